@@ -1,8 +1,13 @@
 import abc
+import asyncio
+import collections
+import copy
 import importlib
 import inspect
 import json
 import os
+import threading
+import weakref
 import nltk
 import logging
 import logging.config
@@ -28,6 +33,9 @@ def get_logger(name):
     return logging.getLogger(name)
 
 
+logger = get_logger(__name__)
+
+
 # Load backend dynamically from "backends" sibling directory
 # Note: The backends might use get_logger (circular import)
 def load_credentials(backend, file_name="key.json") -> Dict:
@@ -134,6 +142,12 @@ class Model(abc.ABC):
         """
         self.__gen_args[arg_name] = arg_value
 
+    def get_gen_args(self) -> Dict:
+        """
+        :return: a copy of all arguments set for the generation process
+        """
+        return dict(self.__gen_args)
+
     def get_gen_arg(self, arg_name):
         assert arg_name in self.__gen_args, f"No '{arg_name}' in gen_args given but is expected"
         return self.__gen_args[arg_name]
@@ -153,6 +167,20 @@ class Model(abc.ABC):
     def get_name(self) -> str:
         return self.model_spec.model_name
 
+    def new_handle(self) -> "Model":
+        """
+        :return: a model that shares everything with this model (e.g. the loaded weights), but the gen args
+        """
+        handle = copy.copy(self)
+        handle.set_gen_args(**self.get_gen_args())
+        return handle
+
+    def memory_footprint(self) -> int:
+        """
+        :return: the bytes of (V)RAM occupied by the loaded model (0 for remote models)
+        """
+        return 0
+
     def __repr__(self):
         return str(self)
 
@@ -191,10 +219,21 @@ class Model(abc.ABC):
         """
         pass
 
+    async def agenerate_response(self, messages: List[Dict]) -> Tuple[Any, Any, str]:
+        """Asynchronous version of generate_response() with the same arguments and return values.
+
+        Remote backends override this with calls to their native async clients. By default, the blocking
+        generate_response() is run in a worker thread, so that local models can be awaited as well.
+        """
+        return await asyncio.to_thread(self.generate_response, messages)
+
 
 class Backend(abc.ABC):
     """ Marker class for a model provider."""
 
+    # whether the models are loaded into local memory; then they are shared via the model pool (see ModelPool)
+    loads_weights: bool = False
+
     @abc.abstractmethod
     def get_model_for(self, model_spec: ModelSpec) -> Model:
         pass
@@ -232,8 +271,79 @@ def is_backend(obj):
     return False
 
 
+class ModelPool:
+    """
+    Keeps the loaded models of local backends by their (unified) model spec, so that their weights are loaded only
+    once, even when several experiments or dialogue pairs use the same model. Each lookup returns a new handle with its
+    own gen args (see Model.new_handle()).
+
+    Before a model is loaded, the least recently used models without handles in use are released, until the expected
+    memory of the loaded models (the memory a model occupied when it was loaded before, if so) fits into the budget.
+    This is repeated after loading, when the actual memory of the model is known.
+    Models with handles in use are never released, because their memory could not be freed anyway.
+    """
+
+    def __init__(self, max_size_mb: float = 0):
+        """
+        :param max_size_mb: the memory budget in megabytes for the loaded models (exceeded only by models in use)
+        """
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self._models = collections.OrderedDict()  # model spec key -> (model, weak references to its handles)
+        self._footprints: Dict[str, int] = dict()  # model spec key -> bytes occupied when it was loaded
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key_for(model_spec: ModelSpec) -> str:
+        return json.dumps(model_spec.__dict__, sort_keys=True, default=str)
+
+    def get(self, model_spec: ModelSpec, backend: Backend) -> Model:
+        """
+        :param model_spec: the unified model spec
+        :param backend: that loads the model, when it is not in the pool
+        :return: a new handle for the loaded model
+        """
+        key = self.key_for(model_spec)
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                logger.info(f"Reusing loaded model: {model_spec.model_name}")
+            else:
+                self._release(required_size=self._footprints.get(key, 0))
+                model = backend.get_model_for(model_spec)
+                self._footprints[key] = model.memory_footprint()
+                self._models[key] = (model, [])
+            model, handles = self._models[key]
+            handle = model.new_handle()
+            handles[:] = [ref for ref in handles if ref() is not None] + [weakref.ref(handle)]
+            self._release(required_size=0)  # now that the footprint of a newly loaded model is known
+            return handle
+
+    def _release(self, required_size: int):
+        used_size = sum(self._footprints[key] for key in self._models)
+        for key in list(self._models):
+            if used_size + required_size <= self.max_size:
+                break
+            model, handles = self._models[key]
+            if any(ref() is not None for ref in handles):
+                continue  # still in use
+            logger.info(f"Releasing loaded model: {model.get_name()}")
+            del self._models[key]
+            used_size -= self._footprints[key]
+
+
 _backend_registry: Dict[str, Backend] = dict()  # we store references to the class constructor
 _model_registry: List[ModelSpec] = list()  # we store model specs so that users might use model_name for lookup
+_model_index: Dict[str, List[int]] = dict()  # model_name -> positions of its entries in the model registry
+_unnamed_model_positions: List[int] = list()  # positions of the entries without model_name
+_loaded_registry_files: Dict[str, Tuple[int, int]] = dict()  # path -> (modification time, size) when loaded
+_model_pool = ModelPool()
+
+
+def configure_model_pool(max_size_mb: float):
+    """
+    :param max_size_mb: the memory budget in megabytes for loaded models that are kept for later use (see ModelPool)
+    """
+    _model_pool.max_size = int(max_size_mb * 1024 * 1024)
 
 
 def load_custom_model_registry(_model_registry_path: str = None, is_optional=True):
@@ -251,16 +361,40 @@ def load_model_registry(_model_registry_path: str = None, is_mandatory=True):
                                     f"Create model registry as a model_registry.json file and try again.")
         else:
             return  # do nothing
+    _model_registry_path = os.path.abspath(_model_registry_path)
+    _stat = os.stat(_model_registry_path)
+    if _loaded_registry_files.get(_model_registry_path) == (_stat.st_mtime_ns, _stat.st_size):
+        return  # already loaded and unchanged
     with open(_model_registry_path, encoding='utf-8') as f:
         _model_listing = json.load(f)
-        for _model_entry in _model_listing:
-            _model_spec: ModelSpec = ModelSpec.from_dict(_model_entry)
-            if not _model_spec.has_backend():
-                raise ValueError(
-                    f"Missing backend definition in model spec '{_model_spec}'. "
-                    f"Check or update the backends/model_registry.json and try again."
-                    f"A minimal model spec is {{'model_id':<id>,'backend':<backend>}}.")
-            _model_registry.append(_model_spec)
+    _model_specs = []
+    for _model_entry in _model_listing:
+        _model_spec: ModelSpec = ModelSpec.from_dict(_model_entry)
+        if not _model_spec.has_backend():
+            raise ValueError(
+                f"Missing backend definition in model spec '{_model_spec}'. "
+                f"Check or update the backends/model_registry.json and try again."
+                f"A minimal model spec is {{'model_id':<id>,'backend':<backend>}}.")
+        _model_specs.append(_model_spec)
+    for _model_spec in _model_specs:  # only register the entries of fully valid registry files
+        if _model_spec.has_attr("model_name"):
+            _model_index.setdefault(_model_spec.model_name, []).append(len(_model_registry))
+        else:
+            _unnamed_model_positions.append(len(_model_registry))
+        _model_registry.append(_model_spec)
+    _loaded_registry_files[_model_registry_path] = (_stat.st_mtime_ns, _stat.st_size)
+
+
+def _registered_specs_for(model_spec: ModelSpec) -> List[ModelSpec]:
+    """
+    :return: the model registry entries that the model spec might unify with (in registry order)
+    """
+    if not model_spec.has_attr("model_name"):
+        return _model_registry
+    positions = _model_index.get(model_spec.model_name, [])
+    if _unnamed_model_positions:
+        positions = sorted(positions + _unnamed_model_positions)
+    return [_model_registry[position] for position in positions]
 
 
 def _register_backend(backend_name: str):
@@ -293,6 +427,8 @@ def _load_model_for(model_spec: ModelSpec) -> Model:
     if backend_name not in _backend_registry:
         _register_backend(backend_name)
     backend_cls = _backend_registry[backend_name]
+    if backend_cls.loads_weights:
+        return _model_pool.get(model_spec, backend_cls)
     return backend_cls.get_model_for(model_spec)
 
 
@@ -313,7 +449,7 @@ def get_model_for(model_spec: Union[str, Dict, ModelSpec]) -> Model:
     if model_spec.is_programmatic():
         return CustomResponseModel(model_spec)
 
-    for registered_spec in _model_registry:
+    for registered_spec in _registered_specs_for(model_spec):
         try:
             model_spec = model_spec.unify(registered_spec)
             break  # use first model spec that does unify (doesn't throw an error)
@@ -1,10 +1,10 @@
 from typing import List, Dict, Tuple, Any
-from retry import retry
 
 import aleph_alpha_client
 import anthropic
 import backends
 from backends import ModelSpec, Model
+from backends.rate_limit import configure_rate_limit, rate_limited
 from backends.utils import ensure_messages_format
 
 logger = backends.get_logger(__name__)
@@ -16,6 +16,7 @@ class AlephAlpha(backends.Backend):
 
     def __init__(self):
         creds = backends.load_credentials(NAME)
+        configure_rate_limit(NAME, creds[NAME].get("rate_limit"))
         self.client = aleph_alpha_client.Client(creds[NAME]["api_key"])
 
     def get_model_for(self, model_spec: ModelSpec) -> Model:
@@ -28,7 +29,7 @@ class AlephAlphaModel(backends.Model):
         super().__init__(model_spec)
         self.client = client
 
-    @retry(tries=3, delay=0, logger=logger)
+    @rate_limited(tries=3)
     @ensure_messages_format
     def generate_response(self, messages: List[Dict]) -> Tuple[Any, Any, str]:
         """
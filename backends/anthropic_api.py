@@ -1,12 +1,11 @@
 from typing import List, Dict, Tuple, Any
-from retry import retry
 import anthropic
+import asyncio
 import backends
 import json
-import base64
-import httpx
-import imghdr
 
+from backends import image_cache
+from backends.rate_limit import configure_rate_limit, rate_limited, arate_limited
 from backends.utils import ensure_messages_format
 
 logger = backends.get_logger(__name__)
@@ -17,26 +16,24 @@ NAME = "anthropic"
 class Anthropic(backends.Backend):
     def __init__(self):
         creds = backends.load_credentials(NAME)
+        configure_rate_limit(NAME, creds[NAME].get("rate_limit"))
         self.client = anthropic.Anthropic(api_key=creds[NAME]["api_key"])
+        self.async_client = anthropic.AsyncAnthropic(api_key=creds[NAME]["api_key"])
 
     def get_model_for(self, model_spec: backends.ModelSpec) -> backends.Model:
-        return AnthropicModel(self.client, model_spec)
+        return AnthropicModel(self.client, model_spec, self.async_client)
 
 
 class AnthropicModel(backends.Model):
-    def __init__(self, client: anthropic.Client, model_spec: backends.ModelSpec):
+    def __init__(self, client: anthropic.Client, model_spec: backends.ModelSpec,
+                 async_client: anthropic.AsyncClient = None):
         super().__init__(model_spec)
         self.client = client
+        self.async_client = async_client
 
     def encode_image(self, image_path):
-        if image_path.startswith('http'):
-            image_bytes = httpx.get(image_path).content
-        else:
-            with open(image_path, "rb") as image_file:
-                image_bytes = image_file.read()
-        image_data = base64.b64encode(image_bytes).decode("utf-8")
-        image_type = imghdr.what(None, image_bytes)
-        return image_data, "image/"+str(image_type)
+        # the images of the history are sent with each call, so the encoded images are cached
+        return image_cache.encode_base64(image_path)
 
     def encode_messages(self, messages):
         encoded_messages = []
@@ -83,7 +80,7 @@ class AnthropicModel(backends.Model):
 
         return encoded_messages, system_message
 
-    @retry(tries=3, delay=0, logger=logger)
+    @rate_limited(tries=3)
     @ensure_messages_format
     def generate_response(self, messages: List[Dict]) -> Tuple[str, Any, str]:
         """
@@ -106,6 +103,31 @@ class AnthropicModel(backends.Model):
             max_tokens=self.get_max_tokens()
         )
 
+        return self._parse_completion(prompt, completion)
+
+    @arate_limited(tries=3)
+    @ensure_messages_format
+    async def agenerate_response(self, messages: List[Dict]) -> Tuple[str, Any, str]:
+        """
+        :param messages: see generate_response
+        :return: the continuation
+        """
+        if self.async_client is None:
+            return await super().agenerate_response(messages)
+        # image encoding reads files or fetches urls, so we keep it off the event loop
+        prompt, system_message = await asyncio.to_thread(self.encode_messages, messages)
+
+        completion = await self.async_client.messages.create(
+            messages=prompt,
+            system=system_message,
+            model=self.model_spec.model_id,
+            temperature=self.get_temperature(),
+            max_tokens=self.get_max_tokens()
+        )
+        return self._parse_completion(prompt, completion)
+
+    @staticmethod
+    def _parse_completion(prompt, completion) -> Tuple[str, Any, str]:
         json_output = completion.model_dump_json()
         response = json.loads(json_output)
         response_text = completion.content[0].text
@@ -0,0 +1,149 @@
+"""
+    Persistent cache for deterministic model responses.
+
+    Responses are stored in a sqlite database and keyed by a hash of the model spec, the generation arguments and the
+    messages. Only calls with temperature 0 are cached, because only these are expected to be reproducible.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Dict, Tuple, Any, Optional
+
+import backends
+
+logger = backends.get_logger(__name__)
+
+DEFAULT_CACHE_PATH = os.path.join(backends.project_root, ".cache", "responses.sqlite")
+DEFAULT_MAX_SIZE_MB = 1024
+
+
+class ResponseCache:
+    """
+    A size-bounded on-disk cache of (prompt, response, response_text) tuples. When the stored responses exceed the
+    maximal size, then the least recently used entries are evicted.
+    """
+
+    def __init__(self, cache_path: str = DEFAULT_CACHE_PATH, max_size_mb: float = DEFAULT_MAX_SIZE_MB):
+        """
+        :param cache_path: of the sqlite database file (created if it does not exist)
+        :param max_size_mb: the maximal size of the stored responses in megabytes
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+        self.cache_path = cache_path
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self._lock = threading.Lock()  # episodes might be played concurrently
+        self._connection = sqlite3.connect(cache_path, check_same_thread=False)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS responses "
+                                 "(key TEXT PRIMARY KEY, value TEXT, size INTEGER, last_access REAL)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses(last_access)")
+        self._connection.commit()
+        self._size = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def is_cacheable(model: backends.Model) -> bool:
+        """ Only deterministic calls should be answered from the cache """
+        try:
+            return model.get_temperature() == 0.0
+        except AssertionError:  # no temperature given
+            return False
+
+    @staticmethod
+    def key_for(model: backends.Model, messages: List[Dict]) -> str:
+        key_obj = {
+            "model_spec": model.model_spec.__dict__,
+            "gen_args": model.get_gen_args(),
+            "messages": messages
+        }
+        key_str = json.dumps(key_obj, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(key_str.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[Any, Any, str]]:
+        with self._lock:
+            row = self._connection.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._connection.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._connection.commit()
+        prompt, response, response_text = json.loads(row[0])
+        return prompt, response, response_text
+
+    def put(self, key: str, value: Tuple[Any, Any, str]):
+        try:
+            value_str = json.dumps(list(value), ensure_ascii=False)
+        except TypeError:  # e.g. raw response objects that are not json serializable
+            logger.warning("Cannot cache response, because it is not json serializable")
+            return
+        size = len(value_str.encode("utf-8"))
+        if size > self.max_size:
+            return
+        with self._lock:
+            row = self._connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._size -= row[0]
+            self._connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                                     (key, value_str, size, time.time()))
+            self._size += size
+            self._evict()
+            self._connection.commit()
+
+    def _evict(self):
+        """ Remove the least recently used entries until the cache fits into the maximal size again """
+        if self._size <= self.max_size:
+            return
+        evict_keys = []
+        rows = self._connection.execute("SELECT key, size FROM responses ORDER BY last_access")
+        for key, size in rows:
+            if self._size <= self.max_size:
+                break
+            evict_keys.append((key,))
+            self._size -= size
+        self._connection.executemany("DELETE FROM responses WHERE key = ?", evict_keys)
+        logger.info("Evicted %d responses from the cache", len(evict_keys))
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+_response_cache: Optional[ResponseCache] = None
+
+
+def enable_response_cache(cache_path: str = DEFAULT_CACHE_PATH, max_size_mb: float = DEFAULT_MAX_SIZE_MB):
+    global _response_cache
+    if _response_cache is not None:
+        _response_cache.close()
+    _response_cache = ResponseCache(cache_path, max_size_mb)
+    logger.info("Response cache enabled at %s", cache_path)
+
+
+def disable_response_cache():
+    global _response_cache
+    if _response_cache is not None:
+        _response_cache.close()
+    _response_cache = None
+
+
+def generate_response(model: backends.Model, messages: List[Dict]) -> Tuple[Any, Any, str, bool]:
+    """
+    Call model.generate_response() or, when the response cache is enabled, answer deterministic calls from the cache.
+    :return: the prompt, response and response text of the call and whether they have been answered from the cache
+    """
+    if _response_cache is None or not ResponseCache.is_cacheable(model):
+        prompt, response, response_text = model.generate_response(messages)
+        return prompt, response, response_text, False
+    key = ResponseCache.key_for(model, messages)
+    cached = _response_cache.get(key)
+    if cached is not None:
+        logger.info("Response for %s found in cache", model.get_name())
+        prompt, response, response_text = cached
+        return prompt, response, response_text, True
+    prompt, response, response_text = model.generate_response(messages)
+    _response_cache.put(key, (prompt, response, response_text))
+    return prompt, response, response_text, False
@@ -1,7 +1,7 @@
 from typing import List, Dict, Tuple, Any
-from retry import retry
 import cohere
 import backends
+from backends.rate_limit import configure_rate_limit, rate_limited, arate_limited
 from backends.utils import ensure_messages_format
 import json
 
@@ -14,19 +14,23 @@ class Cohere(backends.Backend):
 
     def __init__(self):
         creds = backends.load_credentials(NAME)
+        configure_rate_limit(NAME, creds[NAME].get("rate_limit"))
         self.client = cohere.Client(creds[NAME]["api_key"])
+        self.async_client = cohere.AsyncClient(creds[NAME]["api_key"])
 
     def get_model_for(self, model_spec: backends.ModelSpec) -> backends.Model:
-        return CohereModel(self.client, model_spec)
+        return CohereModel(self.client, model_spec, self.async_client)
 
 
 class CohereModel(backends.Model):
 
-    def __init__(self, client: cohere.Client, model_spec: backends.ModelSpec):
+    def __init__(self, client: cohere.Client, model_spec: backends.ModelSpec,
+                 async_client: cohere.AsyncClient = None):
         super().__init__(model_spec)
         self.client = client
+        self.async_client = async_client
 
-    @retry(tries=3, delay=0, logger=logger)
+    @rate_limited(tries=3)
     @ensure_messages_format
     def generate_response(self, messages: List[Dict]) -> Tuple[str, Any, str]:
         """
@@ -39,6 +43,39 @@ class CohereModel(backends.Model):
                 ]
         :return: the continuation
         """
+        message, chat_history = self._to_chat_history(messages)
+
+        output = self.client.chat(
+            message=message,
+            model=self.model_spec.model_id,
+            chat_history=chat_history,
+            temperature=self.get_temperature(),
+            max_tokens = self.get_max_tokens()
+        )
+        return self._parse_output(message, chat_history, output)
+
+    @arate_limited(tries=3)
+    @ensure_messages_format
+    async def agenerate_response(self, messages: List[Dict]) -> Tuple[str, Any, str]:
+        """
+        :param messages: see generate_response
+        :return: the continuation
+        """
+        if self.async_client is None:
+            return await super().agenerate_response(messages)
+        message, chat_history = self._to_chat_history(messages)
+
+        output = await self.async_client.chat(
+            message=message,
+            model=self.model_spec.model_id,
+            chat_history=chat_history,
+            temperature=self.get_temperature(),
+            max_tokens=self.get_max_tokens()
+        )
+        return self._parse_output(message, chat_history, output)
+
+    @staticmethod
+    def _to_chat_history(messages: List[Dict]) -> Tuple[str, List[Dict]]:
         chat_history = []
 
         # all other messages except the last one. It is passed to the API with the variable message.
@@ -52,15 +89,10 @@ class CohereModel(backends.Model):
                 chat_history.append(m)
 
         message = messages[-1]["content"]
+        return message, chat_history
 
-        output = self.client.chat(
-            message=message,
-            model=self.model_spec.model_id,
-            chat_history=chat_history,
-            temperature=self.get_temperature(),
-            max_tokens = self.get_max_tokens()
-        )
-
+    @staticmethod
+    def _parse_output(message: str, chat_history: List[Dict], output) -> Tuple[str, Any, str]:
         response_text = output.text
         prompt = json.dumps({"message": message, "chat_history": chat_history})
 
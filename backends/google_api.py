@@ -1,24 +1,40 @@
 from typing import List, Dict, Tuple, Any
-from retry import retry
 import google.generativeai as genai
 import backends
+from backends import image_cache
+from backends.rate_limit import configure_rate_limit, rate_limited, arate_limited
 from backends.utils import ensure_messages_format
-import os
-import requests
-import uuid
-import tempfile
-import imghdr
-import time
+import asyncio
 
 logger = backends.get_logger(__name__)
 
 NAME = "google"
 
+SAFETY_SETTINGS = [
+    {
+        "category": "HARM_CATEGORY_HARASSMENT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE",
+    },
+    {
+        "category": "HARM_CATEGORY_HATE_SPEECH",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE",
+    },
+    {
+        "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE",
+    },
+    {
+        "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE",
+    },
+]
+
 
 class Google(backends.Backend):
 
     def __init__(self):
         creds = backends.load_credentials(NAME)
+        configure_rate_limit(NAME, creds[NAME].get("rate_limit"))
         genai.configure(api_key=creds[NAME]["api_key"])
 
     def get_model_for(self, model_spec: backends.ModelSpec) -> backends.Model:
@@ -35,28 +51,6 @@ class GoogleModel(backends.Model):
         )
 
 
-    def download_image(self, image_url):
-        # Create a temporary directory
-        temp_dir = tempfile.mkdtemp()
-
-        try:
-            # Send a GET request to the URL
-            response = requests.get(image_url)
-            response.raise_for_status()
-
-            # Generate a unique file name
-            unique_name = str(uuid.uuid4()) + '.jpg'
-            file_path = os.path.join(temp_dir, unique_name)
-
-            # Write the image content to a file
-            with open(file_path, 'wb') as file:
-                file.write(response.content)
-            return file_path
-
-        except requests.RequestException as e:
-            print(f"Failed to download {image_url}: {e}")
-            return None
-
     def upload_file(self, file_path, mime_type):
         """Uploads the given file to Gemini.
 
@@ -69,12 +63,8 @@ class GoogleModel(backends.Model):
         image_parts = []
 
         for image_path in images:
-            if image_path.startswith('http'):
-                image_path = self.download_image(image_path)
-
-            image_type = imghdr.what(image_path)
-            # upload to Gemini server
-            file_url = self.upload_file(image_path, 'image/'+image_type)
+            # upload to Gemini server (only once per image, until the uploaded file expires)
+            file_url = image_cache.upload(image_path, NAME, self.upload_file)
             image_parts.append(file_url)
         return image_parts
 
@@ -110,7 +100,7 @@ class GoogleModel(backends.Model):
             encoded_messages_for_logging.append(m_for_logging)
         return encoded_messages, encoded_messages_for_logging
 
-    @retry(tries=10, delay=120, logger=logger)
+    @rate_limited(tries=10)
     @ensure_messages_format
     def generate_response(self, messages: List[Dict]) -> Tuple[str, Any, str]:
         """
@@ -124,41 +114,43 @@ class GoogleModel(backends.Model):
         :return: the continuation
         """
 
-        generation_config = {
-            "temperature": self.get_temperature(),
-            "max_output_tokens": self.get_max_tokens(),
-            "response_mime_type": "text/plain",
-        }
-
-        safety_settings = [
-            {
-                "category": "HARM_CATEGORY_HARASSMENT",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE",
-            },
-            {
-                "category": "HARM_CATEGORY_HATE_SPEECH",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE",
-            },
-            {
-                "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE",
-            },
-            {
-                "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE",
-            },
-        ]
-
         encoded_messages, encoded_messages_for_logging = self.encode_messages(messages)
 
         response = self.model.generate_content(
             contents=encoded_messages,
-            safety_settings=safety_settings,
-            generation_config=generation_config)
+            safety_settings=SAFETY_SETTINGS,
+            generation_config=self._generation_config())
 
         # print('Putting to sleep for 60 sec')
         # time.sleep(120)
 
+        return self._parse_response(encoded_messages_for_logging, response)
+
+    @arate_limited(tries=10)
+    @ensure_messages_format
+    async def agenerate_response(self, messages: List[Dict]) -> Tuple[str, Any, str]:
+        """
+        :param messages: see generate_response
+        :return: the continuation
+        """
+        # image uploads are blocking, so we keep them off the event loop
+        encoded_messages, encoded_messages_for_logging = await asyncio.to_thread(self.encode_messages, messages)
+
+        response = await self.model.generate_content_async(
+            contents=encoded_messages,
+            safety_settings=SAFETY_SETTINGS,
+            generation_config=self._generation_config())
+
+        return self._parse_response(encoded_messages_for_logging, response)
+
+    def _generation_config(self) -> Dict:
+        return {
+            "temperature": self.get_temperature(),
+            "max_output_tokens": self.get_max_tokens(),
+            "response_mime_type": "text/plain",
+        }
+
+    def _parse_response(self, encoded_messages_for_logging, response) -> Tuple[str, Any, str]:
         response_text = ''
         response_json = {}
         if response.parts:
@@ -2,12 +2,16 @@
     Backend using HuggingFace transformers models.
     Uses HF tokenizers instruct/chat templates for proper input format per model.
 """
-from typing import List, Dict, Tuple, Any, Union
+from typing import List, Dict, Tuple, Any, Union, Optional
+import collections
+import json
+import threading
+import time
 import torch
 import backends
 import re
 
-from transformers import AutoTokenizer, AutoModelForCausalLM, AutoConfig
+from transformers import AutoTokenizer, AutoModelForCausalLM, AutoConfig, DynamicCache
 import copy
 
 from jinja2 import TemplateError
@@ -18,15 +22,36 @@ logger = backends.get_logger(__name__)
 
 FALLBACK_CONTEXT_SIZE = 256
 
+DEFAULT_MAX_BATCH_WAIT = 0.05  # seconds to wait for further prompts to fill up a batch
+DEFAULT_TOKEN_COUNTS_SIZE_MB = 64  # message contents whose token counts are kept (see MessagesTokenCounter)
+
+
+# loaded tokenizers, configs and context sizes by model spec; these are shared by all users of a model spec
+_tokenizer_registry: Dict[str, Tuple[AutoTokenizer, AutoConfig, int]] = dict()
+_tokenizer_registry_lock = threading.Lock()
+
+
+def _tokenizer_key(model_spec: backends.ModelSpec) -> str:
+    return json.dumps(model_spec.__dict__, sort_keys=True, default=str)
+
 
 def load_config_and_tokenizer(model_spec: backends.ModelSpec) -> Union[AutoTokenizer, AutoConfig, int]:
     """
     Load a HuggingFace model's standard config and tokenizer, and get context token limit from config. If the model
     config does not contain the context limit, it is set to 256 as fallback. Does not load the model weights, allowing
     for prototyping on non-GPU systems.
+    The results are cached, so that only the first call for a model spec loads from disk (or the HF hub).
     :param model_spec: The ModelSpec for the model.
     :return: Tokenizer, model config and context token limit (int).
     """
+    key = _tokenizer_key(model_spec)
+    with _tokenizer_registry_lock:
+        if key not in _tokenizer_registry:
+            _tokenizer_registry[key] = _load_config_and_tokenizer(model_spec)
+        return _tokenizer_registry[key]
+
+
+def _load_config_and_tokenizer(model_spec: backends.ModelSpec) -> Union[AutoTokenizer, AutoConfig, int]:
     logger.info(f'Loading huggingface model config and tokenizer: {model_spec.model_name}')
 
     use_api_key = False
@@ -124,6 +149,7 @@ class HuggingfaceLocal(backends.Backend):
     """
     Model/backend handler class for locally-run Huggingface models.
     """
+    loads_weights = True  # models are shared via the model pool
 
     def __init__(self):
         super().__init__()
@@ -157,6 +183,25 @@ class HuggingfaceLocalModel(backends.Model):
 
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
 
+        # optional batching of prompts from concurrently played episodes:
+        self.batch_generator = None
+        if 'max_batch_size' in model_spec and model_spec['max_batch_size'] > 1:
+            max_batch_wait = model_spec['max_batch_wait'] if 'max_batch_wait' in model_spec else DEFAULT_MAX_BATCH_WAIT
+            self.batch_generator = BatchGenerator(self.model, self.tokenizer.pad_token_id,
+                                                  max_batch_size=model_spec['max_batch_size'],
+                                                  max_batch_wait=max_batch_wait)
+
+        # optional reuse of the key/value cache of already processed prompt prefixes (e.g. the previous turns):
+        self.prefix_cache = None
+        if 'prefix_cache_mb' in model_spec and model_spec['prefix_cache_mb'] > 0:
+            if self.batch_generator is not None:
+                logger.info(f"{model_spec.model_name}: prefix_cache_mb is ignored, because batching is enabled")
+            else:
+                self.prefix_cache = PrefixCache(max_size_mb=model_spec['prefix_cache_mb'])
+
+    def memory_footprint(self) -> int:
+        return self.model.get_memory_footprint()
+
     def generate_response(self, messages: List[Dict],
                           return_full_text: bool = False,
                           log_messages: bool = False) -> Tuple[Any, Any, str]:
@@ -182,12 +227,11 @@ class HuggingfaceLocalModel(backends.Model):
         if log_messages:
             logger.info(f"Flattened messages: {current_messages}")
 
-        # apply chat template & tokenize:
-        prompt_tokens = self.tokenizer.apply_chat_template(current_messages, add_generation_prompt=True,
-                                                           return_tensors="pt")
+        # apply chat template & tokenize (like apply_chat_template(tokenize=True), but keeping the prompt text):
+        prompt_text = self.tokenizer.apply_chat_template(current_messages, add_generation_prompt=True, tokenize=False)
+        prompt_tokens = self.tokenizer(prompt_text, add_special_tokens=False, return_tensors="pt").input_ids
         prompt_tokens = prompt_tokens.to(self.device)
 
-        prompt_text = self.tokenizer.batch_decode(prompt_tokens)[0]
         prompt = {"inputs": prompt_text, "max_new_tokens": self.get_max_tokens(),
                   "temperature": self.get_temperature(), "return_full_text": return_full_text}
 
@@ -207,30 +251,42 @@ class HuggingfaceLocalModel(backends.Model):
         if self.get_temperature() > 0.0:
             do_sample = True
 
+        gen_kwargs = dict(max_new_tokens=self.get_max_tokens(), do_sample=do_sample)
         if do_sample:
-            model_output_ids = self.model.generate(
-                prompt_tokens,
-                temperature=self.get_temperature(),
-                max_new_tokens=self.get_max_tokens(),
-                do_sample=do_sample
-            )
+            gen_kwargs['temperature'] = self.get_temperature()
+
+        if self.batch_generator is not None:
+            model_output_ids = self.batch_generator.generate(prompt_tokens[0], gen_kwargs)
+        elif self.prefix_cache is not None:
+            # only the prompt suffix that is not covered by a cached prefix needs to be processed (prefill)
+            past_key_values = self.prefix_cache.lookup(prompt_tokens[0])
+            model_output = self.model.generate(prompt_tokens, past_key_values=past_key_values,
+                                               return_dict_in_generate=True, **gen_kwargs)
+            model_output_ids = model_output.sequences
+            self.prefix_cache.store(model_output_ids[0], model_output.past_key_values)
         else:
-            model_output_ids = self.model.generate(
-                prompt_tokens,
-                max_new_tokens=self.get_max_tokens(),
-                do_sample=do_sample
-            )
+            model_output_ids = self.model.generate(prompt_tokens, **gen_kwargs)
 
-        model_output = self.tokenizer.batch_decode(model_output_ids)[0]
+        if 'output_split_prefix' in self.model_spec:
+            # some tokenizers decode the prompt differently than they encode it, so we split the full output text
+            model_output = self.tokenizer.batch_decode(model_output_ids)[0]
+            response = {'response': model_output}
+            if not return_full_text:
+                response_text = model_output.rsplit(self.model_spec['output_split_prefix'], maxsplit=1)[1]
+                response_text = re.sub(self.model_spec['eos_to_cull'], "", response_text)
+            else:
+                response_text = model_output.strip()
+            return prompt, response, response_text
+
+        # cull input context by only decoding the generated tokens:
+        new_tokens = model_output_ids[0][prompt_tokens.shape[1]:]
+        generated_text = self.tokenizer.decode(new_tokens)
+        model_output = prompt_text + generated_text
 
         response = {'response': model_output}
 
-        # cull input context; equivalent to transformers.pipeline method:
         if not return_full_text:
-            response_text = model_output.replace(prompt_text, '').strip()
-
-            if 'output_split_prefix' in self.model_spec:
-                response_text = model_output.rsplit(self.model_spec['output_split_prefix'], maxsplit=1)[1]
+            response_text = generated_text.strip()
 
             # remove eos token string:
             eos_to_cull = self.model_spec['eos_to_cull']
@@ -241,6 +297,191 @@ class HuggingfaceLocalModel(backends.Model):
         return prompt, response, response_text
 
 
+def _cache_size_bytes(past_key_values: DynamicCache) -> int:
+    if hasattr(past_key_values, "layers"):  # newer transformers versions
+        tensors = [t for layer in past_key_values.layers for t in (layer.keys, layer.values) if t is not None]
+    else:
+        tensors = past_key_values.key_cache + past_key_values.value_cache
+    return sum(t.nelement() * t.element_size() for t in tensors)
+
+
+class PrefixCache:
+    """
+    Keeps the key/value caches of processed token sequences, so that generation for a prompt that starts with an
+    already processed sequence only needs to process the remaining tokens. This is the case for the growing message
+    histories of multi-turn games (same episode) and for shared instructions (other episodes of the same experiment).
+
+    A lookup returns a copy of the cache cropped to the longest common prefix with the prompt. When the stored caches
+    exceed the maximal size, then the least recently used ones are evicted.
+    """
+
+    def __init__(self, max_size_mb: float):
+        """
+        :param max_size_mb: the maximal memory (RAM or VRAM) in megabytes to use for stored key/value caches
+        """
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self._entries = collections.OrderedDict()  # token ids tuple -> (past_key_values, size in bytes)
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def lookup(self, prompt_tokens: torch.Tensor) -> Optional[DynamicCache]:
+        """
+        :param prompt_tokens: the 1-dimensional prompt token ids
+        :return: a copy of the key/value cache for the longest cached prefix of the prompt or None
+        """
+        prompt_ids = prompt_tokens.tolist()
+        best_key, best_length = None, 0
+        with self._lock:
+            for key in self._entries:
+                prefix_length = _common_prefix_length(key, prompt_ids)
+                if prefix_length > best_length:
+                    best_key, best_length = key, prefix_length
+            if best_key is None:
+                return None
+            self._entries.move_to_end(best_key)
+            cached_key_values = self._entries[best_key][0]
+        # stored caches are never modified in place, so they can be copied without blocking other threads
+        past_key_values = copy.deepcopy(cached_key_values)
+        # at least the last prompt token must be processed to get the logits for the first new token
+        past_key_values.crop(min(best_length, len(prompt_ids) - 1))
+        logger.info(f"Reusing cached prefix of {past_key_values.get_seq_length()}/{len(prompt_ids)} prompt tokens")
+        return past_key_values
+
+    def store(self, token_ids: torch.Tensor, past_key_values: DynamicCache):
+        """
+        :param token_ids: the 1-dimensional token ids of the processed sequence (prompt and generated tokens)
+        :param past_key_values: the key/value cache for (the beginning of) the sequence as returned by generate()
+        """
+        if not isinstance(past_key_values, DynamicCache):
+            return
+        key = tuple(token_ids.tolist()[:past_key_values.get_seq_length()])
+        size = _cache_size_bytes(past_key_values)
+        if size > self.max_size:
+            return
+        with self._lock:
+            # the new sequence continues cached ones, so that these are no longer needed
+            for cached_key in [k for k in self._entries if k == key[:len(k)]]:
+                self._size -= self._entries.pop(cached_key)[1]
+            self._entries[key] = (past_key_values, size)
+            self._size += size
+            while self._size > self.max_size:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+
+
+def _common_prefix_length(a, b) -> int:
+    length = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        length += 1
+    return length
+
+
+class _BatchRequest:
+
+    def __init__(self, prompt_tokens: torch.Tensor, gen_kwargs: Dict):
+        self.prompt_tokens = prompt_tokens
+        self.gen_kwargs = gen_kwargs
+        self.gen_key = tuple(sorted(gen_kwargs.items()))  # only requests with the same gen args share a batch
+        self.deadline = time.monotonic()
+        self.output_tokens = None
+        self.error = None
+        self.done = False
+
+
+class BatchGenerator:
+    """
+    Collects prompts from concurrently calling threads (e.g. episodes played by multiple workers) and generates their
+    continuations with a single (left-padded) generate() call per batch.
+
+    There is no background thread: The caller of the oldest pending prompt becomes the leader of the next batch.
+    It waits until either the batch is full or max_batch_wait has passed, then generates for the whole batch
+    and hands the outputs to the other callers.
+    """
+
+    def __init__(self, model, pad_token_id: int, max_batch_size: int, max_batch_wait: float = DEFAULT_MAX_BATCH_WAIT):
+        """
+        :param model: the transformers model to call generate() on
+        :param pad_token_id: used to left-pad the prompts of a batch
+        :param max_batch_size: the maximal number of prompts per generate() call
+        :param max_batch_wait: the maximal seconds to wait for further prompts before a batch is generated
+        """
+        self.model = model
+        self.pad_token_id = pad_token_id
+        self.max_batch_size = max_batch_size
+        self.max_batch_wait = max_batch_wait
+        eos_token_id = model.generation_config.eos_token_id
+        self.eos_token_ids = set(eos_token_id if isinstance(eos_token_id, list) else [eos_token_id])
+        self._condition = threading.Condition()
+        self._pending: List[_BatchRequest] = []
+        self._is_generating = False
+
+    def generate(self, prompt_tokens: torch.Tensor, gen_kwargs: Dict) -> torch.Tensor:
+        """
+        :param prompt_tokens: the 1-dimensional prompt token ids
+        :param gen_kwargs: the arguments to pass to generate(), e.g. max_new_tokens
+        :return: the prompt and generated token ids with shape (1, length) like generate() with a single prompt
+        """
+        request = _BatchRequest(prompt_tokens, gen_kwargs)
+        request.deadline += self.max_batch_wait
+        with self._condition:
+            self._pending.append(request)
+            self._condition.notify_all()
+            batch = None
+            while not request.done:
+                if self._is_generating or not self._pending or self._pending[0] is not request:
+                    self._condition.wait()
+                    continue
+                batch = [r for r in self._pending if r.gen_key == request.gen_key][:self.max_batch_size]
+                time_left = request.deadline - time.monotonic()
+                if len(batch) < self.max_batch_size and time_left > 0:
+                    self._condition.wait(time_left)
+                    continue
+                for r in batch:
+                    self._pending.remove(r)
+                self._is_generating = True
+                break
+        if batch is not None:  # this caller leads the batch
+            try:
+                for r, output_tokens in zip(batch, self._generate_batch(batch)):
+                    r.output_tokens = output_tokens
+            except Exception as e:
+                for r in batch:
+                    r.error = e
+            finally:
+                with self._condition:
+                    for r in batch:
+                        r.done = True
+                    self._is_generating = False
+                    self._condition.notify_all()
+        if request.error is not None:
+            raise request.error
+        return request.output_tokens
+
+    def _generate_batch(self, batch: List[_BatchRequest]) -> List[torch.Tensor]:
+        prompt_lengths = [len(r.prompt_tokens) for r in batch]
+        max_length = max(prompt_lengths)
+        device = batch[0].prompt_tokens.device
+        input_ids = torch.full((len(batch), max_length), self.pad_token_id, dtype=torch.long, device=device)
+        attention_mask = torch.zeros((len(batch), max_length), dtype=torch.long, device=device)
+        for idx, r in enumerate(batch):  # left padding
+            input_ids[idx, max_length - prompt_lengths[idx]:] = r.prompt_tokens
+            attention_mask[idx, max_length - prompt_lengths[idx]:] = 1
+        logger.info(f"Generating for a batch of {len(batch)} prompts")
+        batch_output_ids = self.model.generate(input_ids, attention_mask=attention_mask, **batch[0].gen_kwargs)
+        outputs = []
+        for idx, r in enumerate(batch):
+            new_tokens = batch_output_ids[idx, max_length:]
+            # cut off the padding after the first eos token (shorter outputs are padded to the longest one)
+            for token_idx, token_id in enumerate(new_tokens.tolist()):
+                if token_id in self.eos_token_ids:
+                    new_tokens = new_tokens[:token_idx + 1]
+                    break
+            outputs.append(torch.cat([r.prompt_tokens, new_tokens]).unsqueeze(0))
+        return outputs
+
+
 def _check_context_limit(context_size, prompt_tokens, max_new_tokens: int = 100) -> Tuple[bool, int, int, int]:
     """
     Internal context limit check to run in generate_response.
@@ -259,6 +500,98 @@ def _check_context_limit(context_size, prompt_tokens, max_new_tokens: int = 100)
     return fits, tokens_used, tokens_left, context_size
 
 
+class MessagesTokenCounter:
+    """
+    Counts the prompt tokens of message lists incrementally: The tokens of each message content are counted only once
+    and the tokens added by the chat template are counted once per sequence of roles. Adding a message to a history
+    thus only requires to tokenize the new message.
+
+    The count might differ by a few tokens from the tokenized prompt, because tokens can merge at the boundaries of
+    template and message content. Use it as a fast precheck; generate_response() checks the exact prompt tokens.
+
+    When the counted message contents exceed the maximal size, then the least recently used ones are evicted.
+    """
+
+    def __init__(self, tokenizer: AutoTokenizer, max_size_mb: float = DEFAULT_TOKEN_COUNTS_SIZE_MB):
+        """
+        :param tokenizer: to count the tokens with
+        :param max_size_mb: the maximal size of the message contents whose token counts are kept in megabytes
+        """
+        self.tokenizer = tokenizer
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self._content_counts = collections.OrderedDict()  # message content -> token count
+        self._size = 0  # characters of the kept message contents
+        self._template_counts: Dict[Tuple[str, ...], int] = dict()
+        self._lock = threading.Lock()
+
+    def count(self, messages: List[Dict]) -> int:
+        """
+        :param messages: to count the prompt tokens for (including the chat template and generation prompt)
+        :return: the (approximate) number of prompt tokens
+        """
+        with self._lock:
+            roles = tuple(message['role'] for message in messages)
+            if roles not in self._template_counts:
+                empty_messages = [{'role': role, 'content': ""} for role in roles]
+                template_tokens = self.tokenizer.apply_chat_template(empty_messages, add_generation_prompt=True,
+                                                                     return_dict=False)
+                self._template_counts[roles] = len(template_tokens)
+            tokens = self._template_counts[roles]
+            for message in messages:
+                tokens += self._content_count(message['content'])
+            return tokens
+
+    def _content_count(self, content: str) -> int:
+        if content in self._content_counts:
+            self._content_counts.move_to_end(content)
+            return self._content_counts[content]
+        content_count = len(self.tokenizer(content, add_special_tokens=False).input_ids)
+        self._content_counts[content] = content_count
+        self._size += len(content)
+        while self._size > self.max_size:
+            evicted_content, _ = self._content_counts.popitem(last=False)
+            self._size -= len(evicted_content)
+        return content_count
+
+
+_token_counters: Dict[str, MessagesTokenCounter] = dict()
+
+
+def fast_check_context_limit(messages: List[Dict], model_spec: backends.ModelSpec,
+                             max_new_tokens: int = 100, clean_messages: bool = True) -> Tuple[bool, int, int, int]:
+    """
+    Fast context limit precheck for clemgames: Uses the cached tokenizer of the model and only tokenizes messages that
+    have not been counted before. The token count is approximate (see MessagesTokenCounter).
+    :param messages: for example
+            [
+                {"role": "user", "content": "What is your favourite condiment?"},
+                {"role": "assistant", "content": "Lard!"},
+                {"role": "user", "content": "Do you have mayonnaise recipes?"}
+            ]
+    :param model_spec: The ModelSpec for the model.
+    :param max_new_tokens: How many tokens to generate ('at most', but no stop sequence is defined).
+    :param clean_messages: If True, the standard cleaning method for message lists will be applied (as in generation).
+    :return: Tuple with
+            Bool: True if context limit is not exceeded, False if too many tokens
+            Number of tokens for the given messages and maximum new tokens
+            Number of tokens of 'context space left'
+            Total context token limit
+    """
+    tokenizer, _, context_size = load_config_and_tokenizer(model_spec)
+    key = _tokenizer_key(model_spec)
+    with _tokenizer_registry_lock:
+        if key not in _token_counters:
+            _token_counters[key] = MessagesTokenCounter(tokenizer)
+        token_counter = _token_counters[key]
+    if clean_messages:
+        messages = ensure_alternating_roles(messages)
+    prompt_size = token_counter.count(messages)
+    tokens_used = prompt_size + max_new_tokens  # context includes tokens to be generated
+    tokens_left = context_size - tokens_used
+    fits = tokens_used <= context_size
+    return fits, tokens_used, tokens_left, context_size
+
+
 def check_messages(messages: List[Dict], model_spec: backends.ModelSpec) -> bool:
     """
     Message checking for clemgame development. This checks if the model's chat template accepts the given messages
@@ -1,12 +1,16 @@
 """
 Backend using HuggingFace transformers for open-weight multimodal models.
 """
-from typing import List, Dict, Tuple, Any
+from typing import List, Dict, Tuple, Any, Optional
+from functools import lru_cache
+import collections
+import os
+import threading
 import torch
 import backends
 from PIL import Image
 import requests
-from transformers import AutoProcessor, AutoModelForVision2Seq, IdeficsForVisionText2Text, AutoConfig
+from transformers import AutoProcessor, AutoModelForVision2Seq, IdeficsForVisionText2Text, AutoConfig, BatchFeature
 from jinja2 import Template
 
 # Define a map to load model from transformers Auto Classes
@@ -18,6 +22,9 @@ MODEL_TYPE_MAP = {
 
 FALLBACK_CONTEXT_SIZE = 256
 
+IMAGE_CACHE_SIZE = 64  # decoded images; the images of the history are loaded again for each turn
+DEFAULT_PIXEL_CACHE_MB = 256  # preprocessed pixel values of single images
+
 logger = backends.get_logger(__name__)
 
 def get_context_limit(model_spec: backends.ModelSpec) -> int:
@@ -106,14 +113,31 @@ def load_model(model_spec: backends.ModelSpec):
     return model
 
 
+def image_key(image: str) -> Tuple[str, Optional[int]]:
+    """
+    Images are identified by their URL or by their local path and modification time
+
+    :param image: Image path/url
+    :return key: (path/url, modification time or None for URLs)
+    """
+    if image.startswith('http'):
+        return image, None
+    return image, os.stat(image).st_mtime_ns
+
+
 def load_image(image: str):
     """
-    Load an image based on a given local path or URL
+    Load an image based on a given local path or URL. Recently loaded images are returned from a cache
+    (so the returned images must not be modified).
 
     :param image: Image path/url
     :return loaded_image: PIL Image
     """
+    return _load_image(*image_key(image))
+
 
+@lru_cache(maxsize=IMAGE_CACHE_SIZE)
+def _load_image(image: str, modified: Optional[int]):
     if image.startswith('http') or image.startswith('https'):
         image = Image.open(requests.get(image, stream=True).raw).convert('RGB')
     else:
@@ -122,12 +146,12 @@ def load_image(image: str):
     return image
 
 
-def get_images(messages: list[Dict]) -> list:
+def collect_images(messages: list[Dict]) -> list:
     """
-    Return loaded images from messages
+    Return the images mentioned in messages
 
     :param messages: A list of messages passed to the model
-    :return images: A list of PIL Image objects.
+    :return images: A list of image paths/urls
     """
     # Collect image links/file locations mentioned in messages
     images = []
@@ -138,6 +162,17 @@ def get_images(messages: list[Dict]) -> list:
                     images.append(img)
             else:
                 images.append(message['image'])
+    return images
+
+
+def get_images(messages: list[Dict]) -> list:
+    """
+    Return loaded images from messages
+
+    :param messages: A list of messages passed to the model
+    :return images: A list of PIL Image objects.
+    """
+    images = collect_images(messages)
 
     # Return None if no image is passed
     # Use AutoTokenizer to generate output and not AutoProcessor, as only text is passed.
@@ -153,6 +188,48 @@ def get_images(messages: list[Dict]) -> list:
     return loaded_images
 
 
+class PixelCache:
+    """
+    Keeps the preprocessed pixel values (the image processor outputs) of single images, so that the images of the
+    history (and those recurring in other episodes) are not processed again for each turn.
+
+    When the stored values exceed the maximal size, then the least recently used ones are evicted.
+    """
+
+    def __init__(self, max_size_mb: float):
+        """
+        :param max_size_mb: the maximal memory in megabytes to use for stored pixel values
+        """
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self._entries = collections.OrderedDict()  # image key -> (image processor outputs, size in bytes)
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple) -> Optional[Dict[str, torch.Tensor]]:
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def put(self, key: Tuple, image_inputs: Dict[str, torch.Tensor]):
+        size = sum(value.element_size() * value.nelement() for value in image_inputs.values())
+        if size > self.max_size:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._entries.pop(key)[1]
+            self._entries[key] = (image_inputs, size)
+            self._size += size
+            while self._size > self.max_size:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+
+
+def same_inputs(inputs: Dict[str, torch.Tensor], other: Dict[str, torch.Tensor]) -> bool:
+    return inputs.keys() == other.keys() and all(torch.equal(inputs[name], other[name]) for name in inputs)
+
+
 # Separate Input and Output generation for Idefics
 # Input is required for context check
 def generate_idefics_input(messages: list[Dict]):
@@ -234,6 +311,8 @@ def check_multiple_image(messages: List[Dict]):
 
 
 class HuggingfaceMultimodal(backends.Backend):
+    loads_weights = True  # models are shared via the model pool
+
     def __init__(self):
         super().__init__()
 
@@ -264,6 +343,63 @@ class HuggingfaceMultimodalModel(backends.Model):
         self.padding = model_spec_dict.get('padding', False)
         self.idefics = 'idefics' in model_spec['model_name']
 
+        pixel_cache_mb = model_spec_dict.get('pixel_cache_mb', DEFAULT_PIXEL_CACHE_MB)
+        self.pixel_cache = PixelCache(max_size_mb=pixel_cache_mb) if pixel_cache_mb > 0 else None
+        # whether the processor inputs equal the tokenizer inputs plus the (cached) image processor inputs
+        # None: not checked yet (see get_image_inputs)
+        self.combines_inputs = None
+
+    def get_cached_image_inputs(self, prompt_text: str, images: List[str]) -> BatchFeature:
+        """
+        Return the processor inputs for the prompt and images, but with the image processor outputs of each image
+        taken from the pixel cache (when possible)
+
+        :param prompt_text: The prompt rendered by the chat template
+        :param images: A list of image paths/urls
+        """
+        image_inputs = []
+        for image in images:
+            key = image_key(image)
+            cached_inputs = self.pixel_cache.get(key)
+            if cached_inputs is None:
+                cached_inputs = dict(self.processor.image_processor([load_image(image)], return_tensors="pt"))
+                self.pixel_cache.put(key, cached_inputs)
+            image_inputs.append(cached_inputs)
+        inputs = dict(self.processor.tokenizer(prompt_text, return_tensors="pt"))
+        for name in image_inputs[0]:
+            inputs[name] = torch.cat([cached_inputs[name] for cached_inputs in image_inputs])
+        return BatchFeature(inputs)
+
+    def get_image_inputs(self, prompt_text: str, images: List[str]) -> BatchFeature:
+        """
+        Return the processor inputs for the prompt and images. The image processor outputs are cached per image,
+        when the processor simply combines the tokenizer and image processor outputs. This is checked against the
+        processor with the first images that can be stacked. Otherwise (or when the images of a prompt cannot be
+        stacked, e.g. because of different sizes) the processor processes all images of each prompt.
+
+        :param prompt_text: The prompt rendered by the chat template
+        :param images: A list of image paths/urls
+        """
+        inputs = None
+        if self.pixel_cache is not None and self.combines_inputs is not False:
+            try:
+                inputs = self.get_cached_image_inputs(prompt_text, images)
+            except Exception as e:
+                logger.info(f"Cannot combine the cached image inputs for model {self.model_name}: {e}")
+        if inputs is None or self.combines_inputs is None:
+            processor_inputs = self.processor(prompt_text, images=[load_image(image) for image in images],
+                                              return_tensors="pt")
+            if self.combines_inputs is None and inputs is not None:  # first check with both inputs
+                self.combines_inputs = same_inputs(inputs, processor_inputs)
+                if not self.combines_inputs:
+                    logger.info(f"Image inputs for model {self.model_name} are not cached: "
+                                f"The processor does not only combine the tokenizer and image processor outputs")
+            inputs = processor_inputs
+        return inputs.to(self.device)
+
+    def memory_footprint(self) -> int:
+        return self.multimodal_model.get_memory_footprint()
+
     def generate_response(self, messages: List[Dict]) -> Tuple[Any, Any, str]:
         """
         :param messages: for example
@@ -305,7 +441,7 @@ class HuggingfaceMultimodalModel(backends.Model):
                                                 context_size=context_check[3])
 
         # Get a list of images [as input to the Processor]
-        images = get_images(messages)
+        images = collect_images(messages)
 
         # Generate the output
         if self.idefics:
@@ -319,7 +455,7 @@ class HuggingfaceMultimodalModel(backends.Model):
             if not images:  # If no images are present in the history + current utterance, use tokenizer to get inputs
                 inputs = self.processor.tokenizer(prompt_text, return_tensors="pt").to(self.device)
             else:
-                inputs = self.processor(prompt_text, images=images, return_tensors="pt").to(self.device)
+                inputs = self.get_image_inputs(prompt_text, images)
             model_output = self.multimodal_model.generate(**inputs, max_new_tokens=self.get_max_tokens())
             generated_text = self.processor.batch_decode(model_output, skip_special_tokens=True)
 
@@ -0,0 +1,165 @@
+"""
+    Process-wide cache for the images sent to remote backends.
+
+    Multimodal games send the images of the whole history again with each turn. The cache keeps the base64 encoded
+    payloads and the handles of files uploaded to a provider, both keyed by a hash of the image content, so that each
+    image is only read (or downloaded), encoded and uploaded once. Uploaded files expire on the provider side, so their
+    handles are only reused for a limited time.
+"""
+import base64
+import collections
+import hashlib
+import imghdr
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, Tuple, Any, Callable, Optional
+
+import requests
+
+import backends
+
+logger = backends.get_logger(__name__)
+
+DEFAULT_MAX_SIZE_MB = 256  # base64 payloads
+DEFAULT_UPLOAD_TTL = 47 * 60 * 60  # seconds; e.g. files uploaded to Gemini are deleted after 48 hours
+
+
+class ImageCache:
+    """
+    Images are identified by their URL or by their local path, modification time and size. These are mapped to the hash
+    of the image content, which keys the base64 payloads and uploaded file handles. When the stored payloads exceed the
+    maximal size, then the least recently used ones are evicted.
+    """
+
+    def __init__(self, max_size_mb: float = DEFAULT_MAX_SIZE_MB, upload_ttl: float = DEFAULT_UPLOAD_TTL):
+        """
+        :param max_size_mb: the maximal size of the stored base64 payloads in megabytes
+        :param upload_ttl: the seconds after which an uploaded file is uploaded again
+        """
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.upload_ttl = upload_ttl
+        self._digests: Dict[Tuple, str] = dict()  # image source -> content hash
+        self._payloads = collections.OrderedDict()  # content hash -> (base64 data, media type)
+        self._size = 0
+        self._uploads: Dict[Tuple[str, str], Tuple[Any, float]] = dict()  # (provider, hash) -> (handle, expires at)
+        self._upload_dir = None
+        self._lock = threading.Lock()  # episodes might be played concurrently
+
+    @staticmethod
+    def _source_key(image: str) -> Tuple:
+        if image.startswith('http'):
+            return image,
+        stat = os.stat(image)
+        return image, stat.st_mtime_ns, stat.st_size
+
+    @staticmethod
+    def read(image: str) -> bytes:
+        """
+        :param image: path or url
+        :return: the image content
+        """
+        if image.startswith('http'):
+            response = requests.get(image)
+            response.raise_for_status()
+            return response.content
+        with open(image, "rb") as image_file:
+            return image_file.read()
+
+    @staticmethod
+    def media_type(image_bytes: bytes) -> str:
+        return "image/" + str(imghdr.what(None, image_bytes))
+
+    def _content(self, image: str) -> Tuple[str, Optional[bytes]]:
+        """
+        :return: the content hash and, if the image had to be read for this, the image content
+        """
+        source_key = self._source_key(image)
+        with self._lock:
+            digest = self._digests.get(source_key)
+        if digest is not None:
+            return digest, None
+        image_bytes = self.read(image)
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        with self._lock:
+            self._digests[source_key] = digest
+        return digest, image_bytes
+
+    def encode_base64(self, image: str) -> Tuple[str, str]:
+        """
+        :param image: path or url
+        :return: the base64 encoded image content and its media type (e.g. image/png)
+        """
+        digest, image_bytes = self._content(image)
+        with self._lock:
+            if digest in self._payloads:
+                self._payloads.move_to_end(digest)
+                return self._payloads[digest]
+        if image_bytes is None:  # the payload has been evicted
+            image_bytes = self.read(image)
+        payload = base64.b64encode(image_bytes).decode("utf-8"), self.media_type(image_bytes)
+        size = len(payload[0])
+        if size > self.max_size:
+            return payload
+        with self._lock:
+            if digest not in self._payloads:
+                self._payloads[digest] = payload
+                self._size += size
+                while self._size > self.max_size:
+                    _, (evicted_data, _) = self._payloads.popitem(last=False)
+                    self._size -= len(evicted_data)
+        return payload
+
+    def upload(self, image: str, provider: str, upload_file: Callable[[str, str], Any]) -> Any:
+        """
+        :param image: path or url
+        :param provider: the name of the backend that the file is uploaded to
+        :param upload_file: uploads a local file given its path and media type and returns the file handle
+        :return: the handle of the uploaded image (reused until the upload ttl has passed)
+        """
+        digest, image_bytes = self._content(image)
+        with self._lock:
+            if (provider, digest) in self._uploads:
+                handle, expires_at = self._uploads[(provider, digest)]
+                if time.time() < expires_at:
+                    return handle
+        if image_bytes is None:
+            image_bytes = self.read(image)
+        file_path = image
+        if image.startswith('http'):  # upload from a local copy
+            file_path = self._store_upload_file(digest, image_bytes)
+        handle = upload_file(file_path, self.media_type(image_bytes))
+        with self._lock:
+            self._uploads[(provider, digest)] = (handle, time.time() + self.upload_ttl)
+        return handle
+
+    def _store_upload_file(self, digest: str, image_bytes: bytes) -> str:
+        with self._lock:
+            if self._upload_dir is None:
+                self._upload_dir = tempfile.mkdtemp()
+        file_path = os.path.join(self._upload_dir, digest)
+        with open(file_path, "wb") as f:
+            f.write(image_bytes)
+        return file_path
+
+
+_image_cache = ImageCache()
+
+
+def encode_base64(image: str) -> Tuple[str, str]:
+    """
+    :param image: path or url
+    :return: the base64 encoded image content and its media type (from the process-wide image cache)
+    """
+    return _image_cache.encode_base64(image)
+
+
+def upload(image: str, provider: str, upload_file: Callable[[str, str], Any]) -> Any:
+    """
+    :param image: path or url
+    :param provider: the name of the backend that the file is uploaded to
+    :param upload_file: uploads a local file given its path and media type and returns the file handle
+    :return: the handle of the uploaded image (from the process-wide image cache)
+    """
+    return _image_cache.upload(image, provider, upload_file)
@@ -2,6 +2,7 @@
     Backend using llama.cpp for GGUF/GGML models.
 """
 
+import os
 from typing import List, Dict, Tuple, Any
 
 import backends
@@ -119,6 +120,8 @@ class LlamaCPPLocal(backends.Backend):
     """
     Model/backend handler class for locally-run GGUF/GGML models.
     """
+    loads_weights = True  # models are shared via the model pool
+
     def __init__(self):
         super().__init__()
 
@@ -154,6 +157,14 @@ class LlamaCPPLocalModel(backends.Model):
         # get context size from model instance:
         self.context_size = self.model._n_ctx
 
+        # llama.cpp already reuses the prefix shared with the last processed prompt; the optional state cache keeps
+        # the states of further prompts, e.g. for shared instructions across episodes:
+        if hasattr(model_spec, 'prefix_cache_mb') and model_spec.prefix_cache_mb > 0:
+            self.model.set_cache(llama_cpp.LlamaRAMCache(capacity_bytes=int(model_spec.prefix_cache_mb * 1024 * 1024)))
+
+    def memory_footprint(self) -> int:
+        return os.path.getsize(self.model.model_path)
+
     def generate_response(self, messages: List[Dict], return_full_text: bool = False) -> Tuple[Any, Any, str]:
         """
         :param messages: for example
@@ -1,9 +1,10 @@
 from mistralai.client import MistralClient
+from mistralai.async_client import MistralAsyncClient
 from mistralai.models.chat_completion import ChatMessage
 from typing import List, Dict, Tuple, Any
-from retry import retry
 import json
 import backends
+from backends.rate_limit import configure_rate_limit, rate_limited, arate_limited
 from backends.utils import ensure_messages_format
 
 logger = backends.get_logger(__name__)
@@ -15,7 +16,9 @@ class Mistral(backends.Backend):
 
     def __init__(self):
         creds = backends.load_credentials(NAME)
+        configure_rate_limit(NAME, creds[NAME].get("rate_limit"))
         self.client = MistralClient(api_key=creds[NAME]["api_key"])
+        self.async_client = MistralAsyncClient(api_key=creds[NAME]["api_key"])
 
     def list_models(self):
         models = self.client.models.list()
@@ -24,16 +27,18 @@ class Mistral(backends.Backend):
         return names
 
     def get_model_for(self, model_spec: backends.ModelSpec) -> backends.Model:
-        return MistralModel(self.client, model_spec)
+        return MistralModel(self.client, model_spec, self.async_client)
 
 
 class MistralModel(backends.Model):
 
-    def __init__(self, client: MistralClient, model_spec: backends.ModelSpec):
+    def __init__(self, client: MistralClient, model_spec: backends.ModelSpec,
+                 async_client: MistralAsyncClient = None):
         super().__init__(model_spec)
         self.client = client
+        self.async_client = async_client
 
-    @retry(tries=3, delay=0, logger=logger)
+    @rate_limited(tries=3)
     @ensure_messages_format
     def generate_response(self, messages: List[Dict]) -> Tuple[str, Any, str]:
         """
@@ -47,13 +52,38 @@ class MistralModel(backends.Model):
         :return: the continuation
         """
 
-        prompt = []
-        for m in messages:
-            prompt.append(ChatMessage(role=m['role'], content=m['content']))
+        prompt = self._to_chat_messages(messages)
         api_response = self.client.chat(model=self.model_spec.model_id,
                                         messages=prompt,
                                         temperature=self.get_temperature(),
                                         max_tokens=self.get_max_tokens())
+        return self._parse_api_response(messages, api_response)
+
+    @arate_limited(tries=3)
+    @ensure_messages_format
+    async def agenerate_response(self, messages: List[Dict]) -> Tuple[str, Any, str]:
+        """
+        :param messages: see generate_response
+        :return: the continuation
+        """
+        if self.async_client is None:
+            return await super().agenerate_response(messages)
+        prompt = self._to_chat_messages(messages)
+        api_response = await self.async_client.chat(model=self.model_spec.model_id,
+                                                    messages=prompt,
+                                                    temperature=self.get_temperature(),
+                                                    max_tokens=self.get_max_tokens())
+        return self._parse_api_response(messages, api_response)
+
+    @staticmethod
+    def _to_chat_messages(messages: List[Dict]) -> List[ChatMessage]:
+        prompt = []
+        for m in messages:
+            prompt.append(ChatMessage(role=m['role'], content=m['content']))
+        return prompt
+
+    @staticmethod
+    def _parse_api_response(messages, api_response) -> Tuple[str, Any, str]:
         message = api_response.choices[0].message
         if message.role != "assistant":  # safety check
             raise AttributeError("Response message role is " + message.role + " but should be 'assistant'")
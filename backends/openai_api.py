@@ -1,9 +1,9 @@
 from typing import List, Dict, Tuple, Any
-from retry import retry
 
 import json
 import openai
 import backends
+from backends.rate_limit import configure_rate_limit, rate_limited, arate_limited
 from backends.utils import ensure_messages_format
 
 logger = backends.get_logger(__name__)
@@ -15,9 +15,11 @@ class OpenAI(backends.Backend):
 
     def __init__(self):
         creds = backends.load_credentials(NAME)
+        configure_rate_limit(NAME, creds[NAME].get("rate_limit"))
         api_key = creds[NAME]["api_key"]
         organization = creds[NAME]["organisation"] if "organisation" in creds[NAME] else None
         self.client = openai.OpenAI(api_key=api_key, organization=organization)
+        self.async_client = openai.AsyncOpenAI(api_key=api_key, organization=organization)
 
     def list_models(self):
         models = self.client.models.list()
@@ -27,16 +29,18 @@ class OpenAI(backends.Backend):
         # [print(n) for n in names]   # 2024-01-10: what was this? a side effect-only method?
 
     def get_model_for(self, model_spec: backends.ModelSpec) -> backends.Model:
-        return OpenAIModel(self.client, model_spec)
+        return OpenAIModel(self.client, model_spec, self.async_client)
 
 
 class OpenAIModel(backends.Model):
 
-    def __init__(self, client: openai.OpenAI, model_spec: backends.ModelSpec):
+    def __init__(self, client: openai.OpenAI, model_spec: backends.ModelSpec,
+                 async_client: openai.AsyncOpenAI = None):
         super().__init__(model_spec)
         self.client = client
+        self.async_client = async_client
 
-    @retry(tries=3, delay=0, logger=logger)
+    @rate_limited(tries=3)
     @ensure_messages_format
     def generate_response(self, messages: List[Dict]) -> Tuple[str, Any, str]:
         """
@@ -54,13 +58,30 @@ class OpenAIModel(backends.Model):
                                                            messages=prompt,
                                                            temperature=self.get_temperature(),
                                                            max_tokens=self.get_max_tokens())
+        return self._parse_api_response(prompt, api_response)
 
-                                                           
+    @arate_limited(tries=3)
+    @ensure_messages_format
+    async def agenerate_response(self, messages: List[Dict]) -> Tuple[str, Any, str]:
+        """
+        :param messages: see generate_response
+        :return: the continuation
+        """
+        if self.async_client is None:
+            return await super().agenerate_response(messages)
+        prompt = messages
+        api_response = await self.async_client.chat.completions.create(model=self.model_spec.model_id,
+                                                                       messages=prompt,
+                                                                       temperature=self.get_temperature(),
+                                                                       max_tokens=self.get_max_tokens())
+        return self._parse_api_response(prompt, api_response)
+
+    @staticmethod
+    def _parse_api_response(prompt, api_response) -> Tuple[str, Any, str]:
         message = api_response.choices[0].message
         if message.role != "assistant":  # safety check
             raise AttributeError("Response message role is " + message.role + " but should be 'assistant'")
         response_text = message.content.strip()
         response = json.loads(api_response.json())
-        
 
         return prompt, response, response_text
@@ -1,11 +1,11 @@
 from typing import List, Dict, Tuple, Any
-from retry import retry
 
 import json
 import openai
 import backends
 import httpx
 
+from backends.rate_limit import configure_rate_limit, rate_limited, arate_limited
 from backends.utils import ensure_messages_format
 
 logger = backends.get_logger(__name__)
@@ -17,6 +17,7 @@ class GenericOpenAI(backends.Backend):
 
     def __init__(self):
         creds = backends.load_credentials(NAME)
+        configure_rate_limit(NAME, creds[NAME].get("rate_limit"))
         self.client = openai.OpenAI(
             base_url=creds[NAME]["base_url"],
             api_key=creds[NAME]["api_key"],
@@ -25,6 +26,11 @@ class GenericOpenAI(backends.Backend):
             ### issues with the certificates on our GPU server.
             http_client=httpx.Client(verify=False)
         )
+        self.async_client = openai.AsyncOpenAI(
+            base_url=creds[NAME]["base_url"],
+            api_key=creds[NAME]["api_key"],
+            http_client=httpx.AsyncClient(verify=False)
+        )
 
     def list_models(self):
         models = self.client.models.list()
@@ -33,16 +39,18 @@ class GenericOpenAI(backends.Backend):
         return names
 
     def get_model_for(self, model_spec: backends.ModelSpec) -> backends.Model:
-        return GenericOpenAIModel(self.client, model_spec)
+        return GenericOpenAIModel(self.client, model_spec, self.async_client)
 
 
 class GenericOpenAIModel(backends.Model):
 
-    def __init__(self, client: openai.OpenAI, model_spec: backends.ModelSpec):
+    def __init__(self, client: openai.OpenAI, model_spec: backends.ModelSpec,
+                 async_client: openai.AsyncOpenAI = None):
         super().__init__(model_spec)
         self.client = client
+        self.async_client = async_client
 
-    @retry(tries=3, delay=0, logger=logger)
+    @rate_limited(tries=3)
     @ensure_messages_format
     def generate_response(self, messages: List[Dict]) -> Tuple[str, Any, str]:
         """
@@ -59,6 +67,26 @@ class GenericOpenAIModel(backends.Model):
         api_response = self.client.chat.completions.create(model=self.model_spec.model_id, messages=prompt,
                                                            temperature=self.get_temperature(),
                                                            max_tokens=self.get_max_tokens())
+        return self._parse_api_response(prompt, api_response)
+
+    @arate_limited(tries=3)
+    @ensure_messages_format
+    async def agenerate_response(self, messages: List[Dict]) -> Tuple[str, Any, str]:
+        """
+        :param messages: see generate_response
+        :return: the continuation
+        """
+        if self.async_client is None:
+            return await super().agenerate_response(messages)
+        prompt = messages
+        api_response = await self.async_client.chat.completions.create(model=self.model_spec.model_id,
+                                                                       messages=prompt,
+                                                                       temperature=self.get_temperature(),
+                                                                       max_tokens=self.get_max_tokens())
+        return self._parse_api_response(prompt, api_response)
+
+    @staticmethod
+    def _parse_api_response(prompt, api_response) -> Tuple[str, Any, str]:
         message = api_response.choices[0].message
         if message.role != "assistant":  # safety check
             raise AttributeError("Response message role is " + message.role + " but should be 'assistant'")
@@ -0,0 +1,313 @@
+"""
+    Client-side rate limiting for remote API backends.
+
+    Each backend gets a RateLimiter with token buckets for the requests and tokens per minute and a cap on the number of
+    concurrent calls. Failed calls are retried with exponential backoff (with jitter). When the provider signals a rate
+    limit (HTTP 429), then all calls to the backend are paused for the time given by the provider's response headers
+    (e.g. retry-after), if so.
+
+    The limits are configured by a "rate_limit" entry in the backend's key.json credentials, for example
+        "openai": {"api_key": "<value>",
+                   "rate_limit": {"requests_per_minute": 500, "tokens_per_minute": 30000, "max_concurrent": 8}}
+    or by a "rate_limit" entry with the same keys in a model registry entry (then the model has its own limiter).
+"""
+import asyncio
+import contextvars
+import email.utils
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager, asynccontextmanager
+from functools import wraps
+from typing import Dict, List, Optional
+
+import backends
+
+logger = backends.get_logger(__name__)
+
+DEFAULT_BASE_DELAY = 1  # seconds before the first retry (at most, because of the jitter)
+DEFAULT_MAX_DELAY = 60  # seconds between retries (at most, unless the provider asks for longer)
+CHARS_PER_TOKEN = 4  # rough estimate of the prompt tokens for the tokens per minute budget
+
+RETRY_AFTER_HEADERS = ["retry-after-ms", "retry-after"]
+RATE_LIMIT_RESET_HEADERS = ["x-ratelimit-reset-requests", "x-ratelimit-reset-tokens"]
+
+
+class TokenBucket:
+    """
+    Refills continuously up to its capacity (the budget per minute).
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def reserve(self, amount: float, now: float) -> float:
+        """
+        Take the amount from the bucket. The level might become negative, so that later reservations wait longer.
+        :return: the seconds to wait until the amount is available
+        """
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        self.level -= min(amount, self.capacity)  # larger amounts only wait for a full bucket
+        return max(0.0, -self.level / self.rate)
+
+
+class RateLimiter:
+
+    def __init__(self, requests_per_minute: float = None, tokens_per_minute: float = None, max_concurrent: int = None,
+                 max_tries: int = None, max_delay: float = DEFAULT_MAX_DELAY):
+        """
+        :param requests_per_minute: the request budget (unlimited by default)
+        :param tokens_per_minute: the token budget (prompt and max new tokens; unlimited by default)
+        :param max_concurrent: the maximal number of concurrent calls (unlimited by default)
+        :param max_tries: overrides the number of tries of the backend (see rate_limited())
+        :param max_delay: the maximal seconds between retries (unless the provider asks for longer)
+        """
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_concurrent = max_concurrent
+        self.max_tries = max_tries
+        self.max_delay = max_delay
+        self._running = 0
+        self._paused_until = 0.0
+        self._condition = threading.Condition()
+
+    def reserve(self, tokens: int) -> float:
+        """
+        :param tokens: the estimated tokens of the call
+        :return: the seconds to wait before the call
+        """
+        with self._condition:
+            now = time.monotonic()
+            wait = max(0.0, self._paused_until - now)
+            if self.requests is not None:
+                wait = max(wait, self.requests.reserve(1, now))
+            if self.tokens is not None:
+                wait = max(wait, self.tokens.reserve(tokens, now))
+            return wait
+
+    def pause(self, seconds: float):
+        """ Let all calls wait for the given seconds (e.g. when the provider signals a rate limit) """
+        with self._condition:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def _try_enter(self) -> bool:
+        with self._condition:
+            if self.max_concurrent and self._running >= self.max_concurrent:
+                return False
+            self._running += 1
+            return True
+
+    def _exit(self):
+        with self._condition:
+            self._running -= 1
+            self._condition.notify()
+
+    @contextmanager
+    def slot(self):
+        """ Wait for one of the max_concurrent slots """
+        with self._condition:
+            while self.max_concurrent and self._running >= self.max_concurrent:
+                self._condition.wait()
+            self._running += 1
+        try:
+            yield
+        finally:
+            self._exit()
+
+    @asynccontextmanager
+    async def aslot(self):
+        """ Wait for one of the max_concurrent slots (without blocking the event loop) """
+        while not self._try_enter():
+            await asyncio.sleep(0.05)
+        try:
+            yield
+        finally:
+            self._exit()
+
+    def backoff(self, error: Exception, attempt: int) -> float:
+        """
+        :param error: of the failed call
+        :param attempt: the number of the failed attempt (starting at 1)
+        :return: the seconds to wait before the next attempt
+        """
+        delay = random.uniform(0, min(self.max_delay, DEFAULT_BASE_DELAY * 2 ** (attempt - 1)))
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None:
+            delay = retry_after + random.uniform(0, DEFAULT_BASE_DELAY)  # the waiting calls should not retry at once
+        if retry_after is not None or is_rate_limit_error(error):
+            self.pause(delay)
+        return delay
+
+
+def _response_headers(error: Exception) -> Dict:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    return headers if headers is not None else {}
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    status_code = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    if status_code == 429:
+        return True
+    error_name = type(error).__name__
+    return "RateLimit" in error_name or "ResourceExhausted" in error_name or "TooManyRequests" in error_name
+
+
+def _parse_duration(value: str) -> Optional[float]:
+    """ Parse durations like '20ms', '1s', '6m0s' or '1.5' (seconds) """
+    if re.fullmatch(r"\d+(\.\d+)?", value):
+        return float(value)
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|s|m|h)", value)
+    if not parts or "".join(number + unit for number, unit in parts) != value:
+        return None
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(number) * units[unit] for number, unit in parts)
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """
+    :return: the seconds to wait before the next call as given by the response headers of the error (if so)
+    """
+    headers = _response_headers(error)
+    for header in RETRY_AFTER_HEADERS:
+        value = headers.get(header)
+        if value is None:
+            continue
+        if header == "retry-after-ms":
+            return float(value) / 1000
+        seconds = _parse_duration(value)
+        if seconds is not None:
+            return seconds
+        try:  # a http date
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            continue
+    resets = [_parse_duration(headers[header]) for header in RATE_LIMIT_RESET_HEADERS if header in headers]
+    resets = [seconds for seconds in resets if seconds is not None]
+    return max(resets) if resets else None
+
+
+# set while a call holds its slot, so that an agenerate_response() that falls back to the (also rate limited)
+# generate_response() in a worker thread (asyncio.to_thread copies the context) does not wait and retry again
+_within_rate_limit = contextvars.ContextVar("within_rate_limit", default=False)
+
+_backend_configs: Dict[str, Dict] = dict()  # backend name -> rate limit config
+_rate_limiters: Dict[str, RateLimiter] = dict()
+_rate_limiters_lock = threading.Lock()
+
+
+def configure_rate_limit(backend_name: str, config: Dict = None):
+    """
+    :param backend_name: e.g. openai
+    :param config: the keyword arguments for the RateLimiter of the backend (e.g. the rate_limit entry in key.json)
+    """
+    with _rate_limiters_lock:
+        _backend_configs[backend_name] = dict(config or {})
+        _rate_limiters.pop(backend_name, None)
+
+
+def get_rate_limiter(model_spec: backends.ModelSpec) -> RateLimiter:
+    """
+    :return: the rate limiter of the model (if its registry entry has a rate_limit) or else of its backend
+    """
+    backend_name = model_spec["backend"] if "backend" in model_spec else model_spec.model_name
+    if "rate_limit" in model_spec:
+        key, config = f"{backend_name}:{model_spec.model_name}", model_spec["rate_limit"]
+    else:
+        key, config = backend_name, _backend_configs.get(backend_name, {})
+    with _rate_limiters_lock:
+        if key not in _rate_limiters:
+            _rate_limiters[key] = RateLimiter(**config)
+        return _rate_limiters[key]
+
+
+def estimate_tokens(model: backends.Model, messages: List[Dict]) -> int:
+    """
+    :return: a rough estimate of the prompt tokens plus the maximal new tokens of a call
+    """
+    prompt_chars = sum(len(str(message.get("content", ""))) for message in messages)
+    try:
+        max_tokens = model.get_max_tokens()
+    except AssertionError:  # no max_tokens given
+        max_tokens = 0
+    return prompt_chars // CHARS_PER_TOKEN + max_tokens
+
+
+def rate_limited(tries: int = 3):
+    """
+    Decorator for generate_response() of remote backends: Waits for the rate limiter of the model
+    (see get_rate_limiter()) and retries failed calls with exponential backoff.
+    :param tries: the maximum number of attempts (unless the rate limit config gives max_tries)
+    """
+
+    def decorator(generate_response_fn):
+        @wraps(generate_response_fn)
+        def wrapped_fn(self, messages, *args, **kwargs):
+            if _within_rate_limit.get():
+                return generate_response_fn(self, messages, *args, **kwargs)
+            limiter = get_rate_limiter(self.model_spec)
+            tokens = estimate_tokens(self, messages)
+            max_tries = limiter.max_tries or tries
+            attempt = 1
+            while True:
+                with limiter.slot():
+                    time.sleep(limiter.reserve(tokens))
+                    token = _within_rate_limit.set(True)
+                    try:
+                        return generate_response_fn(self, messages, *args, **kwargs)
+                    except Exception as e:
+                        if attempt >= max_tries:
+                            raise
+                        error = e
+                    finally:
+                        _within_rate_limit.reset(token)
+                delay = limiter.backoff(error, attempt)
+                logger.warning('%s, retrying in %.1f seconds...', error, delay)
+                time.sleep(delay)
+                attempt += 1
+
+        return wrapped_fn
+
+    return decorator
+
+
+def arate_limited(tries: int = 3):
+    """
+    Decorator for agenerate_response() of remote backends, mirroring rate_limited() (without blocking the event loop).
+    :param tries: the maximum number of attempts (unless the rate limit config gives max_tries)
+    """
+
+    def decorator(agenerate_response_fn):
+        @wraps(agenerate_response_fn)
+        async def wrapped_fn(self, messages, *args, **kwargs):
+            if _within_rate_limit.get():
+                return await agenerate_response_fn(self, messages, *args, **kwargs)
+            limiter = get_rate_limiter(self.model_spec)
+            tokens = estimate_tokens(self, messages)
+            max_tries = limiter.max_tries or tries
+            attempt = 1
+            while True:
+                async with limiter.aslot():
+                    await asyncio.sleep(limiter.reserve(tokens))
+                    token = _within_rate_limit.set(True)
+                    try:
+                        return await agenerate_response_fn(self, messages, *args, **kwargs)
+                    except Exception as e:
+                        if attempt >= max_tries:
+                            raise
+                        error = e
+                    finally:
+                        _within_rate_limit.reset(token)
+                delay = limiter.backoff(error, attempt)
+                logger.warning('%s, retrying in %.1f seconds...', error, delay)
+                await asyncio.sleep(delay)
+                attempt += 1
+
+        return wrapped_fn
+
+    return decorator
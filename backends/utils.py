@@ -1,4 +1,5 @@
 import copy
+import inspect
 from functools import wraps
 from typing import List, Dict, Tuple
 
@@ -54,6 +55,14 @@ def ensure_alternating_roles(messages: List[Dict], cull_system_message: bool = T
 
 
 def ensure_messages_format(generate_response_fn):
+    if inspect.iscoroutinefunction(generate_response_fn):
+        @wraps(generate_response_fn)
+        async def async_wrapped_fn(self, messages):
+            _messages = ensure_alternating_roles(messages)
+            return await generate_response_fn(self, _messages)
+
+        return async_wrapped_fn
+
     @wraps(generate_response_fn)
     def wrapped_fn(self, messages):
         _messages = ensure_alternating_roles(messages)
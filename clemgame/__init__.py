@@ -4,6 +4,7 @@ import os
 import logging
 import logging.config
 import yaml
+from typing import List
 
 BANNER = \
     r"""
@@ -32,16 +33,33 @@ def get_logger(name):
     return logging.getLogger(name)
 
 
-# Load games dynamically from "games" sibling directory
+# Load games dynamically from "games" sibling directory (only on demand, see clemgame.find_benchmark())
 # Note: The games might use get_logger (circular import)
 games_root = os.path.join(project_root, "games")
-if os.path.isdir(games_root):
-    games_modules = [file for file in os.listdir(games_root)
-                     if os.path.isdir(os.path.join(games_root, file)) and file not in ["__pycache__"]]
-    for game_module in games_modules:
+_game_modules = dict()  # game directory -> loaded master module (None, when it cannot be loaded)
+
+
+def game_directories() -> List[str]:
+    if not os.path.isdir(games_root):
+        return []
+    return [file for file in os.listdir(games_root)
+            if os.path.isdir(os.path.join(games_root, file)) and file not in ["__pycache__"]]
+
+
+def load_game_module(game_module: str):
+    """ Import 'games.<game_module>.master' (only once, also when this fails) """
+    if game_module not in _game_modules:
         try:
-            importlib.import_module(f"games.{game_module}.master")
+            _game_modules[game_module] = importlib.import_module(f"games.{game_module}.master")
         except Exception as e:
             print(e)
             print(f"Cannot load 'games.{game_module}.master'."
                   f" Please make sure that the file exists.", file=sys.stderr)
+            _game_modules[game_module] = None
+    return _game_modules[game_module]
+
+
+def load_game_modules():
+    """ Import the master modules of all games """
+    for game_module in game_directories():
+        load_game_module(game_module)
@@ -2,7 +2,9 @@
 from typing import List, Dict
 
 import backends
+from backends import cache
 import clemgame
+from clemgame import file_utils
 
 from datetime import datetime
 
@@ -27,10 +29,14 @@ def list_games():
 
 
 def run(game_name: str, model_specs: List[backends.ModelSpec], gen_args: Dict,
-        experiment_name: str = None, instances_name: str = None, results_dir: str = None):
+        experiment_name: str = None, instances_name: str = None, results_dir: str = None, workers: int = 1,
+        use_cache: bool = False, resume: bool = False, model_pool_mb: float = 0):
     if experiment_name:
         logger.info("Only running experiment: %s", experiment_name)
     try:
+        if use_cache:
+            cache.enable_response_cache()
+        backends.configure_model_pool(model_pool_mb)
         player_models = []
         for model_spec in model_specs:
             model = backends.get_model_for(model_spec)
@@ -42,18 +48,29 @@ def run(game_name: str, model_specs: List[backends.ModelSpec], gen_args: Dict,
         if experiment_name:
             benchmark.filter_experiment.append(experiment_name)
         time_start = datetime.now()
-        benchmark.run(player_models=player_models, results_dir=results_dir)
+        if workers > 1:
+            logger.info("Playing episodes with %d workers", workers)
+        if resume:
+            logger.info("Resuming run: Skip already completed episodes")
+        benchmark.run(player_models=player_models, results_dir=results_dir, workers=workers, resume=resume)
         time_end = datetime.now()
         logger.info(f"Run {benchmark.name} took {str(time_end - time_start)}")
     except Exception as e:
         stdout_logger.exception(e)
         logger.error(e, exc_info=True)
+    finally:
+        cache.disable_response_cache()
 
 
-def score(game_name: str, experiment_name: str = None, results_dir: str = None):
+def score(game_name: str, experiment_name: str = None, results_dir: str = None, workers: int = 1,
+          force: bool = False):
     logger.info("Scoring benchmark for: %s", game_name)
     if experiment_name:
         logger.info("Only scoring experiment: %s", experiment_name)
+    if workers > 1:
+        logger.info("Scoring episodes with %d worker processes", workers)
+    if force:
+        logger.info("Scoring all episodes (even those with up to date scores)")
     if game_name == "all":
         games_list = load_benchmarks(do_setup=False)
     else:
@@ -65,7 +82,7 @@ def score(game_name: str, experiment_name: str = None, results_dir: str = None):
                 benchmark.filter_experiment.append(experiment_name)
             stdout_logger.info(f"Score game {idx + 1} of {total_games}: {benchmark.name}")
             time_start = datetime.now()
-            benchmark.compute_scores(results_dir)
+            benchmark.compute_scores(results_dir, workers, force)
             time_end = datetime.now()
             logger.info(f"Score {benchmark.name} took {str(time_end - time_start)}")
         except Exception as e:
@@ -73,10 +90,15 @@ def score(game_name: str, experiment_name: str = None, results_dir: str = None):
             logger.error(e, exc_info=True)
 
 
-def transcripts(game_name: str, experiment_name: str = None, results_dir: str = None):
+def transcripts(game_name: str, experiment_name: str = None, results_dir: str = None, workers: int = 1,
+                force: bool = False):
     logger.info("Building benchmark transcripts for: %s", game_name)
     if experiment_name:
         logger.info("Only transcribe experiment: %s", experiment_name)
+    if workers > 1:
+        logger.info("Building transcripts with %d worker processes", workers)
+    if force:
+        logger.info("Building all transcripts (even those that are up to date)")
     if game_name == "all":
         games_list = load_benchmarks(do_setup=False)
     else:
@@ -88,9 +110,51 @@ def transcripts(game_name: str, experiment_name: str = None, results_dir: str =
                 benchmark.filter_experiment.append(experiment_name)
             stdout_logger.info(f"Transcribe game {idx + 1} of {total_games}: {benchmark.name}")
             time_start = datetime.now()
-            benchmark.build_transcripts(results_dir)
+            benchmark.build_transcripts(results_dir, workers, force)
             time_end = datetime.now()
             logger.info(f"Building transcripts {benchmark.name} took {str(time_end - time_start)}")
         except Exception as e:
             stdout_logger.exception(e)
             logger.error(e, exc_info=True)
+
+
+def plots(game_name: str, experiment_name: str = None, results_dir: str = None, workers: int = 1,
+          force: bool = False):
+    logger.info("Building benchmark plots for: %s", game_name)
+    if experiment_name:
+        logger.info("Only plot experiment: %s", experiment_name)
+    if workers > 1:
+        logger.info("Building plots with %d worker processes", workers)
+    if force:
+        logger.info("Building all plots (even those that are up to date)")
+    if game_name == "all":
+        games_list = load_benchmarks(do_setup=False)
+    else:
+        games_list = [load_benchmark(game_name, do_setup=False)]
+    total_games = len(games_list)
+    for idx, benchmark in enumerate(games_list):
+        try:
+            if experiment_name:
+                benchmark.filter_experiment.append(experiment_name)
+            stdout_logger.info(f"Plot game {idx + 1} of {total_games}: {benchmark.name}")
+            time_start = datetime.now()
+            benchmark.build_plots(results_dir, workers, force)
+            time_end = datetime.now()
+            logger.info(f"Building plots {benchmark.name} took {str(time_end - time_start)}")
+        except Exception as e:
+            stdout_logger.exception(e)
+            logger.error(e, exc_info=True)
+
+
+def consolidate(game_name: str = "all", results_dir: str = None):
+    """ Store the scores of all episodes in the Parquet score tables read by the evaluation scripts """
+    from evaluation import evalutils  # the evaluation dependencies are only needed here
+    logger.info("Consolidating scores for: %s", game_name)
+    try:
+        time_start = datetime.now()
+        evalutils.consolidate_scores(file_utils.results_root(results_dir), None if game_name == "all" else game_name)
+        time_end = datetime.now()
+        logger.info(f"Consolidating scores took {str(time_end - time_start)}")
+    except Exception as e:
+        stdout_logger.exception(e)
+        logger.error(e, exc_info=True)
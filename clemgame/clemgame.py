@@ -1,14 +1,19 @@
 import abc
 import collections
 import copy
+import hashlib
+import inspect
+import json
 import os.path
+import sys
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from datetime import datetime
-from typing import List, Dict, Tuple, Any
+from typing import List, Dict, Tuple, Any, Optional, Union, Callable
 
 from tqdm import tqdm
 
 import backends
-from backends import Model, CustomResponseModel, HumanModel
+from backends import Model, CustomResponseModel, HumanModel, cache
 import clemgame
 from clemgame import file_utils, transcript_utils
 import clemgame.metrics as ms
@@ -27,6 +32,7 @@ class Player(abc.ABC):
     - the programmatic players are called via the _custom_response() method
     - the human players are called via the _terminal_response() method
     - the backend players are called via the generate_response() method of the backend
+      (or answered from the response cache, if enabled)
     """
 
     def __init__(self, model: Model):
@@ -41,18 +47,20 @@ class Player(abc.ABC):
         call_start = datetime.now()
         prompt = messages
         response = dict()
+        cached = False
         if isinstance(self.model, CustomResponseModel):
             response_text = self._custom_response(messages, turn_idx)
         elif isinstance(self.model, HumanModel):
             response_text = self._terminal_response(messages, turn_idx)
         else:
-            prompt, response, response_text = self.model.generate_response(messages)
+            prompt, response, response_text, cached = cache.generate_response(self.model, messages)
         call_duration = datetime.now() - call_start
         response["clem_player"] = {
             "call_start": str(call_start),
             "call_duration": str(call_duration),
             "response": response_text,
-            "model_name": self.model.get_name()
+            "model_name": self.model.get_name(),
+            "cached": cached  # then the call duration is not the one of the model
         }
         return prompt, response, response_text
 
@@ -177,6 +185,14 @@ class GameResourceLocator(abc.ABC):
 
 
 class GameRecorder(GameResourceLocator):
+    """
+    Records the interactions and calls of an episode. By default, the records are kept in memory until
+    store_records() is called. When start_event_log() has been called, then the records are instead appended to
+    an events.jsonl log in the episode directory as they happen, and store_records() compacts the log into the
+    interactions.json and requests.json files.
+    """
+
+    EVENT_LOG_FILE = "events.jsonl"
 
     def __init__(self, name: str):
         super().__init__(name)
@@ -188,19 +204,55 @@ class GameRecorder(GameResourceLocator):
         }
         """ Stores calls to the API """
         self.requests = []
+        """ The append-only event log, if started """
+        self.event_log = None
+        """ Number of logged calls and the latest prompt of each dialogue history (for structural sharing) """
+        self.requests_count = 0
+        self.prompt_tips = []
+
+    def start_event_log(self, results_root: str, dialogue_pair_desc: str, game_record_dir: str):
+        """
+        Stream all further records to the event log of the episode instead of keeping them in memory.
+        Must be called before the first record, usually before setup().
+        """
+        fp = self._event_log_path(results_root, dialogue_pair_desc, game_record_dir)
+        os.makedirs(os.path.dirname(fp), exist_ok=True)
+        self.event_log = open(fp, "w", encoding="utf-8", buffering=1)  # line buffered: flush each event
+
+    def stop_event_log(self):
+        """ Close the event log (if started). Further records are kept in memory again. """
+        if self.event_log:
+            self.event_log.close()
+            self.event_log = None
+
+    def _event_log_path(self, results_root: str, dialogue_pair_desc: str, game_record_dir: str) -> str:
+        return os.path.join(self.results_path_for(results_root, dialogue_pair_desc), game_record_dir,
+                            self.EVENT_LOG_FILE)
+
+    def _append_to_event_log(self, record: Dict):
+        self.event_log.write(json.dumps(record, ensure_ascii=False) + "\n")
 
     def log_next_turn(self):
         """ Call this method to group interactions per turn """
         self.log_current_turn += 1
-        self.interactions["turns"].append([])
+        if self.event_log:
+            self._append_to_event_log({"record": "next_turn"})
+        else:
+            self.interactions["turns"].append([])
 
     def log_key(self, key: str, value: Any):
         """Add a key and value to the internal log."""
-        self.interactions[key] = value
+        if self.event_log:
+            self._append_to_event_log({"record": "key", "key": key, "value": value})
+        else:
+            self.interactions[key] = value
         self.logger.info(f"{self.name}: Logged a game-specific interaction key: {key}.")
 
     def log_players(self, players_dic: Dict):
-        self.interactions["players"] = players_dic
+        if self.event_log:
+            self._append_to_event_log({"record": "players", "value": players_dic})
+        else:
+            self.interactions["players"] = players_dic
         self.logger.info(f"{self.name}: Logged players metadata.")
 
     def log_event(self, from_: str, to: str, action: Dict, call: Tuple[Any, Any] = None):
@@ -221,18 +273,114 @@ class GameRecorder(GameResourceLocator):
             "timestamp": timestamp,
             "action": action
         }
-        self.interactions["turns"][self.log_current_turn].append(action_obj.copy())
+        if self.event_log:  # serialization already takes a snapshot, so that no copies are needed
+            self._append_to_event_log({"record": "action", "value": action_obj})
+        else:
+            self.interactions["turns"][self.log_current_turn].append(action_obj.copy())
         self.logger.info(
             f"{self.name}: Logged {action['type']} action ({from_}->{to}).")
         if call:
-            call_obj = {
-                "timestamp": timestamp,
-                "manipulated_prompt_obj": self._needs_copy(call[0]),
-                "raw_response_obj": self._needs_copy(call[1])
-            }
-            self.requests.append(call_obj)
+            call_obj = {"timestamp": timestamp}
+            prompt_prefix, prompt_obj = self._share_prompt_prefix(call[0])
+            if prompt_prefix:
+                call_obj["manipulated_prompt_prefix"] = prompt_prefix
+            call_obj["manipulated_prompt_obj"] = prompt_obj
+            if self.event_log:
+                call_obj["raw_response_obj"] = call[1]
+                self._append_to_event_log({"record": "call", "value": call_obj})
+            else:
+                call_obj["raw_response_obj"] = self._needs_copy(call[1])
+                self.requests.append(call_obj)
+            self.requests_count += 1
             self.logger.info(f"{self.name}: Logged a call with timestamp {timestamp}")
 
+    @staticmethod
+    def _shareable_prompt(prompt_obj) -> Tuple[Optional[str], Any]:
+        """
+        :return: the field of the prompt object that holds the dialogue history (None for the prompt object itself)
+                 and the dialogue history, which is either a list of messages or a rendered prompt text
+        """
+        if isinstance(prompt_obj, (List, str)):
+            return None, prompt_obj
+        if isinstance(prompt_obj, Dict) and isinstance(prompt_obj.get("inputs"), (List, str)):
+            return "inputs", prompt_obj["inputs"]  # local backends wrap the rendered prompt
+        return None, None
+
+    @staticmethod
+    def _common_prefix_length(history: Union[List, str], other: Union[List, str]) -> int:
+        if other[:len(history)] == history:  # usually the dialogue history only grows
+            return len(history)
+        length = 0
+        for item, other_item in zip(history, other):
+            if item != other_item:
+                break
+            length += 1
+        return length
+
+    def _share_prompt_prefix(self, prompt_obj) -> Tuple[Optional[Dict], Any]:
+        """
+        Each call contains the full dialogue history of a player, so that storing all prompts would grow quadratically
+        with the number of turns. Instead, only the part of the prompt that is not shared with an earlier prompt is
+        stored together with a reference to the earlier prompt. Use expand_requests() to restore the full prompts.
+
+        :return: the reference to the shared prefix (or None) and the prompt object reduced to the non-shared part
+        """
+        field, history = self._shareable_prompt(prompt_obj)
+        if not history:
+            return None, self._needs_copy(prompt_obj)
+        tip_idx, prefix_length = None, 0
+        for idx, (_, tip_field, tip_history) in enumerate(self.prompt_tips):
+            if tip_field != field or type(tip_history) is not type(history):
+                continue
+            length = self._common_prefix_length(tip_history, history)
+            if length > prefix_length:
+                tip_idx, prefix_length = idx, length
+        delta = self._needs_copy(history[prefix_length:])
+        if field is None:
+            reduced_prompt_obj = delta
+        else:
+            reduced_prompt_obj = {key: delta if key == field else self._needs_copy(value)
+                                  for key, value in prompt_obj.items()}
+        if tip_idx is None:
+            self.prompt_tips.append((self.requests_count, field, delta))
+            return None, reduced_prompt_obj
+        tip_request, _, tip_history = self.prompt_tips[tip_idx]
+        # the snapshot shares the unchanged messages with the tip, so that these are not copied again
+        snapshot = (self.requests_count, field, tip_history[:prefix_length] + delta)
+        if prefix_length == len(tip_history):
+            self.prompt_tips[tip_idx] = snapshot  # the dialogue history continues
+        else:
+            self.prompt_tips.append(snapshot)  # the dialogue history has been changed
+        prompt_prefix = {"request": tip_request, "length": prefix_length}
+        if field is not None:
+            prompt_prefix["field"] = field
+        return prompt_prefix, reduced_prompt_obj
+
+    @staticmethod
+    def expand_requests(requests: List[Dict]) -> List[Dict]:
+        """
+        Restore the full prompts of the calls stored in a requests.json file (see log_event()). The expanded prompts
+        share their unchanged messages, so that these are not copied.
+        :param requests: as loaded from the requests.json file
+        :return: the requests with the full prompts as passed to the backends
+        """
+        expanded = []
+        for request in requests:
+            prompt_prefix = request.get("manipulated_prompt_prefix")
+            if prompt_prefix:
+                request = dict(request)
+                del request["manipulated_prompt_prefix"]
+                field = prompt_prefix.get("field")
+                prefix_obj = expanded[prompt_prefix["request"]]["manipulated_prompt_obj"]
+                prompt_obj = request["manipulated_prompt_obj"]
+                if field is None:
+                    request["manipulated_prompt_obj"] = prefix_obj[:prompt_prefix["length"]] + prompt_obj
+                else:
+                    history = prefix_obj[field][:prompt_prefix["length"]] + prompt_obj[field]
+                    request["manipulated_prompt_obj"] = {**prompt_obj, field: history}
+            expanded.append(request)
+        return expanded
+
     @staticmethod
     def _needs_copy(call_obj):
         if isinstance(call_obj, Dict) or isinstance(call_obj, List):
@@ -241,8 +389,41 @@ class GameRecorder(GameResourceLocator):
             return call_obj[:]
         return call_obj
 
+    @staticmethod
+    def compact_event_log(event_log_path: str) -> Tuple[Dict, List]:
+        """
+        Materialize the records of an event log in the interactions.json and requests.json formats.
+        :param event_log_path: to the events.jsonl file of an episode
+        :return: the interactions and the requests
+        """
+        interactions = {
+            "players": {},
+            "turns": []
+        }
+        requests = []
+        with open(event_log_path, encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                record_type = record["record"]
+                if record_type == "next_turn":
+                    interactions["turns"].append([])
+                elif record_type == "action":
+                    interactions["turns"][-1].append(record["value"])
+                elif record_type == "call":
+                    requests.append(record["value"])
+                elif record_type == "players":
+                    interactions["players"] = record["value"]
+                elif record_type == "key":
+                    interactions[record["key"]] = record["value"]
+        return interactions, requests
+
     def store_records(self, results_root: str, dialogue_pair_desc: str, game_record_dir: str):
         """Raise warnings if a mandatory element is empty or format is wrong."""
+        if self.event_log:
+            self.stop_event_log()
+            event_log_path = self._event_log_path(results_root, dialogue_pair_desc, game_record_dir)
+            self.interactions, self.requests = self.compact_event_log(event_log_path)
+            os.remove(event_log_path)  # now fully contained in the stored records
         if not self.interactions["players"]:
             self.logger.warning(f"Players metadada is missing!")
         else:
@@ -375,6 +556,13 @@ class GameScorer(GameResourceLocator):
         # Replace this function call with a function that logs your main score aka BENCH_SCORE
         raise NotImplementedError()
 
+    def store_plots(self, results_root: str, dialogue_pair: str, game_record_dir: str):
+        """
+        Store the plots of the scored episode (called after compute_scores() by the separate plots step,
+        see GameBenchmark.plot_files()). By default, there are no plots.
+        """
+        pass
+
 
 class DialogueGameMaster(GameMaster):
     """
@@ -605,6 +793,11 @@ class GameBenchmark(GameResourceLocator):
     which compose a benchmark for the game. It supports different experiment conditions for games.
     """
 
+    SCORES_MANIFEST = "scores_manifest"
+    TRANSCRIPTS_MANIFEST = "transcripts_manifest"
+    PLOTS_MANIFEST = "plots_manifest"
+    SCORES_TABLE_DIR = "scores_table"  # the consolidated scores in the results root (see evaluation/evalutils.py)
+
     def __init__(self, name: str):
         super().__init__(name)
         self.instances = None
@@ -622,62 +815,169 @@ class GameBenchmark(GameResourceLocator):
             instances_name = "instances"
         self.instances = self.load_json(f"in/{instances_name}")
 
-    def build_transcripts(self, results_dir: str = None):
+    def build_transcripts(self, results_dir: str = None, workers: int = 1, force: bool = False):
+        """
+        Build the transcript.html and transcript.tex files of all recorded episodes.
+
+        When workers > 1, then the transcripts are built by a process pool. Transcripts whose episode records and
+        renderer did not change since they have been built are skipped, unless force is True
+        (see _process_episodes()).
+        """
         results_root = file_utils.results_root(results_dir)
-        dialogue_partners = [file for file in os.listdir(results_root)
-                             if os.path.isdir(os.path.join(results_root, file))]
-        for dialogue_pair in dialogue_partners:
-            game_result_path = self.results_path_for(results_root, dialogue_pair)
-            if not os.path.exists(game_result_path) or not os.path.isdir(game_result_path):
-                stdout_logger.info("No results directory found at: " + game_result_path)
+        episodes = self._collect_episodes(results_root, "Transcribe")
+        self._process_episodes(self._transcribe_episode, results_root, episodes, self.TRANSCRIPTS_MANIFEST,
+                               transcript_utils.renderer_version(), ["transcript.html", "transcript.tex"],
+                               workers, force, desc="Building transcripts")
+
+    def _transcribe_episode(self, results_root: str, dialogue_pair: str, experiment_config: Dict,
+                            rel_episode_path: str) -> bool:
+        """
+        Build the transcripts of a single episode. Exceptions are logged, but not raised, so that other episodes
+        continue.
+        :return: True, if the transcripts were built without exception
+        """
+        try:
+            game_instance = self.load_results_json(f"{rel_episode_path}/instance",
+                                                   results_root, dialogue_pair)
+            game_interactions = self.load_results_json(f"{rel_episode_path}/interactions",
+                                                       results_root, dialogue_pair)
+
+            transcript = transcript_utils.build_transcript(game_interactions, experiment_config,
+                                                           game_instance, dialogue_pair)
+            self.store_results_file(transcript, "transcript.html",
+                                    dialogue_pair,
+                                    sub_dir=rel_episode_path,
+                                    root_dir=results_root)
+            transcript_tex = transcript_utils.build_tex(game_interactions)
+            self.store_results_file(transcript_tex, "transcript.tex",
+                                    dialogue_pair,
+                                    sub_dir=rel_episode_path,
+                                    root_dir=results_root)
+        except Exception:  # continue with other episodes if something goes wrong
+            self.logger.exception(f"{self.name}: Cannot transcribe {rel_episode_path} (but continue)")
+            return False
+        return True
+
+    def scorer_version(self) -> str:
+        """
+        A fingerprint of the scoring code: When it changes, then all episodes are scored again.
+        By default, this is a hash of the game's python sources, the sources of other games' modules that it imports
+        (e.g. shared scoring code) and the clemgame base classes and metrics.
+        Games can overwrite this method, e.g. to return an explicit version string.
+        """
+        source_files = {os.path.abspath(os.path.join(dir_path, file_name))
+                        for dir_path, _, file_names in os.walk(file_utils.game_dir(self.name))
+                        for file_name in file_names if file_name.endswith(".py")}
+        source_files.update(self._imported_game_sources())
+        source_files = sorted(source_files) + [os.path.abspath(__file__), os.path.abspath(ms.__file__)]
+        sha = hashlib.sha256()
+        for source_file in source_files:
+            with open(source_file, "rb") as f:
+                sha.update(f.read())
+        return sha.hexdigest()
+
+    def _imported_game_sources(self) -> List[str]:
+        """
+        :return: the source files of the games.* modules that the benchmark's module imports (also indirectly)
+        """
+        source_files = []
+        visited = set()
+        pending = [type(self).__module__]
+        while pending:
+            module = sys.modules.get(pending.pop())
+            if module is None or module.__name__ in visited:
                 continue
+            visited.add(module.__name__)
+            if module.__name__.startswith("games.") and getattr(module, "__file__", None):
+                source_files.append(os.path.abspath(module.__file__))
+            for value in vars(module).values():  # imported modules, classes and functions
+                module_name = value.__name__ if inspect.ismodule(value) else getattr(value, "__module__", None)
+                if isinstance(module_name, str) and module_name.startswith("games.") and module_name not in visited:
+                    pending.append(module_name)
+        return source_files
+
+    def episode_fingerprint(self, results_root: str, dialogue_pair: str, rel_episode_path: str,
+                            version: str) -> Dict:
+        """
+        :param version: of the code that processes the episode records (e.g. the scorer version)
+        :return: the hashes of the episode's instance.json and interactions.json together with the version
+        """
+        fingerprint = {}
+        episode_path = os.path.join(self.results_path_for(results_root, dialogue_pair), rel_episode_path)
+        for record_name in ["instance", "interactions"]:
+            try:
+                with open(os.path.join(episode_path, f"{record_name}.json"), "rb") as f:
+                    fingerprint[record_name] = hashlib.sha256(f.read()).hexdigest()
+            except FileNotFoundError:
+                fingerprint[record_name] = None
+        fingerprint["version"] = version
+        return fingerprint
+
+    def compute_scores(self, results_dir: str = None, workers: int = 1, force: bool = False):
+        """
+        Score all recorded episodes and store their scores.json files.
+
+        When workers > 1, then the episodes are scored by a process pool. Episodes whose records and scoring code
+        (see scorer_version()) did not change since they have been scored are skipped, unless force is True
+        (see _process_episodes()).
+        """
+        results_root = file_utils.results_root(results_dir)
+        episodes = self._collect_episodes(results_root, "Scoring")
+        self._process_episodes(self._score_episode, results_root, episodes, self.SCORES_MANIFEST,
+                               self.scorer_version(), ["scores.json"], workers, force, desc="Scoring episodes")
 
-            experiment_dirs = [file for file in os.listdir(game_result_path)
-                               if os.path.isdir(os.path.join(game_result_path, file))]
-            if not experiment_dirs:
-                stdout_logger.warning(f"{self.name}: No experiments for {dialogue_pair}")
-            for experiment_dir in experiment_dirs:
-                experiment_path = os.path.join(game_result_path, experiment_dir)
-                experiment_name = "_".join(experiment_dir.split("_")[1:])  # remove leading index number
-                if self.filter_experiment and experiment_name not in self.filter_experiment:
-                    stdout_logger.info(f"Skip experiment {experiment_name}")
-                    continue
-                stdout_logger.info(f"Transcribe: {experiment_name}")
-                experiment_config = self.load_results_json(f"{experiment_dir}/experiment_{experiment_name}",
-                                                           results_root, dialogue_pair)
-                episode_dirs = [file for file in os.listdir(experiment_path)
-                                if os.path.isdir(os.path.join(experiment_path, file))]
-                error_count = 0
-                for episode_dir in tqdm(episode_dirs, desc="Building transcripts"):
-                    try:
-                        rel_episode_path = f"{experiment_dir}/{episode_dir}"
-                        game_instance = self.load_results_json(f"{rel_episode_path}/instance",
-                                                               results_root, dialogue_pair)
-                        game_interactions = self.load_results_json(f"{rel_episode_path}/interactions",
-                                                                   results_root, dialogue_pair)
-
-                        transcript = transcript_utils.build_transcript(game_interactions, experiment_config,
-                                                                       game_instance, dialogue_pair)
-                        self.store_results_file(transcript, "transcript.html",
-                                                dialogue_pair,
-                                                sub_dir=rel_episode_path,
-                                                root_dir=results_root)
-                        transcript_tex = transcript_utils.build_tex(game_interactions)
-                        self.store_results_file(transcript_tex, "transcript.tex",
-                                                dialogue_pair,
-                                                sub_dir=rel_episode_path,
-                                                root_dir=results_root)
-                    except Exception:  # continue with other episodes if something goes wrong
-                        self.logger.exception(f"{self.name}: Cannot transcribe {episode_dir} (but continue)")
-                        error_count += 1
-                if error_count > 0:
-                    stdout_logger.error(
-                        f"{self.name}: '{error_count}' exceptions occurred: See clembench.log for details.")
+    def plot_files(self) -> List[str]:
+        """
+        The files stored in each episode directory by GameScorer.store_plots(). Games with plots overwrite this method.
+        :return: the file names of the episode plots (none by default)
+        """
+        return []
+
+    def build_plots(self, results_dir: str = None, workers: int = 1, force: bool = False):
+        """
+        Store the plots of all recorded episodes (see plot_files()). Plotting is kept apart from scoring,
+        because rendering figures takes much longer than computing the scores.
 
-    def compute_scores(self, results_dir: str = None):
+        When workers > 1, then the plots are rendered by a process pool. Plots whose episode records and scoring code
+        did not change since they have been rendered are skipped, unless force is True (see _process_episodes()).
+        """
+        plot_files = self.plot_files()
+        if not plot_files:
+            stdout_logger.info(f"{self.name}: No plots to build")
+            return
         results_root = file_utils.results_root(results_dir)
+        episodes = self._collect_episodes(results_root, "Plotting")
+        self._process_episodes(self._plot_episode, results_root, episodes, self.PLOTS_MANIFEST,
+                               self.scorer_version(), plot_files, workers, force, desc="Building plots")
+
+    def _plot_episode(self, results_root: str, dialogue_pair: str, experiment_config: Dict,
+                      rel_episode_path: str) -> bool:
+        """
+        Store the plots of a single episode. Exceptions are logged, but not raised, so that other episodes continue.
+        :return: True, if the plots were stored without exception
+        """
+        try:
+            game_instance = self.load_results_json(f"{rel_episode_path}/instance",
+                                                   results_root, dialogue_pair)
+            game_interactions = self.load_results_json(f"{rel_episode_path}/interactions",
+                                                       results_root, dialogue_pair)
+
+            game_scorer = self.create_game_scorer(experiment_config, game_instance)
+            game_scorer.compute_scores(game_interactions)
+            game_scorer.store_plots(results_root, dialogue_pair, rel_episode_path)
+        except Exception:  # continue with other episodes if something goes wrong
+            self.logger.exception(f"{self.name}: Cannot plot {rel_episode_path} (but continue)")
+            return False
+        return True
+
+    def _collect_episodes(self, results_root: str, activity: str) -> List[Tuple[str, Dict, str]]:
+        """
+        :return: the dialogue pair, experiment config and relative episode path of all recorded episodes
+                 (of the selected experiments)
+        """
         dialogue_partners = [file for file in os.listdir(results_root)
-                             if os.path.isdir(os.path.join(results_root, file))]
+                             if os.path.isdir(os.path.join(results_root, file)) and file != self.SCORES_TABLE_DIR]
+        episodes = []
         for dialogue_pair in dialogue_partners:
             game_result_path = self.results_path_for(results_root, dialogue_pair)
             if not os.path.exists(game_result_path) or not os.path.isdir(game_result_path):
@@ -694,33 +994,106 @@ class GameBenchmark(GameResourceLocator):
                 if self.filter_experiment and experiment_name not in self.filter_experiment:
                     stdout_logger.info(f"Skip experiment {experiment_name}")
                     continue
-                stdout_logger.info(f"Scoring: {experiment_name}")
+                stdout_logger.info(f"{activity}: {experiment_name}")
                 experiment_config = self.load_results_json(f"{experiment_dir}/experiment_{experiment_name}",
                                                            results_root, dialogue_pair)
                 episode_dirs = [file for file in os.listdir(experiment_path)
                                 if os.path.isdir(os.path.join(experiment_path, file))]
-                error_count = 0
-                for episode_dir in tqdm(episode_dirs, desc="Scoring episodes"):
-                    try:
-                        rel_episode_path = f"{experiment_dir}/{episode_dir}"
-                        game_instance = self.load_results_json(f"{rel_episode_path}/instance",
-                                                               results_root, dialogue_pair)
-                        game_interactions = self.load_results_json(f"{rel_episode_path}/interactions",
-                                                                   results_root, dialogue_pair)
-
-                        game_scorer = self.create_game_scorer(experiment_config, game_instance)
-                        game_scorer.compute_scores(game_interactions)
-                        game_scorer.store_scores(results_root, dialogue_pair, rel_episode_path)
-                    except Exception:  # continue with other episodes if something goes wrong
-                        self.logger.exception(f"{self.name}: Cannot score {episode_dir} (but continue)")
+                for episode_dir in episode_dirs:
+                    episodes.append((dialogue_pair, experiment_config, f"{experiment_dir}/{episode_dir}"))
+        return episodes
+
+    def _process_episodes(self, process_episode: Callable[[str, str, Dict, str], bool], results_root: str,
+                          episodes: List[Tuple[str, Dict, str]], manifest_name: str, version: str,
+                          output_files: List[str], workers: int, force: bool, desc: str):
+        """
+        Apply process_episode(results_root, dialogue_pair, experiment_config, rel_episode_path) to the episodes.
+
+        The fingerprints of the processed episodes are kept in a manifest per dialogue pair
+        (see episode_fingerprint()). Episodes whose output files exist and whose fingerprint did not change are
+        skipped, unless force is True.
+
+        :param process_episode: returns True, if the episode was processed without exception
+        :param manifest_name: of the manifest file in the game results directory (without .json suffix)
+        :param version: of the code that processes the episodes
+        :param output_files: that are stored in the episode directory by process_episode
+        :param workers: when > 1, then the episodes are processed by a process pool
+        """
+        manifests = {dialogue_pair: self._load_manifest(manifest_name, results_root, dialogue_pair)
+                     for dialogue_pair, _, _ in episodes}
+        pending_episodes = []
+        for dialogue_pair, experiment_config, rel_episode_path in episodes:
+            fingerprint = self.episode_fingerprint(results_root, dialogue_pair, rel_episode_path, version)
+            episode_path = os.path.join(self.results_path_for(results_root, dialogue_pair), rel_episode_path)
+            if (not force and manifests[dialogue_pair].get(rel_episode_path) == fingerprint
+                    and all(os.path.isfile(os.path.join(episode_path, file)) for file in output_files)):
+                continue
+            pending_episodes.append((dialogue_pair, experiment_config, rel_episode_path, fingerprint))
+        skip_count = len(episodes) - len(pending_episodes)
+        if skip_count > 0:
+            stdout_logger.info(f"{self.name}: Skip {skip_count} episodes that are up to date")
+        error_count = 0
+        processed_episodes = []
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {executor.submit(process_episode, results_root, dialogue_pair, experiment_config,
+                                           rel_episode_path): (dialogue_pair, rel_episode_path, fingerprint)
+                           for dialogue_pair, experiment_config, rel_episode_path, fingerprint in pending_episodes}
+                for future in tqdm(as_completed(futures), total=len(futures), desc=desc):
+                    if future.result():
+                        processed_episodes.append(futures[future])
+                    else:
                         error_count += 1
-                if error_count > 0:
-                    stdout_logger.error(
-                        f"{self.name}: '{error_count}' exceptions occurred: See clembench.log for details.")
+        else:
+            for dialogue_pair, experiment_config, rel_episode_path, fingerprint in tqdm(pending_episodes, desc=desc):
+                if process_episode(results_root, dialogue_pair, experiment_config, rel_episode_path):
+                    processed_episodes.append((dialogue_pair, rel_episode_path, fingerprint))
+                else:
+                    error_count += 1
+        if error_count > 0:
+            stdout_logger.error(
+                f"{self.name}: '{error_count}' exceptions occurred: See clembench.log for details.")
+        for dialogue_pair, rel_episode_path, fingerprint in processed_episodes:
+            manifests[dialogue_pair][rel_episode_path] = fingerprint
+        for dialogue_pair in {dialogue_pair for dialogue_pair, _, _ in processed_episodes}:
+            self.store_results_file(manifests[dialogue_pair], f"{manifest_name}.json", dialogue_pair,
+                                    root_dir=results_root)
+
+    def _load_manifest(self, manifest_name: str, results_root: str, dialogue_pair: str) -> Dict:
+        try:
+            return self.load_results_json(manifest_name, results_root, dialogue_pair)
+        except (FileNotFoundError, ValueError):  # not processed yet or a broken manifest: process everything
+            return dict()
+
+    def _score_episode(self, results_root: str, dialogue_pair: str, experiment_config: Dict,
+                       rel_episode_path: str) -> bool:
+        """
+        Score a single episode. Exceptions are logged, but not raised, so that other episodes continue.
+        :return: True, if the episode was scored without exception
+        """
+        try:
+            game_instance = self.load_results_json(f"{rel_episode_path}/instance",
+                                                   results_root, dialogue_pair)
+            game_interactions = self.load_results_json(f"{rel_episode_path}/interactions",
+                                                       results_root, dialogue_pair)
+
+            game_scorer = self.create_game_scorer(experiment_config, game_instance)
+            game_scorer.compute_scores(game_interactions)
+            game_scorer.store_scores(results_root, dialogue_pair, rel_episode_path)
+        except Exception:  # continue with other episodes if something goes wrong
+            self.logger.exception(f"{self.name}: Cannot score {rel_episode_path} (but continue)")
+            return False
+        return True
 
-    def run(self, player_models: List[Model], results_dir: str = None):
+    def run(self, player_models: List[Model], results_dir: str = None, workers: int = 1, resume: bool = False):
         """
         Runs game-play on all game instances for a game.
+
+        When workers > 1, then the episodes of an experiment are played concurrently by a thread pool.
+        The episodes are still numbered by their position in the experiment's game instances.
+
+        When resume is True, then episodes that have already been completed by a previous run are skipped
+        (see is_episode_complete()).
         There must be an instances.json with the following structure:
         "experiments": [ # this is required
             {
@@ -798,10 +1171,8 @@ class GameBenchmark(GameResourceLocator):
                     model_1 = dialogue_pair[1]
                     model_1 = f"{model_1.get_name()}-t{model_1.get_temperature()}"
                     dialogue_pair_desc = f"{model_0}--{model_1}"
-                episode_counter = 0
-
-                self.logger.info("Activity: %s Experiment: %s Partners: %s Episode: %d",
-                                 self.name, experiment_name, dialogue_pair_desc, episode_counter)
+                self.logger.info("Activity: %s Experiment: %s Partners: %s",
+                                 self.name, experiment_name, dialogue_pair_desc)
 
                 experiment_record_dir = f"{experiment_idx}_{experiment_name}"
                 experiment_config = {k: experiment[k] for k in experiment if k != 'game_instances'}
@@ -819,25 +1190,29 @@ class GameBenchmark(GameResourceLocator):
                 error_count = 0
                 time_experiment_start = datetime.now()
                 game_instances: List = experiment["game_instances"]
-                for game_instance in tqdm(game_instances, desc="Playing games"):
-                    game_id = game_instance["game_id"]
-                    self.logger.info("Activity: %s Experiment: %s Episode: %d Game: %s",
-                                     self.name, experiment_name, episode_counter, game_id)
-                    episode_dir = experiment_record_dir + f"/episode_{episode_counter}"
-                    self.store_results_file(game_instance,
-                                            f"instance.json",
-                                            dialogue_pair_desc,
-                                            sub_dir=episode_dir,
-                                            root_dir=results_root)
-                    try:
-                        game_master = self.create_game_master(experiment_config, dialogue_pair)
-                        game_master.setup(**game_instance)
-                        game_master.play()
-                        game_master.store_records(results_root, dialogue_pair_desc, episode_dir)
-                    except Exception:  # continue with other episodes if something goes wrong
-                        self.logger.exception(f"{self.name}: Exception for episode {game_id} (but continue)")
-                        error_count += 1
-                    episode_counter += 1
+                # episode numbering is fixed upfront so that it does not depend on the order of completion
+                episodes = [(episode_counter, f"{experiment_record_dir}/episode_{episode_counter}", game_instance)
+                            for episode_counter, game_instance in enumerate(game_instances)]
+                if resume:
+                    episodes = [(episode_counter, episode_dir, game_instance)
+                                for episode_counter, episode_dir, game_instance in episodes
+                                if not self.is_episode_complete(results_root, dialogue_pair_desc, episode_dir)]
+                    stdout_logger.info(f"Resume: {len(game_instances) - len(episodes)} of {len(game_instances)} "
+                                       f"episodes already completed")
+                if workers > 1:
+                    with ThreadPoolExecutor(max_workers=workers) as executor:
+                        futures = [executor.submit(self._play_episode, experiment_config, dialogue_pair,
+                                                   dialogue_pair_desc, episode_counter, episode_dir,
+                                                   game_instance, results_root)
+                                   for episode_counter, episode_dir, game_instance in episodes]
+                        for future in tqdm(as_completed(futures), total=len(futures), desc="Playing games"):
+                            if not future.result():
+                                error_count += 1
+                else:
+                    for episode_counter, episode_dir, game_instance in tqdm(episodes, desc="Playing games"):
+                        if not self._play_episode(experiment_config, dialogue_pair, dialogue_pair_desc,
+                                                  episode_counter, episode_dir, game_instance, results_root):
+                            error_count += 1
                 if error_count > 0:
                     stdout_logger.error(
                         f"{self.name}: '{error_count}' exceptions occurred: See clembench.log for details.")
@@ -850,6 +1225,47 @@ class GameBenchmark(GameResourceLocator):
                                         sub_dir=experiment_record_dir,
                                         root_dir=results_root)
 
+    def is_episode_complete(self, results_root: str, dialogue_pair_desc: str, episode_dir: str) -> bool:
+        """
+        An episode is complete, when its records (interactions.json and requests.json) have been fully stored.
+        :return: True, if both records exist and can be loaded
+        """
+        for record_name in ["interactions", "requests"]:
+            try:
+                self.load_results_json(f"{episode_dir}/{record_name}", results_root, dialogue_pair_desc)
+            except (FileNotFoundError, ValueError):  # not stored or only partially written
+                return False
+        return True
+
+    def _play_episode(self, experiment_config: Dict, dialogue_pair: List[Model], dialogue_pair_desc: str,
+                      episode_counter: int, episode_dir: str, game_instance: Dict, results_root: str) -> bool:
+        """
+        Play and record a single episode. Exceptions are logged, but not raised, so that other episodes continue.
+        :return: True, if the episode was played without exception
+        """
+        game_id = game_instance["game_id"]
+        game_master = None
+        self.logger.info("Activity: %s Experiment: %s Episode: %d Game: %s",
+                         self.name, experiment_config["name"], episode_counter, game_id)
+        self.store_results_file(game_instance,
+                                f"instance.json",
+                                dialogue_pair_desc,
+                                sub_dir=episode_dir,
+                                root_dir=results_root)
+        try:
+            game_master = self.create_game_master(experiment_config, dialogue_pair)
+            game_master.start_event_log(results_root, dialogue_pair_desc, episode_dir)
+            game_master.setup(**game_instance)
+            game_master.play()
+            game_master.store_records(results_root, dialogue_pair_desc, episode_dir)
+        except Exception:  # continue with other episodes if something goes wrong
+            self.logger.exception(f"{self.name}: Exception for episode {game_id} (but continue)")
+            return False
+        finally:
+            if game_master is not None:
+                game_master.stop_event_log()  # keeps the partial log of failed episodes for inspection
+        return True
+
     def is_single_player(self) -> bool:
         """
         Decide if only a single cLLM is part of the interaction.
@@ -926,6 +1342,7 @@ class GameInstanceGenerator(GameResourceLocator):
 
 
 def load_benchmarks(do_setup: bool = True) -> List[GameBenchmark]:
+    clemgame.load_game_modules()
     game_benchmarks = []
     for gb_cls in GameBenchmark.__subclasses__():
         gb = gb_cls()  # subclasses should only get the model_name
@@ -945,6 +1362,15 @@ def load_benchmark(game_name: str, do_setup: bool = True, instances_name: str =
 
 
 def find_benchmark(game_name: str):
+    # usually the game is located in the directory of the same name: then only its module is imported
+    if game_name in clemgame.game_directories():
+        game_module = clemgame.load_game_module(game_name)
+        for gb_cls in GameBenchmark.__subclasses__():
+            if game_module is not None and gb_cls.__module__ == game_module.__name__:
+                gb = gb_cls()
+                if gb.applies_to(game_name):
+                    return gb
+    clemgame.load_game_modules()
     for gb_cls in GameBenchmark.__subclasses__():
         gb = gb_cls()  # subclasses should only get the dialog_pair
         if gb.applies_to(game_name):
@@ -100,8 +100,8 @@ def store_file(data, file_name: str, dir_path: str, sub_dir: str = None, do_over
     if sub_dir:
         dir_path = os.path.join(dir_path, sub_dir)
 
-    if not os.path.exists(dir_path):
-        os.makedirs(dir_path)
+    # episodes might be stored concurrently
+    os.makedirs(dir_path, exist_ok=True)
 
     fp = os.path.join(dir_path, file_name)
     if not do_overwrite:
@@ -1,3 +1,4 @@
+import hashlib
 import json
 import os
 from string import Template
@@ -100,12 +101,24 @@ def _get_class_name(event):
         return "gm-gm"
 
 
+def renderer_version() -> str:
+    """
+    A fingerprint of the transcript rendering: When it changes, then all transcripts are built again.
+    """
+    sha = hashlib.sha256()
+    with open(__file__, "rb") as f:
+        sha.update(f.read())
+    sha.update(CSS_STRING.encode("utf-8"))
+    sha.update(os.environ.get("IMAGE_ROOT", project_root).encode("utf-8"))  # image paths are resolved on rendering
+    return sha.hexdigest()
+
+
 def build_transcript(interactions: Dict, experiment_config: Dict, game_instance: Dict, dialogue_pair: str):
     """Create an html with the interaction transcript."""
-    transcript = HTML_HEADER.format(CSS_STRING)
+    transcript = [HTML_HEADER.format(CSS_STRING)]
     title = f"Interaction Transcript for {experiment_config['name']}, " \
             f"episode {game_instance['game_id']} with {dialogue_pair}."
-    transcript += top_info.format(title)
+    transcript.append(top_info.format(title))
     # Collect all events over all turns (ignore turn boundaries here)
     events = [event for turn in interactions['turns'] for event in turn]
     for event in events:
@@ -126,28 +139,28 @@ def build_transcript(interactions: Dict, experiment_config: Dict, game_instance:
         # in case the content is a json with an image entry
         if isinstance(msg_content, dict):
             if "image" in msg_content:
-                transcript += f'<div speaker="{speaker}" class="msg {class_name}">\n'
-                transcript += f'  <p>{msg_raw}</p>\n'
+                transcript.append(f'<div speaker="{speaker}" class="msg {class_name}">\n')
+                transcript.append(f'  <p>{msg_raw}</p>\n')
                 for image_src in msg_content["image"]:
                     if not image_src.startswith("http"):  # take the web url as it is
                         if "IMAGE_ROOT" in os.environ:
                             image_src = os.path.join(os.environ["IMAGE_ROOT"], image_src)
                         else:
                             image_src = os.path.join(project_root, image_src)
-                    transcript += (f'  <a title="{image_src}">'
-                                   f'<img style="width:100%" src="{image_src}" alt="{image_src}" />'
-                                   f'</a>\n')
-                transcript += '</div>\n'
+                    transcript.append(f'  <a title="{image_src}">'
+                                      f'<img style="width:100%" src="{image_src}" alt="{image_src}" />'
+                                      f'</a>\n')
+                transcript.append('</div>\n')
             else:
-                transcript += HTML_TEMPLATE.format(speaker, class_name, msg_raw)
+                transcript.append(HTML_TEMPLATE.format(speaker, class_name, msg_raw))
         else:
-            transcript += HTML_TEMPLATE.format(speaker, class_name, msg_raw)
-    transcript += HTML_FOOTER
-    return transcript
+            transcript.append(HTML_TEMPLATE.format(speaker, class_name, msg_raw))
+    transcript.append(HTML_FOOTER)
+    return "".join(transcript)
 
 
 def build_tex(interactions: Dict):
-    tex = TEX_HEADER
+    tex = [TEX_HEADER]
     # Collect all events over all turns (ignore turn boundaries here)
     events = [event for turn in interactions['turns'] for event in turn]
     for event in events:
@@ -156,12 +169,12 @@ def build_tex(interactions: Dict):
         if isinstance(msg_content, str):
             msg_content = msg_content.replace('\n', '\\\\ \\tt ')
         rgb, speakers, cols_init, cols_end, ncols, width = TEX_BUBBLE_PARAMS[class_name]
-        tex += TEX_TEMPLATE.substitute(cols_init=cols_init,
-                                       rgb=rgb,
-                                       speakers=speakers,
-                                       msg=msg_content,
-                                       cols_end=cols_end,
-                                       ncols=ncols,
-                                       width=width)
-    tex += TEX_FOOTER
-    return tex
+        tex.append(TEX_TEMPLATE.substitute(cols_init=cols_init,
+                                           rgb=rgb,
+                                           speakers=speakers,
+                                           msg=msg_content,
+                                           cols_end=cols_end,
+                                           ncols=ncols,
+                                           width=width))
+    tex.append(TEX_FOOTER)
+    return "".join(tex)
@@ -96,8 +96,11 @@ if __name__ == '__main__':
     args = parser.parse_args()
 
     # Get all episode scores as a pandas dataframe
-    scores = utils.load_scores(path=args.results_path)
-    df_episode_scores = utils.build_df_episode_scores(scores)
+    if utils.use_score_tables(args.results_path):
+        df_episode_scores = utils.load_score_table('episode', args.results_path)
+    else:
+        scores = utils.load_scores(path=args.results_path)
+        df_episode_scores = utils.build_df_episode_scores(scores)
 
     # Create the PLAYED variable, inferring it from ABORTED
     if clemmetrics.METRIC_PLAYED in df_episode_scores['metric'].unique():
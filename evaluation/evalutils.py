@@ -3,7 +3,11 @@ Auxiliary functions for plots and tables.
 """
 
 import os
+import shutil
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Iterable, Iterator
 
 import json
 import matplotlib.pyplot as plt
@@ -13,8 +17,16 @@ from tqdm import tqdm
 
 import clemgame.metrics as clemmetrics
 
+try:  # a faster json decoder, if available
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
 EVAL_DIR = 'results_eval'
 RESULTS_DIR = './results'
+SCORES_TABLE_DIR = 'scores_table'
+SCORES_MANIFEST = 'scores_manifest.json'  # written by each scoring run
+LOAD_WORKERS = 8
 SEP = '---'
 FLOAT_FORMAT = "%.2f"
 
@@ -126,48 +138,127 @@ def name_as_tuple(name: str) -> tuple:
 
 def load_json(path: str) -> dict:
     """Load a json file."""
-    with open(path, 'r') as file:
-        data = json.load(file)
+    with open(path, 'rb') as file:
+        data = json_loads(file.read())
     return data
 
 
-def load_scores(game_name: str = None, path: str = RESULTS_DIR) -> dict:
+def load_json_files(paths: Iterable, workers: int = LOAD_WORKERS) -> Iterator:
+    """Load json files with a thread pool and yield them in the given order."""
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for path in paths:
+            pending.append(executor.submit(load_json, path))
+            if len(pending) >= 4 * workers:  # bounded, for streaming consumers
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _matches(value: str, wanted: str) -> bool:
+    """Check if a directory name matches a filter (if given)."""
+    return wanted is None or value == wanted
+
+
+def _is_experiment_dir(path: str) -> bool:
+    """Experiment directories contain the experiment_<name>.json file."""
+    return any(name.startswith('experiment_') and name.endswith('.json')
+               for name in os.listdir(path))
+
+
+def find_episode_files(path: str, file_name: str, game_name: str = None,
+                       model: str = None,
+                       experiment: str = None) -> Iterator[Path]:
+    """Find a record file of all episodes below the given path.
+
+    The walk is pruned by the game, model (pair directory name or one of its
+    players) and experiment (with or without index prefix) when given.
+    """
+    stack = [path]
+    while stack:
+        dir_path = stack.pop()
+        sub_dirs = sorted(entry.path for entry in os.scandir(dir_path)
+                          if entry.is_dir() and entry.name != SCORES_TABLE_DIR)
+        if not any(_is_experiment_dir(sub_dir) for sub_dir in sub_dirs):
+            stack.extend(reversed(sub_dirs))
+            continue
+        # dir_path is a game directory of the model (pair) directory above
+        game_dir = Path(dir_path)
+        pair = game_dir.parent.name
+        if not _matches(game_dir.name, game_name):
+            continue
+        if model is not None and model not in [pair] + pair.split('--'):
+            continue
+        for experiment_dir in sub_dirs:
+            experiment_name = os.path.basename(experiment_dir)
+            if experiment is not None and experiment not in [
+                    experiment_name,
+                    '_'.join(experiment_name.split('_')[1:])]:
+                continue
+            for entry in sorted(os.scandir(experiment_dir),
+                                key=lambda entry: entry.name):
+                episode_file = Path(entry.path) / file_name
+                if entry.is_dir() and episode_file.is_file():
+                    yield episode_file
+
+
+def iter_scores(game_name: str = None, path: str = RESULTS_DIR,
+                model: str = None, experiment: str = None,
+                workers: int = LOAD_WORKERS) -> Iterator[tuple]:
+    """Yield the name tuple and the turn and episode scores of episodes."""
+    score_files = find_episode_files(path, 'scores.json', game_name,
+                                     model, experiment)
+    score_files = list(score_files)
+    names = [name_as_tuple(parse_directory_name(path)) for path in score_files]
+    for naming, data in zip(names, load_json_files(score_files, workers)):
+        yield naming, {'turns': data['turn scores'],
+                       'episodes': data['episode scores']}
+
+
+def load_scores(game_name: str = None, path: str = RESULTS_DIR,
+                model: str = None, experiment: str = None,
+                workers: int = LOAD_WORKERS) -> dict:
     """Get all turn and episodes scores and return them in a dictionary."""
-    # https://stackoverflow.com/a/18394205
-    score_files = list(Path(path).rglob("*scores.json"))
-    print(f'Loading {len(score_files)} JSON files.')
     scores = {}
-    for path in tqdm(score_files, desc="Loading scores"):
-        if game_name:
-            if game_name not in str(path):
-                continue
-        naming = name_as_tuple(parse_directory_name(path))
+    desc = "Loading scores"
+    for naming, data in tqdm(iter_scores(game_name, path, model, experiment,
+                                         workers), desc=desc):
         if naming not in scores:
-            data = load_json(path)
-            scores[naming] = {}
-            scores[naming]['turns'] = data['turn scores']
-            scores[naming]['episodes'] = data['episode scores']
+            scores[naming] = data
         else:
             print(f'Repeated file {naming}!')
     print(f'Retrieved {len(scores)} JSON files with scores.')
     return scores
 
 
-def load_interactions(game_name: str = None) -> dict:
+def iter_interactions(game_name: str = None, path: str = RESULTS_DIR,
+                      model: str = None, experiment: str = None,
+                      workers: int = LOAD_WORKERS) -> Iterator[tuple]:
+    """Yield the name tuple, interactions and instance of episodes."""
+    interaction_files = find_episode_files(path, 'interactions.json',
+                                           game_name, model, experiment)
+    interaction_files = list(interaction_files)
+    names = [name_as_tuple(parse_directory_name(path))
+             for path in interaction_files]
+    instance_files = [path.with_name('instance.json')
+                      for path in interaction_files]
+    records = load_json_files(interaction_files, workers)
+    instances = load_json_files(instance_files, workers)
+    for naming, data, instance in zip(names, records, instances):
+        yield naming, (data, instance)
+
+
+def load_interactions(game_name: str = None, path: str = RESULTS_DIR,
+                      model: str = None, experiment: str = None,
+                      workers: int = LOAD_WORKERS) -> dict:
     """Get all interaction records and return them in a dictionary."""
-    # https://stackoverflow.com/a/18394205
-    interaction_files = list(Path(RESULTS_DIR).rglob("*interactions.json"))
-    print(f'Loading {len(interaction_files)} JSON files.')
     interactions = {}
-    for path in tqdm(interaction_files, desc="Loading interactions"):
-        if game_name:
-            if game_name not in str(path):
-                continue
-        naming = name_as_tuple(parse_directory_name(path))
+    desc = "Loading interactions"
+    for naming, data in tqdm(iter_interactions(game_name, path, model,
+                                               experiment, workers),
+                             desc=desc):
         if naming not in interactions:
-            data = load_json(path)
-            instance = load_json(str(path).replace('interactions.json', 'instance.json'))
-            interactions[naming] = (data, instance)
+            interactions[naming] = data
         else:
             print(f'Repeated file {naming}!')
     print(f'Retrieved {len(interactions)} JSON files with interactions.')
@@ -203,32 +294,158 @@ def create_eval_tree(levels: list) -> None:
         create_eval_subdirs(episode_path)
 
 
-def build_df_turn_scores(scores: dict) -> pd.DataFrame:
+# columns that identify the results
+ID_COLUMNS = ['game', 'model', 'experiment', 'episode']
+
+
+def build_df(columns: dict, categorical: bool = False) -> pd.DataFrame:
+    """Create a dataframe from columnar lists; the scores become floats.
+
+    The game, model, experiment and metric columns become categoricals, when
+    categorical is True. This saves memory on large results, but groupby
+    then also lists unobserved categories unless observed=True is given.
+    """
+    df = pd.DataFrame(columns)
+    try:
+        df['value'] = df['value'].astype(float)
+    except (ValueError, TypeError):
+        pass  # non-numeric scores are kept as they are
+    if categorical:
+        for column in ['game', 'model', 'experiment', 'metric']:
+            df[column] = df[column].astype('category')
+    return df
+
+
+def build_df_turn_scores(scores: dict,
+                         categorical: bool = False) -> pd.DataFrame:
     """Create dataframe with all turn scores."""
-    cols = ['game', 'model', 'experiment', 'episode', 'turn', 'metric', 'value']
-    df_turn_scores = pd.DataFrame(columns=cols)
+    cols = ID_COLUMNS + ['turn', 'metric', 'value']
+    columns = {col: [] for col in cols}
     for name, data in tqdm(scores.items(), desc="Build turn scores dataframe"):
-        (game, model, experiment, episode) = name
         for turn, turn_data in data['turns'].items():
             for metric_name, metric_value in turn_data.items():
-                new_row = [game, model, experiment, episode, turn,
-                           metric_name, metric_value]
-                df_turn_scores.loc[len(df_turn_scores)] = new_row
-    return df_turn_scores
+                for col, value in zip(ID_COLUMNS, name):
+                    columns[col].append(value)
+                columns['turn'].append(turn)
+                columns['metric'].append(metric_name)
+                columns['value'].append(metric_value)
+    return build_df(columns, categorical)
 
 
-def build_df_episode_scores(scores: dict) -> pd.DataFrame:
+def build_df_episode_scores(scores: dict,
+                            categorical: bool = False) -> pd.DataFrame:
     """Create dataframe with all episode scores."""
-    cols = ['game', 'model', 'experiment', 'episode', 'metric', 'value']
-    df_episode_scores = pd.DataFrame(columns=cols)
+    cols = ID_COLUMNS + ['metric', 'value']
+    columns = {col: [] for col in cols}
     desc = "Build episode scores dataframe"
     for name, data in tqdm(scores.items(), desc=desc):
-        (game, model, experiment, episode) = name
         for metric_name, metric_value in data['episodes'].items():
-            new_row = [game, model, experiment, episode,
-                       metric_name, metric_value]
-            df_episode_scores.loc[len(df_episode_scores)] = new_row
-    return df_episode_scores
+            for col, value in zip(ID_COLUMNS, name):
+                columns[col].append(value)
+            columns['metric'].append(metric_name)
+            columns['value'].append(metric_value)
+    return build_df(columns, categorical)
+
+
+def score_table_path(path: str, level: str) -> Path:
+    """Path to the Parquet table of the turn or episode scores."""
+    return Path(path) / SCORES_TABLE_DIR / f'{level}_scores'
+
+
+def has_score_tables(path: str = RESULTS_DIR) -> bool:
+    """Check if the scores have been consolidated into Parquet tables."""
+    return all(score_table_path(path, level).exists()
+               for level in ['turn', 'episode'])
+
+
+def stale_score_tables(path: str = RESULTS_DIR) -> list:
+    """Get the games whose scores changed since they were consolidated.
+
+    A game is stale when the scores manifest of one of its model (pair)
+    directories is newer than the game's partitions of the tables, or when
+    it has scores.json files (e.g. without a manifest) but no partitions.
+    """
+    stale = set()
+    for game_dir in Path(path).glob('*/*/'):
+        if game_dir.parent.name == SCORES_TABLE_DIR:
+            continue
+        game = game_dir.name
+        partitions = [score_table_path(path, level) / f'game={game}'
+                      for level in ['turn', 'episode']]
+        partitions = [partition for partition in partitions
+                      if partition.exists()]
+        manifest = game_dir / SCORES_MANIFEST
+        if manifest.exists():
+            scored_at = manifest.stat().st_mtime
+            if not partitions or any(partition.stat().st_mtime < scored_at
+                                     for partition in partitions):
+                stale.add(game)
+        elif not partitions and next(game_dir.glob('*/*/scores.json'), None):
+            stale.add(game)
+    return sorted(stale)
+
+
+def use_score_tables(path: str = RESULTS_DIR) -> bool:
+    """Check if the Parquet tables hold the current scores of all games.
+
+    Prints which source of the scores is used.
+    """
+    if not has_score_tables(path):
+        print('No consolidated score tables, reading the scores.json files.')
+        return False
+    stale = stale_score_tables(path)
+    if stale:
+        print(f'The score tables are outdated for {", ".join(stale)} '
+              '(see cli.py consolidate), reading the scores.json files.')
+        return False
+    print(f'Reading the score tables in {Path(path) / SCORES_TABLE_DIR}.')
+    return True
+
+
+def consolidate_scores(path: str = RESULTS_DIR,
+                       game_name: str = None) -> None:
+    """Store all scores in Parquet tables partitioned by game.
+
+    When a game is given, then only its partition is replaced.
+    """
+    scores = load_scores(game_name, path)
+    dfs = {'turn': build_df_turn_scores(scores),
+           'episode': build_df_episode_scores(scores)}
+    for level, df in dfs.items():
+        table_path = score_table_path(path, level)
+        if game_name:
+            shutil.rmtree(table_path / f'game={game_name}', ignore_errors=True)
+        else:
+            shutil.rmtree(table_path, ignore_errors=True)
+        table_path.mkdir(parents=True, exist_ok=True)
+        if not df.empty:
+            df.to_parquet(table_path, partition_cols=['game'], index=False)
+    print(f'Consolidated scores into {Path(path) / SCORES_TABLE_DIR}.')
+
+
+def load_score_table(level: str, path: str = RESULTS_DIR,
+                     columns: list = None,
+                     game_name: str = None) -> pd.DataFrame:
+    """Read the turn or episode scores from the consolidated Parquet table.
+
+    Only the given columns (all by default) and the partition of the
+    given game (all by default) are read.
+    """
+    table_path = score_table_path(path, level)
+    filters = [('game', '==', game_name)] if game_name else None
+    df = pd.read_parquet(table_path, columns=columns, filters=filters)
+    if 'game' in df.columns:  # partitions are read as categoricals
+        df['game'] = df['game'].astype(str)
+    cols = ID_COLUMNS + (['turn'] if level == 'turn' else []) + ['metric', 'value']
+    return df[[col for col in cols if col in df.columns]]
+
+
+def episode_keys(*dfs: pd.DataFrame) -> list:
+    """Get the (game, model, experiment, episode) tuples of the scores."""
+    keys = set()
+    for df in dfs:
+        keys.update(df[ID_COLUMNS].itertuples(index=False, name=None))
+    return sorted(keys)
 
 
 def filter_df_by_key(df: pd.DataFrame, value_dict: dict) -> pd.DataFrame:
@@ -241,14 +458,14 @@ def filter_df_by_key(df: pd.DataFrame, value_dict: dict) -> pd.DataFrame:
 
 def save_raw_scores(df_turn_scores: pd.DataFrame,
                     df_episode_scores: pd.DataFrame,
-                    scores: dict) -> None:
+                    keys: list) -> None:
     """Create .csv files with all the scores"""
     name = create_file_name('', 'turn', 'tables', 'scores_raw', 'csv')
     df_turn_scores.to_csv(name)
     name = create_file_name('', 'episode', 'tables', 'scores_raw', 'csv')
     df_episode_scores.to_csv(name)
-    save_raw_episode_scores(scores.keys(), df_episode_scores)
-    save_raw_turn_scores(scores.keys(), df_turn_scores)
+    save_raw_episode_scores(keys, df_episode_scores)
+    save_raw_turn_scores(keys, df_turn_scores)
     print('Saved raw scores into .csv files.')
 
 
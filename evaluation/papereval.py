@@ -46,11 +46,15 @@ args = parser.parse_args()
 if args.no_plots:
     print('Only tables will be created, all plots skipped!')
 
-scores = utils.load_scores()
-utils.create_eval_tree(scores.keys())
-
-df_turn_scores = utils.build_df_turn_scores(scores)
-df_episode_scores = utils.build_df_episode_scores(scores)
+if utils.use_score_tables():
+    df_turn_scores = utils.load_score_table('turn')
+    df_episode_scores = utils.load_score_table('episode')
+else:
+    scores = utils.load_scores()
+    df_turn_scores = utils.build_df_turn_scores(scores)
+    df_episode_scores = utils.build_df_episode_scores(scores)
+episode_keys = utils.episode_keys(df_turn_scores, df_episode_scores)
+utils.create_eval_tree(episode_keys)
 
 # Create the PLAYED variable
 aux = df_episode_scores[df_episode_scores["metric"] == "Aborted"].copy()
@@ -61,13 +65,13 @@ df_episode_scores = pd.concat([df_episode_scores, aux], ignore_index=True)
 
 GAMES = df_turn_scores['game'].unique().tolist()
 MODELS = df_turn_scores['model'].unique().tolist()
-EXPERIMENTS = list(set([x[:3] for x in scores]))
-EPISODES = scores.keys()
+EXPERIMENTS = list(set([x[:3] for x in episode_keys]))
+EPISODES = episode_keys
 ZERO_ONE_EPISODE_SCORES = utils.get_metrics_in_zero_one(df_episode_scores)
 ZERO_ONE_TURN_SCORES = utils.get_metrics_in_zero_one(df_turn_scores)
 
 # Save tables with raw scores
-utils.save_raw_scores(df_turn_scores, df_episode_scores, scores)
+utils.save_raw_scores(df_turn_scores, df_episode_scores, episode_keys)
 
 for key, value in utils.short_names.items():
     df_turn_scores['model'] = df_turn_scores['model'].str.replace(key, value)
@@ -3,15 +3,13 @@ from typing import List, Dict, Tuple
 import re
 import os
 import json
-from queue import Queue
-from copy import deepcopy
 from time import sleep
 import numpy as np
 import matplotlib.pyplot as plt
 import imageio
-import shutil
 
 import games.mm_mapworld_specificroom.utils as utils
+from games.textmapworld.exploration import ExplorationGraph
 
 import clemgame.metrics as ms
 from backends import Model, CustomResponseModel
@@ -327,6 +325,7 @@ class MM_MapWorldScorer(GameScorer):
         self.nodes = instance_data["nodes"]
         self.edges = instance_data["edges"]
         self.start_node = instance_data["start"]
+        self.graph = ExplorationGraph.for_map(self.nodes, self.edges, moves_touch_visited=True)
         self.target = instance_data["target"]
         self.target_cat = game_instance['target_cat']
         self.cats = instance_data['cats']
@@ -334,46 +333,16 @@ class MM_MapWorldScorer(GameScorer):
         
         
     def adj(self, node):
-        return set([ed[1] for ed in self.edges if ed[0] == node])
+        return self.graph.adj(node)
     
     def visited_all(self, visited, to_visit):
         return all([n in visited for n in to_visit])
     
     def get_available_moves(self, node, visited):
-        return [edge for edge in self.edges if node == edge[0] and (edge[0] in visited or edge[1] in visited)]
+        return self.graph.get_available_moves(node, visited)
     
     def find_best_moves(self, current, visited):
-        to_visit = [ed[1] for ed in self.edges if ed[0] in visited and ed[1] not in visited]
-        start = [current]
-        q = Queue()
-        q.put(start)
-        found = set()
-        max_len = 100
-        while True:
-            if not q.qsize():
-                break
-            n = q.get()
-            if len(n) > max_len:
-                break
-            if self.visited_all(n, to_visit):
-                found.add((n[0], n[1]))
-                max_len = len(n)
-                continue
-            if len(n) == max_len:
-                continue
-            avail = self.get_available_moves(n[-1], visited)
-            if all([move[1] in n for move in avail]):
-                for move in avail:
-                    new = deepcopy(n)
-                    new.append(move[1])
-                    q.put(new)
-            else:
-                for move in avail:
-                    if not move[1] in n:
-                        new = deepcopy(n)
-                        new.append(move[1])
-                        q.put(new)
-        return found
+        return self.graph.find_best_moves(current, visited)
     
     def plot_path(self, path):
         offset = 0.05
@@ -513,31 +482,19 @@ class MM_MapWorldScorer(GameScorer):
             self.log_episode_score(BENCH_SCORE, find)     
 
         
-    def store_scores(self, results_root: str, dialogue_pair: str, game_record_dir: str):
-        self.store_results_file(self.scores, "scores.json",
-                                dialogue_pair=dialogue_pair,
-                                sub_dir=game_record_dir,
-                                root_dir=results_root)
-        
-        # plotting & animation
-        if not os.path.exists("tmp"):
-            os.makedirs("tmp")
+    def store_plots(self, results_root: str, dialogue_pair: str, game_record_dir: str):
+        episode_dir = os.path.join(results_root, dialogue_pair, self.name, game_record_dir)
         path_plot = self.plot_path(self.path)
-        path_plot.savefig(os.path.join(results_root, dialogue_pair, self.name, game_record_dir, "path.png"))
-        plt.close()
-        if not os.path.exists("tmp/step_plots"):
-            os.makedirs("tmp/step_plots")
+        path_plot.savefig(os.path.join(episode_dir, "path.png"))
+        plt.close(path_plot)
+        # render the animation frames in memory (parallel plot workers must not share a tmp directory)
         images = []
         for i in range(len(self.path)):
             step_plot = self.plot_path(self.path[:i+1])
-            step_plot.savefig(f"tmp/step_plots/{i}.png")
-            images.append(imageio.imread(f"tmp/step_plots/{i}.png"))
-            plt.close()
-        imageio.mimsave(os.path.join(results_root, dialogue_pair, self.name, game_record_dir, "animation.gif"), images, fps=1, loop=True)
-        try:
-            shutil.rmtree("tmp")
-        except OSError as e:
-            print("Error: %s - %s." % (e.filename, e.strerror))
+            step_plot.canvas.draw()
+            images.append(np.array(step_plot.canvas.buffer_rgba()))
+            plt.close(step_plot)
+        imageio.mimsave(os.path.join(episode_dir, "animation.gif"), images, fps=1, loop=True)
         
         
                 
@@ -551,6 +508,10 @@ class MmMapWorldBenchmark(GameBenchmark):
     def is_single_player(self):
         return False
 
+    # the plots are stored by the separate plots step (see cli.py plots)
+    def plot_files(self):
+        return ["path.png", "animation.gif"]
+
     # add a description of your game
     def get_description(self):
         return "In this game an agend is placed on a graph and needs to navigate through it by reasoning about past steps taken."
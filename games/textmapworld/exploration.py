@@ -0,0 +1,110 @@
+from functools import lru_cache
+from typing import Dict, List, Set, Tuple, Any, Iterable
+
+
+class ExplorationGraph:
+    """
+    Adjacency-indexed graph for scoring the exploration of a map (shared by the textmapworld and mm_mapworld
+    variants).
+
+    find_best_moves() computes the first moves of the shortest paths from the current node that cover all
+    unvisited neighbours of the visited nodes. Paths only return to a node of the path, when all neighbours of their
+    last node are already part of the path. The search runs breadth-first over the (last node, path nodes) states
+    of these paths, where the path nodes are kept as a bitmask, and the results are memoized.
+
+    Use for_map() to share the graph (and its memoized results) between the episodes that are played on the same map.
+    """
+
+    MAX_PATH_LENGTH = 100
+
+    def __init__(self, nodes: Iterable, edges: Iterable[Tuple[Any, Any]], moves_touch_visited: bool = False):
+        """
+        :param nodes: of the graph
+        :param edges: directed (a, b) tuples (add both directions for an undirected graph)
+        :param moves_touch_visited: when True, then paths can only take edges from or to a visited node
+                                    (the map is only known around the visited nodes)
+        """
+        self.moves_touch_visited = moves_touch_visited
+        self.adjacency: Dict[Any, List] = {node: [] for node in nodes}
+        for source, target in edges:
+            self.adjacency.setdefault(source, [])
+            self.adjacency.setdefault(target, [])
+            if target not in self.adjacency[source]:
+                self.adjacency[source].append(target)
+        self.bits = {node: 1 << idx for idx, node in enumerate(self.adjacency)}
+        self._best_moves: Dict[Tuple[Any, int], Set[Tuple]] = dict()
+
+    def adj(self, node) -> Set:
+        return set(self.adjacency.get(node, []))
+
+    @staticmethod
+    @lru_cache(maxsize=128)
+    def _for_map(nodes: Tuple, edges: Tuple, moves_touch_visited: bool) -> "ExplorationGraph":
+        return ExplorationGraph(nodes, edges, moves_touch_visited)
+
+    @staticmethod
+    def for_map(nodes: Iterable, edges: Iterable[Tuple[Any, Any]],
+                moves_touch_visited: bool = False) -> "ExplorationGraph":
+        """ The graph of a map, shared with the (recently) scored episodes on the same map """
+        return ExplorationGraph._for_map(tuple(nodes), tuple(tuple(edge) for edge in edges), moves_touch_visited)
+
+    def _targets(self, node, visited: Set) -> List:
+        if self.moves_touch_visited and node not in visited:
+            return [target for target in self.adjacency[node] if target in visited]
+        return self.adjacency[node]
+
+    def get_available_moves(self, node, visited: Set = None) -> List[Tuple]:
+        if node not in self.adjacency:
+            return []
+        targets = self._targets(node, visited) if visited is not None else self.adjacency[node]
+        return [(node, target) for target in targets]
+
+    def to_mask(self, nodes: Iterable) -> int:
+        mask = 0
+        for node in nodes:
+            mask |= self.bits.get(node, 0)
+        return mask
+
+    def find_best_moves(self, current, visited: Set) -> Set[Tuple]:
+        """
+        :param current: node
+        :param visited: nodes
+        :return: the (current, next node) moves that start a shortest path covering all unvisited neighbours
+                 of the visited nodes (or all moves, when there are none)
+        """
+        if current not in self.adjacency:
+            return set()
+        key = (current, self.to_mask(visited))
+        if key not in self._best_moves:
+            self._best_moves[key] = self._search_best_moves(current, visited)
+        return set(self._best_moves[key])
+
+    def _search_best_moves(self, current, visited: Set) -> Set[Tuple]:
+        to_visit = self.to_mask(target for node in visited for target in self.adjacency.get(node, [])
+                                if target not in visited)
+        start = (current, self.bits[current])
+        reached = {start}
+        # the first moves of the shortest paths that reach a state
+        layer: Dict[Tuple[Any, int], Set[Tuple]] = {start: set()}
+        for _ in range(self.MAX_PATH_LENGTH - 1):
+            next_layer: Dict[Tuple[Any, int], Set[Tuple]] = dict()
+            for (node, path_mask), first_moves in layer.items():
+                available = self._targets(node, visited)
+                targets = [target for target in available if not path_mask & self.bits[target]]
+                if not targets:  # all neighbours are already part of the path: go back
+                    targets = available
+                for target in targets:
+                    state = (target, path_mask | self.bits[target])
+                    if state in reached:  # reached by a shorter path before
+                        continue
+                    next_first_moves = next_layer.setdefault(state, set())
+                    next_first_moves.update(first_moves if first_moves else {(current, target)})
+            reached.update(next_layer)
+            found = set()
+            for (_, path_mask), first_moves in next_layer.items():
+                if path_mask & to_visit == to_visit:
+                    found.update(first_moves)
+            if found or not next_layer:
+                return found
+            layer = next_layer
+        return set()
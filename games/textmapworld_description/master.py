@@ -7,8 +7,7 @@ from backends import Model, CustomResponseModel
 from clemgame.clemgame import GameMaster, GameBenchmark, Player, DialogueGameMaster, GameScorer
 from clemgame.metrics import METRIC_ABORTED, METRIC_SUCCESS, METRIC_LOSE, BENCH_SCORE
 from games.textmapworld_description.utils import loop_identification, get_directions, string_available_directions, have_common_element, get_nextnode_label, count_word_in_sentence
-from queue import Queue
-from copy import deepcopy
+from games.textmapworld.exploration import ExplorationGraph
 from clemgame import get_logger
 from clemgame import file_utils, string_utils
 import random
@@ -283,48 +282,18 @@ class GraphGameScorer(GameScorer):
         new_edges = [(edge[1], edge[0]) for edge in old_edges]
         new_edges.extend(old_edges)
         self.edges = new_edges
+        self.graph = ExplorationGraph.for_map(self.nodes, self.edges)
         self.start = game_instance["Current_Position"] if self.game_type=="named_graph" else ast.literal_eval(game_instance["Current_Position"])
         
     
-    def visited_all(self, visited, to_visit):
-        return all([n in visited for n in to_visit])
-    
     def get_available_moves(self, node):
-        return [edge for edge in self.edges if node == edge[0]]
+        return self.graph.get_available_moves(node)
     
     def adj(self, node):
-        return set([ed[1] for ed in self.edges if ed[0] == node])
+        return self.graph.adj(node)
     
     def find_best_moves(self, current, visited):
-        
-        to_visit = [ed[1] for ed in self.edges if ed[0] in visited and ed[1] not in visited]
-        start = [current]
-        q = Queue()
-        q.put(start)
-        found = set()
-        max_len = 100
-        while True:
-            n = q.get()
-            if len(n) > max_len:
-                break
-            if self.visited_all(n, to_visit):
-                if len(n) > 1:
-                    found.add((n[0], n[1]))
-                    max_len = len(n)
-
-            avail = self.get_available_moves(n[-1])
-            if all([move[1] in n for move in avail]):
-                for move in avail:
-                    new = deepcopy(n)
-                    new.append(move[1])
-                    q.put(new)
-            else:
-                for move in avail:
-                    if not move[1] in n:
-                        new = deepcopy(n)
-                        new.append(move[1])
-                        q.put(new)
-        return found
+        return self.graph.find_best_moves(current, visited)
         
     def compute_scores(self, episode_interactions) -> None:
 
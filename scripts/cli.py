@@ -26,11 +26,17 @@ from clemgame import benchmark
     To score a specific game:
     $> python3 scripts/cli.py score -g privateshared
     
+    To store all scores in the Parquet tables read by the evaluation (also done by score):
+    $> python3 scripts/cli.py consolidate
+
     To score all games:
     $> python3 scripts/cli.py transcribe
     
     To score a specific game:
     $> python3 scripts/cli.py transcribe -g privateshared
+
+    To store the episode plots of the games that have some (e.g. mm_mapworld):
+    $> python3 scripts/cli.py plots -g mm_mapworld
 """
 
 
@@ -60,11 +66,24 @@ def main(args: argparse.Namespace):
                       gen_args=read_gen_args(args),
                       experiment_name=args.experiment_name,
                       instances_name=args.instances_name,
-                      results_dir=args.results_dir)
+                      results_dir=args.results_dir,
+                      workers=args.workers,
+                      use_cache=args.cache,
+                      resume=args.resume,
+                      model_pool_mb=args.model_pool_mb)
     if args.command_name == "score":
-        benchmark.score(args.game, experiment_name=args.experiment_name, results_dir=args.results_dir)
+        benchmark.score(args.game, experiment_name=args.experiment_name, results_dir=args.results_dir,
+                        workers=args.workers, force=args.force)
+        if args.consolidate:
+            benchmark.consolidate(args.game, results_dir=args.results_dir)
+    if args.command_name == "consolidate":
+        benchmark.consolidate(args.game, results_dir=args.results_dir)
     if args.command_name == "transcribe":
-        benchmark.transcripts(args.game, experiment_name=args.experiment_name, results_dir=args.results_dir)
+        benchmark.transcripts(args.game, experiment_name=args.experiment_name, results_dir=args.results_dir,
+                              workers=args.workers, force=args.force)
+    if args.command_name == "plots":
+        benchmark.plots(args.game, experiment_name=args.experiment_name, results_dir=args.results_dir,
+                        workers=args.workers, force=args.force)
 
 
 if __name__ == "__main__":
@@ -103,6 +122,20 @@ if __name__ == "__main__":
                             help="A relative or absolute path to the results root directory. "
                                  "For example '-r results/v1.5/de‘ or '-r /absolute/path/for/results'. "
                                  "When not specified, then the results will be located in './results'")
+    run_parser.add_argument("-w", "--workers", type=int, default=1,
+                            help="The number of episodes to play concurrently. "
+                                 "Useful for remote API backends; local models should keep the default. Default: 1.")
+    run_parser.add_argument("--cache", action=argparse.BooleanOptionalAction, default=False,
+                            help="Answer calls with temperature 0 from a persistent response cache (when possible) "
+                                 "and store new responses to it. The cache is located at '.cache/responses.sqlite'. "
+                                 "Default: --no-cache.")
+    run_parser.add_argument("--resume", action="store_true",
+                            help="Only play the episodes that have not been completed by a previous run "
+                                 "into the same results directory (e.g. after a crash).")
+    run_parser.add_argument("--model_pool_mb", type=float, default=0,
+                            help="The memory in megabytes for keeping loaded local models (e.g. huggingface), "
+                                 "so that experiments with other 'dialogue_partners' can reuse them later. "
+                                 "Models that are in use are always reused. Default: 0.")
 
     score_parser = sub_parsers.add_parser("score")
     score_parser.add_argument("-e", "--experiment_name", type=str,
@@ -113,6 +146,22 @@ if __name__ == "__main__":
                               help="A relative or absolute path to the results root directory. "
                                    "For example '-r results/v1.5/de‘ or '-r /absolute/path/for/results'. "
                                    "When not specified, then the results will be located in './results'")
+    score_parser.add_argument("-w", "--workers", type=int, default=1,
+                              help="The number of processes that score episodes in parallel. Default: 1.")
+    score_parser.add_argument("--force", action="store_true",
+                              help="Score all episodes again, even those whose interactions, instance and scoring "
+                                   "code did not change since they have been scored (see scores_manifest.json).")
+    score_parser.add_argument("--consolidate", action=argparse.BooleanOptionalAction, default=True,
+                              help="Afterwards, store all scores in the Parquet tables read by the evaluation "
+                                   "(see consolidate). Default: --consolidate.")
+
+    consolidate_parser = sub_parsers.add_parser("consolidate")
+    consolidate_parser.add_argument("-g", "--game", type=str,
+                                    help="A specific game name (see ls). Only its scores are replaced.",
+                                    default="all")
+    consolidate_parser.add_argument("-r", "--results_dir", type=str, default="results",
+                                    help="A relative or absolute path to the results root directory. "
+                                         "The tables are stored in its 'scores_table' sub-directory.")
 
     transcribe_parser = sub_parsers.add_parser("transcribe")
     transcribe_parser.add_argument("-e", "--experiment_name", type=str,
@@ -123,5 +172,26 @@ if __name__ == "__main__":
                                    help="A relative or absolute path to the results root directory. "
                                         "For example '-r results/v1.5/de‘ or '-r /absolute/path/for/results'. "
                                         "When not specified, then the results will be located in './results'")
+    transcribe_parser.add_argument("-w", "--workers", type=int, default=1,
+                                   help="The number of processes that build transcripts in parallel. Default: 1.")
+    transcribe_parser.add_argument("--force", action="store_true",
+                                   help="Build all transcripts again, even those whose interactions and instance "
+                                        "did not change since they have been built "
+                                        "(see transcripts_manifest.json).")
+
+    plots_parser = sub_parsers.add_parser("plots")
+    plots_parser.add_argument("-e", "--experiment_name", type=str,
+                              help="Optional argument to only run a specific experiment")
+    plots_parser.add_argument("-g", "--game", type=str,
+                              help="A specific game name (see ls).", default="all")
+    plots_parser.add_argument("-r", "--results_dir", type=str, default="results",
+                              help="A relative or absolute path to the results root directory. "
+                                   "For example '-r results/v1.5/de‘ or '-r /absolute/path/for/results'. "
+                                   "When not specified, then the results will be located in './results'")
+    plots_parser.add_argument("-w", "--workers", type=int, default=1,
+                              help="The number of processes that build plots in parallel. Default: 1.")
+    plots_parser.add_argument("--force", action="store_true",
+                              help="Build all plots again, even those whose interactions, instance and scoring "
+                                   "code did not change since they have been built (see plots_manifest.json).")
 
     main(parser.parse_args())
@@ -1,7 +1,18 @@
+import asyncio
 import unittest
 
-from backends import get_model_for, load_model_registry
-from backends.utils import ensure_alternating_roles
+from backends import get_model_for, load_model_registry, Model, ModelSpec, ModelPool, Backend
+from backends.utils import ensure_alternating_roles, ensure_messages_format
+
+
+class EchoModel(Model):
+
+    def __init__(self):
+        super().__init__(ModelSpec(model_name="echo"))
+
+    @ensure_messages_format
+    def generate_response(self, messages):
+        return messages, {}, messages[-1]["content"]
 
 
 class UtilsTestCase(unittest.TestCase):
@@ -98,6 +109,30 @@ class UtilsTestCase(unittest.TestCase):
                          )
 
 
+class AsyncTestCase(unittest.TestCase):
+
+    def test_agenerate_response_falls_back_to_generate_response(self):
+        messages = [
+            {"role": "user", "content": "Initial Prompt"},
+            {"role": "user", "content": "Turn 1"}
+        ]
+        _, _, response_text = asyncio.run(EchoModel().agenerate_response(messages))
+        self.assertEqual(response_text, "Initial Prompt\n\nTurn 1")
+
+    def test_ensure_messages_format_wraps_coroutine(self):
+        class AsyncEchoModel(EchoModel):
+            @ensure_messages_format
+            async def agenerate_response(self, messages):
+                return messages, {}, messages[-1]["content"]
+
+        messages = [
+            {"role": "system", "content": ""},
+            {"role": "user", "content": "Initial Prompt"}
+        ]
+        prompt, _, _ = asyncio.run(AsyncEchoModel().agenerate_response(messages))
+        self.assertEqual(prompt, [{"role": "user", "content": "Initial Prompt"}])
+
+
 class ModelTestCase(unittest.TestCase):
     def test_get_backend_for_model1(self):
         load_model_registry("test-registry.json")
@@ -115,5 +150,54 @@ class ModelTestCase(unittest.TestCase):
         assert model.model_spec.backend == "openai"
 
 
+class LoadedModel(EchoModel):
+
+    def memory_footprint(self) -> int:
+        return 1024 * 1024
+
+
+class LoadingBackend(Backend):
+    loads_weights = True
+
+    def __init__(self):
+        self.loaded = 0
+
+    def get_model_for(self, model_spec):
+        self.loaded += 1
+        return LoadedModel()
+
+
+class ModelPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = LoadingBackend()
+
+    def test_handles_share_the_loaded_model(self):
+        pool = ModelPool()
+        model_1 = pool.get(ModelSpec(model_name="a"), self.backend)
+        model_2 = pool.get(ModelSpec(model_name="a"), self.backend)
+        model_1.set_gen_args(temperature=0.0)
+        model_2.set_gen_args(temperature=1.0)
+        self.assertEqual(self.backend.loaded, 1)
+        self.assertEqual(model_1.get_temperature(), 0.0)
+
+    def test_unused_models_are_released_when_exceeding_the_budget(self):
+        pool = ModelPool(max_size_mb=1)
+        pool.get(ModelSpec(model_name="a"), self.backend)
+        pool.get(ModelSpec(model_name="b"), self.backend)
+        pool.get(ModelSpec(model_name="b"), self.backend)
+        self.assertEqual(self.backend.loaded, 2)
+        pool.get(ModelSpec(model_name="a"), self.backend)  # b's footprint is known and there is no handle left
+        pool.get(ModelSpec(model_name="b"), self.backend)
+        self.assertEqual(self.backend.loaded, 4)
+
+    def test_models_in_use_are_not_released(self):
+        pool = ModelPool(max_size_mb=0)
+        model_a = pool.get(ModelSpec(model_name="a"), self.backend)
+        pool.get(ModelSpec(model_name="b"), self.backend)
+        self.assertIs(pool.get(ModelSpec(model_name="a"), self.backend).model_spec, model_a.model_spec)
+        self.assertEqual(self.backend.loaded, 2)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,58 @@
+import json
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from evaluation.evalutils import stale_score_tables, score_table_path, SCORES_MANIFEST
+
+
+class StaleScoreTablesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.results_dir = tempfile.TemporaryDirectory()
+        self.path = self.results_dir.name
+
+    def tearDown(self):
+        self.results_dir.cleanup()
+
+    def store_scores(self, game, manifest=True, scored_at=100):
+        game_dir = Path(self.path) / "model-a--model-b" / game
+        episode_dir = game_dir / "0_exp" / "episode_0"
+        episode_dir.mkdir(parents=True)
+        (episode_dir / "scores.json").write_text(json.dumps({"turn scores": {}, "episode scores": {}}))
+        if manifest:
+            (game_dir / SCORES_MANIFEST).write_text("{}")
+            os.utime(game_dir / SCORES_MANIFEST, (scored_at, scored_at))
+
+    def store_partition(self, game, consolidated_at=200):
+        partition = score_table_path(self.path, "episode") / f"game={game}"
+        partition.mkdir(parents=True)
+        os.utime(partition, (consolidated_at, consolidated_at))
+
+    def test_consolidated_game_is_current(self):
+        self.store_scores("taboo")
+        self.store_partition("taboo")
+        self.assertEqual(stale_score_tables(self.path), [])
+
+    def test_scored_after_consolidation(self):
+        self.store_scores("taboo", scored_at=300)
+        self.store_partition("taboo")
+        self.assertEqual(stale_score_tables(self.path), ["taboo"])
+
+    def test_game_without_partition(self):
+        self.store_scores("taboo")
+        self.store_scores("wordle", manifest=False)  # e.g. scored before the manifests
+        self.store_scores("imagegame", manifest=False)
+        self.store_partition("imagegame")
+        self.store_partition("other")
+        self.assertEqual(stale_score_tables(self.path), ["taboo", "wordle"])
+
+    def test_game_without_scores(self):
+        episode_dir = Path(self.path) / "model-a--model-b" / "taboo" / "0_exp" / "episode_0"
+        episode_dir.mkdir(parents=True)
+        self.assertEqual(stale_score_tables(self.path), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+
+from games.textmapworld.exploration import ExplorationGraph
+
+
+def undirected(*edges):
+    return [edge for a, b in edges for edge in [(a, b), (b, a)]]
+
+
+LINE = undirected(("A", "B"), ("B", "C"), ("C", "D"))
+CYCLE = undirected(("A", "B"), ("B", "C"), ("C", "D"), ("D", "A"))
+# a cycle with the dead end E at A
+LOLLIPOP = CYCLE + undirected(("A", "E"))
+# the dead end E and the line B-C at A
+TEE = undirected(("A", "E"), ("A", "B"), ("B", "C"))
+
+
+class ExplorationGraphTestCase(unittest.TestCase):
+
+    def best_moves(self, edges, current, visited, moves_touch_visited=False):
+        nodes = sorted({node for edge in edges for node in edge})
+        graph = ExplorationGraph(nodes, edges, moves_touch_visited)
+        return graph.find_best_moves(current, set(visited))
+
+    def test_line(self):
+        self.assertEqual(self.best_moves(LINE, "B", {"A", "B"}), {("B", "C")})
+        # going back from the dead end A is shorter than going back from D
+        self.assertEqual(self.best_moves(LINE, "B", {"B"}), {("B", "A")})
+
+    def test_cycle(self):
+        self.assertEqual(self.best_moves(CYCLE, "A", {"A"}), {("A", "B"), ("A", "D")})
+        self.assertEqual(self.best_moves(CYCLE, "A", {"A", "B"}), {("A", "D")})
+        self.assertEqual(self.best_moves(CYCLE, "B", {"A", "B"}), {("B", "C")})
+
+    def test_dead_end_forces_backtracking(self):
+        # A-E-A-B is shorter than A-B-C-B-A-E (C must be visited before going back)
+        self.assertEqual(self.best_moves(TEE, "A", {"A"}), {("A", "E")})
+        # A-E-A-B-C-D, A-E-A-D-C-B, A-B-C-D-A-E and A-D-C-B-A-E are equally long
+        self.assertEqual(self.best_moves(LOLLIPOP, "A", {"A"}), {("A", "E"), ("A", "B"), ("A", "D")})
+        # E is left via A again
+        self.assertEqual(self.best_moves(LOLLIPOP, "E", {"A", "E"}), {("E", "A")})
+
+    def test_fully_explored_map(self):
+        self.assertEqual(self.best_moves(LINE, "B", {"A", "B", "C", "D"}), {("B", "A"), ("B", "C")})
+        self.assertEqual(self.best_moves(CYCLE, "C", {"A", "B", "C", "D"}), {("C", "B"), ("C", "D")})
+
+    def test_moves_touch_visited(self):
+        # C cannot be left towards the unknown D, so going back from C is as short as going back from A
+        self.assertEqual(self.best_moves(LINE, "B", {"B"}, moves_touch_visited=True), {("B", "A"), ("B", "C")})
+        # D can only be left towards the visited A: A-D-A-B-C is shorter than A-B-C-B-A-D
+        self.assertEqual(self.best_moves(CYCLE, "A", {"A", "B"}, moves_touch_visited=True), {("A", "D")})
+        # C can only be left towards the visited B: A-E-A-B-C is as short as A-B-C-B-A-E
+        self.assertEqual(self.best_moves(TEE, "A", {"A"}, moves_touch_visited=True), {("A", "E"), ("A", "B")})
+        self.assertEqual(ExplorationGraph(["A", "B", "C", "D"], LINE, moves_touch_visited=True)
+                         .get_available_moves("C", {"B"}), [("C", "B")])
+
+    def test_unknown_node(self):
+        self.assertEqual(self.best_moves(LINE, "X", {"A"}), set())
+
+    def test_results_are_memoized_copies(self):
+        graph = ExplorationGraph.for_map(["A", "B", "C", "D"], LINE)
+        best_moves = graph.find_best_moves("B", {"B"})
+        best_moves.add(("B", "C"))
+        self.assertEqual(graph.find_best_moves("B", {"B"}), {("B", "A")})
+        self.assertIs(ExplorationGraph.for_map(["A", "B", "C", "D"], LINE), graph)
+
+
+if __name__ == '__main__':
+    unittest.main()
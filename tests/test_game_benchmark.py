@@ -0,0 +1,246 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from backends import CustomResponseModel
+from clemgame.clemgame import GameBenchmark, GameMaster, GameScorer, Player
+
+PAIR = "model-a--model-b"
+GAME = "testgame"
+
+
+class CountingScorer(GameScorer):
+    """ Counts the scored episodes; fails for interactions with a 'fail' entry """
+
+    def __init__(self, scored_ids, experiment, game_instance):
+        super().__init__(GAME, experiment, game_instance)
+        self.scored_ids = scored_ids
+
+    def compute_scores(self, episode_interactions):
+        if episode_interactions.get("fail"):
+            raise ValueError("cannot score")
+        self.scored_ids.append(self.game_instance["game_id"])
+        self.log_episode_score("turns", len(episode_interactions["turns"]))
+
+
+class CountingBenchmark(GameBenchmark):
+
+    def __init__(self):
+        super().__init__(GAME)
+        self.version = "1"
+        self.scored_ids = []
+
+    def scorer_version(self):
+        return self.version
+
+    def create_game_scorer(self, experiment, game_instance):
+        return CountingScorer(self.scored_ids, experiment, game_instance)
+
+
+class ShoutingPlayer(Player):
+
+    def __init__(self, model, delays):
+        super().__init__(model)
+        self.delays = delays
+
+    def _custom_response(self, messages, turn_idx):
+        word = messages[-1]["content"]
+        time.sleep(self.delays.get(word, 0))
+        return word.upper()
+
+
+class ShoutingGameMaster(GameMaster):
+    """ A single turn in which the player repeats the word of the game instance """
+
+    def __init__(self, experiment, player_models, played_words, delays):
+        super().__init__(GAME, experiment, player_models)
+        self.player = ShoutingPlayer(player_models[0], delays)
+        self.played_words = played_words
+        self.word = None
+
+    def setup(self, word, **kwargs):
+        self.word = word
+        self.played_words.append(word)
+        self.log_players({"GM": "Game master", "Player 1": self.player.get_description()})
+
+    def play(self):
+        self.log_next_turn()
+        self.log_event("GM", "Player 1", {"type": "send message", "content": self.word})
+        prompt, response, response_text = self.player([{"role": "user", "content": self.word}], 0)
+        self.log_event("Player 1", "GM", {"type": "get message", "content": response_text},
+                       call=(prompt, response))
+
+
+class ShoutingBenchmark(GameBenchmark):
+
+    def __init__(self, words, delays=None):
+        """
+        :param delays: the seconds that the player needs to answer a word (none by default)
+        """
+        super().__init__(GAME)
+        self.instances = {"experiments": [{"name": "exp", "game_instances": [
+            {"game_id": 10 + idx, "word": word} for idx, word in enumerate(words)]}]}
+        self.delays = delays or {}
+        self.played_words = []
+
+    def create_game_master(self, experiment, player_models):
+        return ShoutingGameMaster(experiment, player_models, self.played_words, self.delays)
+
+
+WORDS = ["apple", "banana", "cherry"]
+
+
+class RunTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.results_dir = tempfile.TemporaryDirectory()
+        self.model = CustomResponseModel()
+        self.pair = f"{self.model.get_name()}-t0.0--{self.model.get_name()}-t0.0"
+
+    def tearDown(self):
+        self.results_dir.cleanup()
+
+    def episode_path(self, episode_counter, file_name=None):
+        path = os.path.join(self.results_dir.name, self.pair, GAME, "0_exp", f"episode_{episode_counter}")
+        return path if file_name is None else os.path.join(path, file_name)
+
+    def run_benchmark(self, delays=None, **kwargs):
+        benchmark = ShoutingBenchmark(WORDS, delays)
+        benchmark.run([self.model], self.results_dir.name, **kwargs)
+        return benchmark.played_words
+
+    def episode_dirs(self):
+        return sorted(os.listdir(os.path.dirname(self.episode_path(0))))
+
+    def assert_episode_records(self, episode_counter):
+        """ The episode directory holds the complete records of the game instance at its position """
+        with open(self.episode_path(episode_counter, "instance.json")) as f:
+            self.assertEqual(json.load(f), {"game_id": 10 + episode_counter, "word": WORDS[episode_counter]})
+        with open(self.episode_path(episode_counter, "interactions.json")) as f:
+            turn = json.load(f)["turns"][0]
+        self.assertEqual([event["action"]["content"] for event in turn],
+                         [WORDS[episode_counter], WORDS[episode_counter].upper()])
+        with open(self.episode_path(episode_counter, "requests.json")) as f:
+            requests = json.load(f)
+        self.assertEqual(len(requests), 1)
+        self.assertEqual(requests[0]["raw_response_obj"]["clem_player"]["response"], WORDS[episode_counter].upper())
+        self.assertFalse(os.path.exists(self.episode_path(episode_counter, "events.jsonl")))
+
+    def test_resume_skips_complete_episodes(self):
+        self.assertEqual(self.run_benchmark(), WORDS)
+        with open(self.episode_path(0, "interactions.json"), "rb") as f:
+            complete_interactions = f.read()
+        # the run stopped while playing the second episode: only the event log has been written
+        for file_name in ["interactions.json", "requests.json"]:
+            os.remove(self.episode_path(1, file_name))
+        with open(self.episode_path(1, "events.jsonl"), "w") as f:
+            f.write(json.dumps({"record": "next_turn"}) + "\n")
+        # the third episode was not played at all
+        for file_name in os.listdir(self.episode_path(2)):
+            os.remove(self.episode_path(2, file_name))
+
+        self.assertEqual(self.run_benchmark(resume=True), WORDS[1:])
+        with open(self.episode_path(0, "interactions.json"), "rb") as f:
+            self.assertEqual(f.read(), complete_interactions)
+        for episode_counter in range(len(WORDS)):
+            self.assert_episode_records(episode_counter)
+        self.assertEqual(self.run_benchmark(resume=True), [])
+
+    def test_resume_replays_partially_written_records(self):
+        self.run_benchmark()
+        with open(self.episode_path(1, "requests.json"), "r+") as f:
+            f.truncate(10)
+        self.assertEqual(self.run_benchmark(resume=True), WORDS[1:2])
+        self.assert_episode_records(1)
+
+    def test_concurrent_episodes_are_numbered_like_sequential_ones(self):
+        self.run_benchmark()
+        sequential_dirs = self.episode_dirs()
+        shutil.rmtree(os.path.join(self.results_dir.name, self.pair))
+        # the first episode finishes last
+        played_words = self.run_benchmark(delays={WORDS[0]: 0.2}, workers=2)
+        self.assertCountEqual(played_words, WORDS)
+        self.assertEqual(self.episode_dirs(), sequential_dirs)
+        self.assertEqual(sequential_dirs, ["episode_0", "episode_1", "episode_2", "experiment_exp.json"])
+        for episode_counter in range(len(WORDS)):
+            self.assert_episode_records(episode_counter)
+        self.assertEqual(self.run_benchmark(workers=2, resume=True), [])
+
+    def test_run_without_resume_replays_all_episodes(self):
+        self.run_benchmark()
+        self.assertEqual(self.run_benchmark(), WORDS)
+
+
+class ComputeScoresTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.results_dir = tempfile.TemporaryDirectory()
+        self.experiment_path = os.path.join(self.results_dir.name, PAIR, GAME, "0_exp")
+        self.store_json({"name": "exp"}, "experiment_exp.json")
+        for game_id in range(2):
+            self.store_episode(game_id, {"turns": [[]] * game_id})
+        self.benchmark = CountingBenchmark()
+
+    def tearDown(self):
+        self.results_dir.cleanup()
+
+    def store_json(self, data, rel_path):
+        path = os.path.join(self.experiment_path, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(data, f)
+
+    def store_episode(self, game_id, interactions):
+        self.store_json({"game_id": game_id}, f"episode_{game_id}/instance.json")
+        self.store_json(interactions, f"episode_{game_id}/interactions.json")
+
+    def score(self, force=False):
+        self.benchmark.scored_ids.clear()
+        self.benchmark.compute_scores(self.results_dir.name, force=force)
+        return sorted(self.benchmark.scored_ids)
+
+    def manifest(self):
+        with open(os.path.join(self.results_dir.name, PAIR, GAME, "scores_manifest.json")) as f:
+            return json.load(f)
+
+    def test_second_run_skips_episodes(self):
+        self.assertEqual(self.score(), [0, 1])
+        self.assertEqual(self.score(), [])
+        with open(os.path.join(self.experiment_path, "episode_1", "scores.json")) as f:
+            self.assertEqual(json.load(f)["episode scores"], {"turns": 1})
+
+    def test_edited_interactions_are_scored_again(self):
+        self.score()
+        self.store_episode(1, {"turns": [[], []]})
+        self.assertEqual(self.score(), [1])
+
+    def test_deleted_scores_are_scored_again(self):
+        self.score()
+        os.remove(os.path.join(self.experiment_path, "episode_0", "scores.json"))
+        self.assertEqual(self.score(), [0])
+
+    def test_changed_version_scores_all_episodes_again(self):
+        self.score()
+        self.benchmark.version = "2"
+        self.assertEqual(self.score(), [0, 1])
+        self.assertEqual(self.score(), [])
+
+    def test_force_scores_all_episodes_again(self):
+        self.score()
+        self.assertEqual(self.score(force=True), [0, 1])
+
+    def test_failed_episode_is_not_in_manifest(self):
+        self.store_episode(1, {"turns": [], "fail": True})
+        self.assertEqual(self.score(), [0])
+        self.assertEqual(list(self.manifest()), ["0_exp/episode_0"])
+        self.assertEqual(self.score(), [])  # the failed episode is tried again, but fails again
+        self.store_episode(1, {"turns": []})
+        self.assertEqual(self.score(), [1])
+        self.assertEqual(sorted(self.manifest()), ["0_exp/episode_0", "0_exp/episode_1"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import json
+import unittest
+
+from clemgame.clemgame import GameRecorder
+
+
+class GameRecorderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.recorder = GameRecorder("test")
+        self.recorder.log_next_turn()
+
+    def log_call(self, prompt):
+        self.recorder.log_event("GM", "Player 1", {"type": "get message", "content": ""}, call=(prompt, {}))
+
+    def test_requests_share_the_dialogue_history(self):
+        player_1 = [{"role": "user", "content": "Hello"}]
+        player_2 = [{"role": "system", "content": "Be nice"}, {"role": "user", "content": "Hi"}]
+        self.log_call(player_1)
+        self.log_call(player_2)
+        player_1 += [{"role": "assistant", "content": "Hi"}, {"role": "user", "content": "How are you?"}]
+        self.log_call(player_1)
+        player_2 += [{"role": "assistant", "content": "Hello"}]
+        self.log_call(player_2)
+        requests = self.recorder.requests
+        self.assertEqual(requests[2]["manipulated_prompt_prefix"], {"request": 0, "length": 1})
+        self.assertEqual(len(requests[2]["manipulated_prompt_obj"]), 2)
+        self.assertEqual(requests[3]["manipulated_prompt_prefix"], {"request": 1, "length": 2})
+        expanded = GameRecorder.expand_requests(json.loads(json.dumps(requests)))
+        self.assertEqual(expanded[2]["manipulated_prompt_obj"], player_1)
+        self.assertEqual(expanded[3]["manipulated_prompt_obj"], player_2)
+        self.assertNotIn("manipulated_prompt_prefix", expanded[3])
+
+    def test_changed_history_is_not_shared(self):
+        messages = [{"role": "user", "content": "Hello"}, {"role": "user", "content": "Again"}]
+        self.log_call(messages)
+        messages[0]["content"] = "Goodbye"  # the logged prompt must not change
+        self.log_call(messages)
+        self.assertNotIn("manipulated_prompt_prefix", self.recorder.requests[1])
+        expanded = GameRecorder.expand_requests(self.recorder.requests)
+        self.assertEqual(expanded[0]["manipulated_prompt_obj"][0]["content"], "Hello")
+        self.assertEqual(expanded[1]["manipulated_prompt_obj"], messages)
+
+    def test_rendered_prompt_inputs_are_shared(self):
+        self.log_call({"inputs": "<s>Hello", "max_new_tokens": 10})
+        self.log_call({"inputs": "<s>Hello</s>How are you?", "max_new_tokens": 10})
+        self.assertEqual(self.recorder.requests[1]["manipulated_prompt_prefix"],
+                         {"request": 0, "length": 8, "field": "inputs"})
+        self.assertEqual(self.recorder.requests[1]["manipulated_prompt_obj"]["inputs"], "</s>How are you?")
+        expanded = GameRecorder.expand_requests(self.recorder.requests)
+        self.assertEqual(expanded[1]["manipulated_prompt_obj"],
+                         {"inputs": "<s>Hello</s>How are you?", "max_new_tokens": 10})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,16 @@
+import threading
+import types
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+from tokenizers import Tokenizer, models, pre_tokenizers
+from transformers import PreTrainedTokenizerFast, DynamicCache
 
 import backends
-from backends.huggingface_local_api import check_messages, check_context_limit
+from backends import huggingface_local_api
+from backends.huggingface_local_api import check_messages, check_context_limit, fast_check_context_limit, \
+    MessagesTokenCounter, BatchGenerator, PrefixCache
 
 MODEL_SPEC = backends.ModelSpec(**{
     "model_name": "Mistral-7B-Instruct-v0.1",
@@ -96,5 +105,190 @@ class HuggingfaceLocalTestCase(unittest.TestCase):
         when the full set of clemgames is run by others."""
 
 
+
+def word_tokenizer() -> PreTrainedTokenizerFast:
+    """ A tokenizer with a word for each token (so that the counts are exact) and a chat template """
+    words = "<unk> <s> [user] [assistant] [system] what is your favourite condiment ? lard ! do you have".split()
+    tokenizer = Tokenizer(models.WordLevel({word: idx for idx, word in enumerate(words)}, unk_token="<unk>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.WhitespaceSplit()
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=tokenizer, unk_token="<unk>", bos_token="<s>")
+    tokenizer.chat_template = ("{{ bos_token }}{% for message in messages %}"
+                               " [{{ message['role'] }}] {{ message['content'] }}{% endfor %}"
+                               "{% if add_generation_prompt %} [assistant]{% endif %}")
+    return tokenizer
+
+
+class MessagesTokenCounterTestCase(unittest.TestCase):
+    MESSAGES = [
+        {"role": "user", "content": "what is your favourite condiment ?"},
+        {"role": "assistant", "content": "lard !"},
+        {"role": "user", "content": "do you have lard ?"}
+    ]
+
+    def setUp(self):
+        self.tokenizer = word_tokenizer()
+
+    def prompt_size(self, messages):
+        return len(self.tokenizer.apply_chat_template(messages, add_generation_prompt=True, return_dict=False))
+
+    def test_count_equals_prompt_tokens(self):
+        token_counter = MessagesTokenCounter(self.tokenizer)
+        for end in range(1, len(self.MESSAGES) + 1):
+            self.assertEqual(token_counter.count(self.MESSAGES[:end]), self.prompt_size(self.MESSAGES[:end]))
+
+    def test_counted_contents_are_bounded(self):
+        token_counter = MessagesTokenCounter(self.tokenizer, max_size_mb=40 / (1024 * 1024))  # 40 characters
+        self.assertEqual(token_counter.count(self.MESSAGES), self.prompt_size(self.MESSAGES))
+        self.assertLessEqual(token_counter._size, 40)
+        self.assertNotIn(self.MESSAGES[0]["content"], token_counter._content_counts)
+        self.assertEqual(token_counter.count(self.MESSAGES), self.prompt_size(self.MESSAGES))
+
+    def test_fast_check_agrees_with_exact_count(self):
+        model_spec = backends.ModelSpec(model_name="word_model", backend="huggingface_local")
+        key = huggingface_local_api._tokenizer_key(model_spec)
+        huggingface_local_api._tokenizer_registry[key] = (self.tokenizer, None, 30)
+        try:
+            fits, tokens_used, tokens_left, context_size = fast_check_context_limit(self.MESSAGES, model_spec,
+                                                                                    max_new_tokens=10)
+        finally:
+            del huggingface_local_api._tokenizer_registry[key]
+            huggingface_local_api._token_counters.pop(key, None)
+        self.assertEqual(tokens_used, self.prompt_size(self.MESSAGES) + 10)
+        self.assertEqual((fits, tokens_left, context_size), (tokens_used <= 30, 30 - tokens_used, 30))
+
+
+
+EOS = 2
+PAD = 0
+
+
+class RecordingModel:
+    """
+    Records the inputs of generate() and continues each prompt with its first token times ten, the eos token and
+    filler tokens (like the padding of shorter outputs in a batch)
+    """
+
+    def __init__(self, error: Exception = None):
+        self.generation_config = types.SimpleNamespace(eos_token_id=EOS)
+        self.calls = []
+        self.error = error
+        self._lock = threading.Lock()
+
+    def generate(self, input_ids, attention_mask=None, **gen_kwargs):
+        with self._lock:
+            self.calls.append((input_ids.clone(), attention_mask.clone(), gen_kwargs))
+        if self.error is not None:
+            raise self.error
+        first_tokens = [row[mask.bool()][0].item() for row, mask in zip(input_ids, attention_mask)]
+        new_tokens = torch.tensor([[token * 10, EOS, 7, 7] for token in first_tokens])
+        return torch.cat([input_ids, new_tokens], dim=1)
+
+
+class BatchGeneratorTestCase(unittest.TestCase):
+
+    def generate_concurrently(self, generator, prompts, gen_kwargs=None):
+        gen_kwargs = gen_kwargs or [{"max_new_tokens": 4}] * len(prompts)
+        with ThreadPoolExecutor(len(prompts)) as executor:
+            futures = [executor.submit(generator.generate, torch.tensor(prompt), kwargs)
+                       for prompt, kwargs in zip(prompts, gen_kwargs)]
+            return [future.result(timeout=10) for future in futures]
+
+    def test_prompts_are_left_padded(self):
+        model = RecordingModel()
+        generator = BatchGenerator(model, pad_token_id=PAD, max_batch_size=2, max_batch_wait=5)
+        self.generate_concurrently(generator, [[5, 6], [3, 4, 5, 6]])
+        self.assertEqual(len(model.calls), 1)
+        input_ids, attention_mask, _ = model.calls[0]
+        rows = sorted(zip(input_ids.tolist(), attention_mask.tolist()))
+        self.assertEqual(rows, [([PAD, PAD, 5, 6], [0, 0, 1, 1]), ([3, 4, 5, 6], [1, 1, 1, 1])])
+
+    def test_outputs_are_cut_after_eos(self):
+        model = RecordingModel()
+        generator = BatchGenerator(model, pad_token_id=PAD, max_batch_size=2, max_batch_wait=5)
+        outputs = self.generate_concurrently(generator, [[5, 6], [3, 4, 5, 6]])
+        self.assertEqual([output.tolist() for output in outputs], [[[5, 6, 50, EOS]], [[3, 4, 5, 6, 30, EOS]]])
+
+    def test_batches_are_bounded_by_max_batch_size(self):
+        model = RecordingModel()
+        generator = BatchGenerator(model, pad_token_id=PAD, max_batch_size=2, max_batch_wait=0.2)
+        outputs = self.generate_concurrently(generator, [[1], [3], [4], [5], [6]])
+        self.assertEqual([output.tolist() for output in outputs],
+                         [[[token, token * 10, EOS]] for token in [1, 3, 4, 5, 6]])
+        self.assertEqual(sum(len(input_ids) for input_ids, _, _ in model.calls), 5)
+        self.assertTrue(all(len(input_ids) <= 2 for input_ids, _, _ in model.calls))
+
+    def test_gen_kwargs_are_batched_separately(self):
+        model = RecordingModel()
+        generator = BatchGenerator(model, pad_token_id=PAD, max_batch_size=2, max_batch_wait=0.2)
+        self.generate_concurrently(generator, [[1], [3]], [{"max_new_tokens": 4}, {"max_new_tokens": 8}])
+        self.assertEqual(sorted((len(input_ids), kwargs["max_new_tokens"]) for input_ids, _, kwargs in model.calls),
+                         [(1, 4), (1, 8)])
+
+    def test_error_reaches_all_callers(self):
+        model = RecordingModel(error=RuntimeError("out of memory"))
+        generator = BatchGenerator(model, pad_token_id=PAD, max_batch_size=2, max_batch_wait=5)
+        with ThreadPoolExecutor(2) as executor:
+            futures = [executor.submit(generator.generate, torch.tensor(prompt), {"max_new_tokens": 4})
+                       for prompt in [[1], [3, 4]]]
+            for future in futures:
+                with self.assertRaises(RuntimeError):
+                    future.result(timeout=10)
+        self.assertEqual(len(model.calls), 1)
+        # the generator is still usable afterwards
+        model.error = None
+        generator.max_batch_wait = 0
+        self.assertEqual(generator.generate(torch.tensor([5]), {"max_new_tokens": 4}).tolist(), [[5, 50, EOS]])
+
+
+
+def key_value_cache(length: int) -> DynamicCache:
+    """ A single layer cache of the given sequence length (16 bytes per token) """
+    past_key_values = DynamicCache()
+    states = torch.arange(length, dtype=torch.float32).reshape(1, 1, length, 1).repeat(1, 1, 1, 2)
+    past_key_values.update(states, states.clone(), 0)
+    return past_key_values
+
+
+class PrefixCacheTestCase(unittest.TestCase):
+
+    def test_longest_common_prefix_is_used(self):
+        prefix_cache = PrefixCache(max_size_mb=1)
+        prefix_cache.store(torch.tensor([1, 2, 3, 4]), key_value_cache(4))
+        prefix_cache.store(torch.tensor([1, 2, 9, 9, 9]), key_value_cache(5))
+        self.assertEqual(prefix_cache.lookup(torch.tensor([1, 2, 9, 9, 5, 6])).get_seq_length(), 4)
+        self.assertEqual(prefix_cache.lookup(torch.tensor([1, 2, 3, 5])).get_seq_length(), 3)
+        self.assertIsNone(prefix_cache.lookup(torch.tensor([7, 1, 2])))
+
+    def test_at_least_one_prompt_token_is_left(self):
+        prefix_cache = PrefixCache(max_size_mb=1)
+        prefix_cache.store(torch.tensor([1, 2, 3, 4]), key_value_cache(4))
+        self.assertEqual(prefix_cache.lookup(torch.tensor([1, 2, 3, 4])).get_seq_length(), 3)
+        self.assertEqual(prefix_cache.lookup(torch.tensor([1, 2])).get_seq_length(), 1)
+
+    def test_lookup_returns_a_copy(self):
+        prefix_cache = PrefixCache(max_size_mb=1)
+        prefix_cache.store(torch.tensor([1, 2, 3, 4]), key_value_cache(4))
+        prefix_cache.lookup(torch.tensor([1, 2, 5]))
+        self.assertEqual(prefix_cache.lookup(torch.tensor([1, 2, 3, 4, 5])).get_seq_length(), 4)
+
+    def test_extended_sequences_replace_their_prefixes(self):
+        prefix_cache = PrefixCache(max_size_mb=1)
+        prefix_cache.store(torch.tensor([1, 2]), key_value_cache(2))
+        prefix_cache.store(torch.tensor([1, 2, 3, 4, 5]), key_value_cache(4))  # the last token is not processed
+        self.assertEqual(list(prefix_cache._entries), [(1, 2, 3, 4)])
+        self.assertEqual(prefix_cache._size, 4 * 16)
+
+    def test_least_recently_used_caches_are_evicted(self):
+        prefix_cache = PrefixCache(max_size_mb=8 * 16 / (1024 * 1024))  # two caches of four tokens
+        prefix_cache.store(torch.tensor([1, 1, 1, 1]), key_value_cache(4))
+        prefix_cache.store(torch.tensor([2, 2, 2, 2]), key_value_cache(4))
+        prefix_cache.lookup(torch.tensor([1, 1, 5]))
+        prefix_cache.store(torch.tensor([3, 3, 3, 3]), key_value_cache(4))
+        self.assertEqual(list(prefix_cache._entries), [(1, 1, 1, 1), (3, 3, 3, 3)])
+        self.assertEqual(prefix_cache._size, 8 * 16)
+        prefix_cache.store(torch.tensor(list(range(10))), key_value_cache(10))  # larger than the cache
+        self.assertEqual(len(prefix_cache._entries), 2)
+
+
 if __name__ == '__main__':
     unittest.main()
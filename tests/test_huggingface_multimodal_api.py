@@ -0,0 +1,110 @@
+import os
+import tempfile
+import unittest
+
+import torch
+from PIL import Image
+from transformers import BatchFeature
+
+from backends.huggingface_multimodal_api import HuggingfaceMultimodalModel, PixelCache, load_image
+
+
+class FakeTokenizer:
+
+    def __call__(self, text, return_tensors=None):
+        return BatchFeature({"input_ids": torch.tensor([[len(text)]])})
+
+
+class FakeImageProcessor:
+    """ The pixel values keep the image width, so that images of different widths cannot be stacked """
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, images, return_tensors=None):
+        self.calls += len(images)
+        return BatchFeature({"pixel_values": torch.stack([torch.ones(3, image.width) for image in images])})
+
+
+class FakeProcessor:
+
+    def __init__(self, extra_inputs: bool = False):
+        """
+        :param extra_inputs: whether the processor adds inputs to the tokenizer and image processor outputs
+        """
+        self.tokenizer = FakeTokenizer()
+        self.image_processor = FakeImageProcessor()
+        self.extra_inputs = extra_inputs
+        self.calls = 0
+
+    def __call__(self, text, images=None, return_tensors=None):
+        self.calls += 1
+        inputs = dict(self.tokenizer(text))
+        width = max(image.width for image in images)  # pads the images
+        inputs["pixel_values"] = torch.stack([torch.ones(3, width) for _ in images])
+        if self.extra_inputs:
+            inputs["image_sizes"] = torch.tensor([[image.width, image.height] for image in images])
+        return BatchFeature(inputs)
+
+
+def fake_model(processor: FakeProcessor) -> HuggingfaceMultimodalModel:
+    """ A model with the given processor (and without loading any weights) """
+    model = HuggingfaceMultimodalModel.__new__(HuggingfaceMultimodalModel)
+    model.model_name = "fake"
+    model.device = "cpu"
+    model.processor = processor
+    model.pixel_cache = PixelCache(max_size_mb=1)
+    model.combines_inputs = None
+    return model
+
+
+class PixelCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.image_dir = tempfile.TemporaryDirectory()
+        self.small_images = [self.store_image(f"small{idx}.png", 8) for idx in range(2)]
+        self.large_image = self.store_image("large.png", 16)
+
+    def tearDown(self):
+        self.image_dir.cleanup()
+
+    def store_image(self, name, width):
+        path = os.path.join(self.image_dir.name, name)
+        Image.new("RGB", (width, 4)).save(path)
+        return path
+
+    def test_cached_inputs_equal_processor_inputs(self):
+        model = fake_model(FakeProcessor())
+        inputs = model.get_image_inputs("prompt", self.small_images)
+        self.assertTrue(model.combines_inputs)
+        expected = model.processor("prompt", images=[load_image(image) for image in self.small_images])
+        self.assertEqual(inputs.keys(), expected.keys())
+        self.assertTrue(all(torch.equal(inputs[name], expected[name]) for name in inputs))
+
+    def test_images_are_processed_once(self):
+        model = fake_model(FakeProcessor())
+        model.get_image_inputs("turn 1", self.small_images[:1])
+        model.get_image_inputs("turn 2", self.small_images)
+        model.get_image_inputs("turn 3", self.small_images)
+        self.assertEqual(model.processor.image_processor.calls, 2)
+        self.assertEqual(model.processor.calls, 1)  # the check with the first images
+
+    def test_unstackable_first_images_keep_the_check_open(self):
+        model = fake_model(FakeProcessor())
+        model.get_image_inputs("turn 1", [self.small_images[0], self.large_image])
+        self.assertIsNone(model.combines_inputs)
+        model.get_image_inputs("turn 2", self.small_images)
+        self.assertTrue(model.combines_inputs)
+
+    def test_processor_with_other_inputs_is_not_cached(self):
+        model = fake_model(FakeProcessor(extra_inputs=True))
+        inputs = model.get_image_inputs("turn 1", self.small_images)
+        self.assertFalse(model.combines_inputs)
+        self.assertIn("image_sizes", inputs)
+        model.get_image_inputs("turn 2", self.small_images)
+        self.assertEqual(model.processor.image_processor.calls, 2)  # only for the check
+        self.assertEqual(model.processor.calls, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import base64
+import os
+import shutil
+import tempfile
+import unittest
+
+from backends.image_cache import ImageCache
+
+IMAGE = "games/cloudgame/resources/images/3.jpg"
+
+
+class ImageCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.image_dir = tempfile.TemporaryDirectory()
+        self.uploads = []
+
+    def tearDown(self):
+        self.image_dir.cleanup()
+
+    def copy_image(self, name):
+        path = os.path.join(self.image_dir.name, name)
+        shutil.copy(IMAGE, path)
+        return path
+
+    def upload_file(self, file_path, mime_type):
+        self.uploads.append(file_path)
+        return f"handle {len(self.uploads)}"
+
+    def test_encoded_image_is_cached(self):
+        image_cache = ImageCache()
+        with open(IMAGE, "rb") as f:
+            expected = base64.b64encode(f.read()).decode("utf-8")
+        self.assertEqual(image_cache.encode_base64(IMAGE), (expected, "image/jpeg"))
+        self.assertIs(image_cache.encode_base64(IMAGE)[0], image_cache.encode_base64(IMAGE)[0])
+
+    def test_modified_image_is_encoded_again(self):
+        image_cache = ImageCache()
+        path = self.copy_image("image.jpg")
+        image_data, _ = image_cache.encode_base64(path)
+        with open(path, "ab") as f:
+            f.write(b"modified")
+        self.assertNotEqual(image_cache.encode_base64(path)[0], image_data)
+
+    def test_same_content_is_uploaded_once(self):
+        image_cache = ImageCache()
+        handle = image_cache.upload(self.copy_image("a.jpg"), "provider", self.upload_file)
+        self.assertEqual(image_cache.upload(self.copy_image("b.jpg"), "provider", self.upload_file), handle)
+        self.assertEqual(len(self.uploads), 1)
+        image_cache.upload(IMAGE, "other provider", self.upload_file)
+        self.assertEqual(len(self.uploads), 2)
+
+    def test_expired_upload_is_uploaded_again(self):
+        image_cache = ImageCache(upload_ttl=0)
+        image_cache.upload(IMAGE, "provider", self.upload_file)
+        image_cache.upload(IMAGE, "provider", self.upload_file)
+        self.assertEqual(len(self.uploads), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import asyncio
+import time
+import unittest
+
+from backends import Model, ModelSpec
+from backends.rate_limit import RateLimiter, TokenBucket, configure_rate_limit, rate_limited, arate_limited, \
+    get_rate_limiter, retry_after_seconds
+
+
+class RateLimitError(Exception):
+
+    def __init__(self, headers):
+        super().__init__("rate limited")
+        self.status_code = 429
+        self.response = type("Response", (), {"headers": headers})()
+
+
+class FlakyModel(Model):
+
+    def __init__(self, errors, model_spec=None):
+        super().__init__(model_spec or ModelSpec(model_name="flaky", backend="test_rate_limit"))
+        self.errors = list(errors)
+        self.calls = 0
+
+    def _call(self, messages):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return messages, {}, "response"
+
+    @rate_limited(tries=3)
+    def generate_response(self, messages):
+        return self._call(messages)
+
+    @arate_limited(tries=3)
+    async def agenerate_response(self, messages):
+        return self._call(messages)
+
+
+class SyncFallbackModel(FlakyModel):
+    """ Like the remote backends without an async client: agenerate_response() runs generate_response() """
+
+    @arate_limited(tries=3)
+    async def agenerate_response(self, messages):
+        return await Model.agenerate_response(self, messages)
+
+
+MESSAGES = [{"role": "user", "content": "Hello"}]
+
+
+class RateLimitTestCase(unittest.TestCase):
+
+    def setUp(self):
+        configure_rate_limit("test_rate_limit")
+
+    def test_token_bucket_waits_when_empty(self):
+        bucket = TokenBucket(per_minute=60)
+        now = time.monotonic()
+        self.assertEqual(bucket.reserve(60, now), 0)
+        self.assertAlmostEqual(bucket.reserve(2, now), 2)
+        self.assertAlmostEqual(bucket.reserve(1, now + 1), 2)
+
+    def test_retry_after_headers(self):
+        self.assertEqual(retry_after_seconds(RateLimitError({"retry-after": "3"})), 3)
+        self.assertEqual(retry_after_seconds(RateLimitError({"retry-after-ms": "250"})), 0.25)
+        self.assertEqual(retry_after_seconds(RateLimitError({"x-ratelimit-reset-requests": "1s",
+                                                             "x-ratelimit-reset-tokens": "6m0s"})), 360)
+        self.assertIsNone(retry_after_seconds(ValueError()))
+
+    def test_rate_limit_error_pauses_the_backend(self):
+        limiter = RateLimiter()
+        limiter.backoff(RateLimitError({"retry-after": "2"}), attempt=1)
+        self.assertGreaterEqual(limiter.reserve(tokens=1), 1.9)
+
+    def test_retries_until_success(self):
+        model = FlakyModel([RateLimitError({"retry-after-ms": "1"})] * 2)
+        self.assertEqual(model.generate_response(MESSAGES)[2], "response")
+        self.assertEqual(model.calls, 3)
+
+    def test_raises_after_last_try(self):
+        configure_rate_limit("test_rate_limit", {"max_tries": 2})
+        model = FlakyModel([RateLimitError({"retry-after-ms": "1"})] * 2)
+        with self.assertRaises(RateLimitError):
+            model.generate_response(MESSAGES)
+        self.assertEqual(model.calls, 2)
+
+    def test_async_retries_until_success(self):
+        model = FlakyModel([RateLimitError({"retry-after-ms": "1"})])
+        self.assertEqual(asyncio.run(model.agenerate_response(MESSAGES))[2], "response")
+        self.assertEqual(model.calls, 2)
+
+    def test_async_fallback_to_sync_call_is_limited_once(self):
+        configure_rate_limit("test_rate_limit", {"max_concurrent": 1, "requests_per_minute": 60})
+        model = SyncFallbackModel([RateLimitError({"retry-after-ms": "1"})] * 3)
+        with self.assertRaises(RateLimitError):
+            asyncio.run(asyncio.wait_for(model.agenerate_response(MESSAGES), timeout=10))
+        self.assertEqual(model.calls, 3)  # not 3x3 nested retries
+        self.assertEqual(asyncio.run(asyncio.wait_for(model.agenerate_response(MESSAGES), timeout=10))[2], "response")
+        self.assertEqual(get_rate_limiter(model.model_spec)._running, 0)
+        self.assertEqual(model.generate_response(MESSAGES)[2], "response")
+
+    def test_model_rate_limit_from_registry_entry(self):
+        model_spec = ModelSpec(model_name="limited", backend="test_rate_limit", rate_limit={"requests_per_minute": 60})
+        limiter = get_rate_limiter(model_spec)
+        self.assertEqual(limiter.requests.capacity, 60)
+        self.assertIsNot(limiter, get_rate_limiter(ModelSpec(model_name="other", backend="test_rate_limit")))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import os
+import tempfile
+import unittest
+
+from backends import Model, ModelSpec, cache
+from clemgame.clemgame import Player
+
+
+class CountingModel(Model):
+
+    def __init__(self, temperature: float = 0.0):
+        super().__init__(ModelSpec(model_name="counting"))
+        self.set_gen_args(temperature=temperature, max_tokens=100)
+        self.calls = 0
+
+    def generate_response(self, messages):
+        self.calls += 1
+        return messages, {"calls": self.calls}, f"response {self.calls}"
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.cache_dir.name, "responses.sqlite")
+
+    def tearDown(self):
+        cache.disable_response_cache()
+        self.cache_dir.cleanup()
+
+    def test_deterministic_call_is_answered_from_cache(self):
+        cache.enable_response_cache(self.cache_path)
+        model = CountingModel()
+        messages = [{"role": "user", "content": "Hello"}]
+        first = cache.generate_response(model, messages)
+        second = cache.generate_response(model, messages)
+        self.assertEqual(model.calls, 1)
+        self.assertEqual(first[:3], second[:3])
+        self.assertFalse(first[3])
+        self.assertTrue(second[3])
+
+    def test_cache_persists_across_instances(self):
+        cache.enable_response_cache(self.cache_path)
+        messages = [{"role": "user", "content": "Hello"}]
+        cache.generate_response(CountingModel(), messages)
+        cache.enable_response_cache(self.cache_path)
+        model = CountingModel()
+        _, _, response_text, cached = cache.generate_response(model, messages)
+        self.assertEqual(model.calls, 0)
+        self.assertEqual(response_text, "response 1")
+        self.assertTrue(cached)
+
+    def test_sampling_call_is_not_cached(self):
+        cache.enable_response_cache(self.cache_path)
+        model = CountingModel(temperature=0.7)
+        messages = [{"role": "user", "content": "Hello"}]
+        cache.generate_response(model, messages)
+        self.assertFalse(cache.generate_response(model, messages)[3])
+        self.assertEqual(model.calls, 2)
+
+    def test_player_records_cached_responses(self):
+        cache.enable_response_cache(self.cache_path)
+        player = Player(CountingModel())
+        messages = [{"role": "user", "content": "Hello"}]
+        _, first, _ = player(messages, turn_idx=0)
+        _, second, response_text = player(messages, turn_idx=1)
+        self.assertEqual(response_text, "response 1")
+        self.assertFalse(first["clem_player"]["cached"])
+        self.assertTrue(second["clem_player"]["cached"])
+        self.assertEqual(second["calls"], 1)
+
+    def test_different_gen_args_are_different_keys(self):
+        messages = [{"role": "user", "content": "Hello"}]
+        model_a = CountingModel()
+        model_b = CountingModel()
+        model_b.set_gen_arg("max_tokens", 50)
+        self.assertNotEqual(cache.ResponseCache.key_for(model_a, messages),
+                            cache.ResponseCache.key_for(model_b, messages))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        response_cache = cache.ResponseCache(self.cache_path, max_size_mb=100 / (1024 * 1024))
+        response_cache.put("a", ([], {}, "x" * 30))
+        response_cache.put("b", ([], {}, "x" * 30))
+        response_cache.get("a")  # now "b" is the least recently used
+        response_cache.put("c", ([], {}, "x" * 30))
+        self.assertIsNotNone(response_cache.get("a"))
+        self.assertIsNone(response_cache.get("b"))
+        self.assertIsNotNone(response_cache.get("c"))
+        response_cache.close()
+
+
+if __name__ == '__main__':
+    unittest.main()